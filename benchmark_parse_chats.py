@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+import os
+import io
+import sys
+import json
+import time
+import resource
+import argparse
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from typing import Dict, List, Optional
+from generate_synthetic_export import generate_export
+from parse_chats import ChatParser
+
+
+# name -> (generate_export() arguments, ChatParser options); chat counts are multiplied by --scale
+CASES = {
+    'default': ({'chats': 500}, {}),
+    'tool_heavy': ({'chats': 250, 'tool_uses': 12, 'thinks': 0, 'texts': 1}, {}),
+    'long_messages': ({'chats': 100, 'message_lines': 200}, {}),
+    'streaming': ({'chats': 500}, {'streaming': True}),
+    'content_offsets': ({'chats': 500}, {'content_offsets': True}),
+    'compress_content': ({'chats': 500}, {'compress_content': True}),
+}
+
+# Metrics compared with the baseline, and whether higher values are better
+METRICS = {
+    'lines_per_sec': True,
+    'messages_per_sec': True,
+    'peak_rss_mb': False,
+    'db_size_bytes': False,
+    'commits': False,
+}
+
+
+def _run_case(md_path: str, db_path: str, parser_options: Dict) -> Dict:
+    """Parse md_path into a new database; runs in its own process so peak RSS is per case."""
+    commits = 0
+    
+    def count_commits(statement: str):
+        nonlocal commits
+        if statement.strip().upper() == 'COMMIT':
+            commits += 1
+    
+    parser = ChatParser(db_path, **parser_options)
+    parser.report_progress = False
+    parser.conn.set_trace_callback(count_commits)
+    start = time.perf_counter()
+    try:
+        with redirect_stdout(io.StringIO()):
+            parser.parse_file(md_path)
+    finally:
+        parser.close()
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    rss_divisor = 1024 * 1024 if sys.platform == 'darwin' else 1024
+    return {
+        'seconds': seconds,
+        'chats': parser.chat_count,
+        'messages': parser.message_count,
+        'commits': commits,
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / rss_divisor, 1),
+    }
+
+
+def run_benchmarks(case_names: List[str], scale: float = 1.0, repeat: int = 1) -> Dict[str, Dict]:
+    """Generate an export for each case, parse it and measure the parser.
+    
+    Each run parses into a fresh database in a fresh process; the fastest of
+    repeat runs is kept.
+    
+    Args:
+        case_names: Names of CASES to run
+        scale: Multiplier for the number of chats generated
+        repeat: Number of runs per case
+    
+    Returns:
+        Results by case name: lines, bytes, chats, messages, seconds,
+        lines_per_sec, messages_per_sec, peak_rss_mb, db_size_bytes, commits
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in case_names:
+            export_options, parser_options = CASES[name]
+            export_options = dict(export_options, chats=max(1, int(export_options['chats'] * scale)))
+            md_path = os.path.join(tmp_dir, f"{name}.md")
+            db_path = os.path.join(tmp_dir, f"{name}.db")
+            with open(md_path, 'w', encoding='utf-8') as f:
+                counts = generate_export(f, **export_options)
+            
+            best = None
+            for _ in range(repeat):
+                if os.path.exists(db_path):
+                    os.remove(db_path)
+                with ProcessPoolExecutor(max_workers=1) as pool:
+                    run = pool.submit(_run_case, md_path, db_path, parser_options).result()
+                run['db_size_bytes'] = os.path.getsize(db_path)
+                if best is None or run['seconds'] < best['seconds']:
+                    best = run
+            
+            result = {'lines': counts['lines'], 'bytes': counts['bytes'], **best}
+            result['lines_per_sec'] = round(counts['lines'] / best['seconds'])
+            result['messages_per_sec'] = round(best['messages'] / best['seconds'])
+            result['seconds'] = round(best['seconds'], 3)
+            results[name] = result
+            print(f"{name}: {result['lines']:,} lines, {result['messages']:,} messages in {result['seconds']}s "
+                  f"({result['lines_per_sec']:,} lines/s, {result['messages_per_sec']:,} messages/s), "
+                  f"peak RSS {result['peak_rss_mb']} MB, DB {result['db_size_bytes']:,} bytes, "
+                  f"{result['commits']} commits")
+            sys.stdout.flush()
+    return results
+
+
+def compare_to_baseline(results: Dict[str, Dict], baseline: Dict[str, Dict], tolerance: float) -> List[str]:
+    """Compare benchmark results to a baseline.
+    
+    Args:
+        results: Results of run_benchmarks()
+        baseline: Earlier results of run_benchmarks()
+        tolerance: Allowed relative change in the wrong direction, e.g. 0.2 for 20%
+    
+    Returns:
+        Descriptions of metrics that regressed beyond the tolerance
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            print(f"{name}: no baseline")
+            continue
+        for metric, higher_is_better in METRICS.items():
+            expected = baseline[name].get(metric)
+            if not expected:
+                continue
+            change = (result[metric] - expected) / expected
+            regressed = change < -tolerance if higher_is_better else change > tolerance
+            if regressed:
+                regressions.append(f"{name}: {metric} {result[metric]:,} vs baseline {expected:,} ({change:+.0%})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark parse_chats.py on synthetic exports and compare to a baseline')
+    parser.add_argument('--cases', nargs='+', choices=list(CASES), default=list(CASES), help='Cases to run (default: all)')
+    parser.add_argument('--scale', type=float, default=1.0, help='Multiplier for the number of chats per case (default: 1.0)')
+    parser.add_argument('--repeat', type=int, default=3, help='Runs per case, the fastest is kept (default: 3)')
+    parser.add_argument('--output', default=None, help='Write results as JSON to this file')
+    parser.add_argument('--baseline', default='benchmark_baseline.json', help='Baseline JSON to compare against (default: benchmark_baseline.json)')
+    parser.add_argument('--save-baseline', action='store_true', help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed relative regression per metric (default: 0.2)')
+    
+    args = parser.parse_args()
+    
+    results = run_benchmarks(args.cases, args.scale, max(1, args.repeat))
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+    
+    baseline: Optional[Dict] = None
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+    if baseline is None:
+        print(f"No baseline at {args.baseline}, run with --save-baseline to create one")
+        return
+    
+    regressions = compare_to_baseline(results, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regressions beyond {args.tolerance:.0%} of {args.baseline}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    print(f"\nNo regressions beyond {args.tolerance:.0%} of {args.baseline}")
+
+
+if __name__ == '__main__':
+    main()
@@ -4,6 +4,7 @@ import sys
 from typing import List, Dict, Optional, Tuple
 import numpy as np
 from embed_tasks import TaskEmbedder
+from task_builder import Task
 from dotenv import load_dotenv
 import os
 from llm_utils import tokens_to_chars, create_openai_client, load_api_config, DEFAULT_SUMMARY_PARAMS, get_llm_params, get_llm_context_limit_and_max_tokens
@@ -40,7 +41,7 @@ class TaskClusterer:
         )
         return len(formatted_prompt) + 1000
     
-    def load_embeddings_and_lengths(self) -> Tuple[Dict[int, np.ndarray], Dict[int, int], List[int], List[Dict]]:
+    def load_embeddings_and_lengths(self) -> Tuple[Dict[int, np.ndarray], Dict[int, int], List[int], List[Task]]:
         """Load embeddings, lengths, and task data ordered by timestamp."""
         tasks_data = self.chats_cursor.execute("""
             SELECT se.user_msg_id, se.embedding_data, se.formatted_length,
@@ -63,12 +64,8 @@ class TaskClusterer:
             embeddings_map[user_msg_id] = embedding
             lengths_map[user_msg_id] = formatted_length or 0
             ordered_user_msg_ids.append(user_msg_id)
-            tasks.append({
-                'user_msg_id': user_msg_id,
-                'formatted_length': formatted_length or 0,
-                'message_datetime': msg_datetime,
-                'start_line': start_line
-            })
+            tasks.append(Task(user_msg_id=user_msg_id, formatted_length=formatted_length or 0,
+                              user_datetime_str=msg_datetime))
         
         return embeddings_map, lengths_map, ordered_user_msg_ids, tasks
     
@@ -95,8 +92,8 @@ class TaskClusterer:
         threshold = sorted_distances[percentile_idx]
         return threshold
     
-    def sequential_cluster(self, tasks: List[Dict], embeddings_map: Dict[int, np.ndarray], 
-                          threshold: float, max_size: int, min_size: Optional[int] = None) -> List[List[Dict]]:
+    def sequential_cluster(self, tasks: List[Task], embeddings_map: Dict[int, np.ndarray], 
+                          threshold: float, max_size: int, min_size: Optional[int] = None) -> List[List[Task]]:
         """Sequential clustering: merge consecutive tasks if similar and fits."""
         groups = []
         current_group = []
@@ -0,0 +1,179 @@
+#!/usr/bin/env python3
+import os
+import mmap
+import zlib
+import hashlib
+import sqlite3
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+# zlib can refer back 32 KB, so a larger preset dictionary would not be used
+DICTIONARY_SIZE = 32768
+COMPRESSION_LEVEL = 9
+
+
+def create_content_source_table(cursor: sqlite3.Cursor):
+    """Create the single-row table recording the export that content offsets point into."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS content_source (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            file_path TEXT,
+            file_size INTEGER,
+            file_mtime_ns INTEGER,
+            file_hash TEXT
+        )
+    """)
+
+
+def create_content_dictionaries_table(cursor: sqlite3.Cursor):
+    """Create the table of preset dictionaries that compressed content refers to."""
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS content_dictionaries (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            dictionary BLOB,
+            sample_count INTEGER
+        )
+    """)
+
+
+def train_dictionary(samples: Iterable[str], size: int = DICTIONARY_SIZE) -> bytes:
+    """Build a zlib preset dictionary from lines shared between content samples.
+
+    A zlib dictionary is plain data that compressed text may refer back to, so
+    lines appearing in more than one sample are ranked by the bytes they would
+    save and the best ones are placed last, where matches are cheapest.
+
+    Args:
+        samples: Content texts, e.g. tool-use blocks
+        size: Maximum dictionary size in bytes
+
+    Returns:
+        Dictionary bytes, empty if the samples share no lines
+    """
+    counts = Counter()
+    for sample in samples:
+        counts.update(set(sample.splitlines(keepends=True)))
+    ranked = sorted(((count * len(line.encode('utf-8')), line) for line, count in counts.items() if count > 1),
+                    reverse=True)
+    chosen = []
+    total = 0
+    for _, line in ranked:
+        encoded = line.encode('utf-8')
+        if total + len(encoded) <= size:
+            chosen.append(encoded)
+            total += len(encoded)
+    return b''.join(reversed(chosen))
+
+
+def compress_text(text: str, dictionary: bytes) -> bytes:
+    """Compress text as raw deflate data primed with a preset dictionary."""
+    compressor = zlib.compressobj(COMPRESSION_LEVEL, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=dictionary)
+    return compressor.compress(text.encode('utf-8')) + compressor.flush()
+
+
+def decompress_text(data: bytes, dictionary: bytes) -> str:
+    """Inverse of compress_text()."""
+    decompressor = zlib.decompressobj(-zlib.MAX_WBITS, zdict=dictionary)
+    return (decompressor.decompress(data) + decompressor.flush()).decode('utf-8')
+
+
+def hash_file(filepath: str) -> str:
+    """SHA-256 of a file, read in chunks."""
+    hasher = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+class ContentReader:
+    """Resolve message content stored inline, compressed or as byte ranges of the source export.
+
+    Content parsed with --compress-content is a BLOB compressed with the
+    content_dictionaries row named by dictionary_id. Content parsed with
+    --content-offsets has a NULL content_text and a source_offset/source_length
+    pointing into the markdown export recorded in the content_source table.
+    The export is memory-mapped on first use, after checking it is the file the
+    database was parsed from: the size and mtime are compared first and the
+    SHA-256 only when they differ.
+    """
+
+    COLUMNS = ('content_text', 'source_offset', 'source_length', 'dictionary_id')
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self._file = None
+        self._mmap = None
+        self._dictionaries: Dict[int, bytes] = {}
+        # Databases parsed by older versions lack some of the columns
+        self._columns = {row[1] for row in conn.execute("PRAGMA table_info(content)")}
+        self._query = f"SELECT {self.select_columns()} FROM content WHERE message_id = ?"
+
+    def select_columns(self, table_alias: str = '') -> str:
+        """SELECT list of the COLUMNS that resolve() takes, NULL for columns this database lacks.
+
+        Args:
+            table_alias: Alias of the content table in a larger query, e.g. 'c'
+        """
+        prefix = f"{table_alias}." if table_alias else ''
+        return ', '.join(f"{prefix}{column}" if column in self._columns else 'NULL' for column in self.COLUMNS)
+
+    def _source(self) -> mmap.mmap:
+        if self._mmap is not None:
+            return self._mmap
+        row = self.conn.execute("""
+            SELECT file_path, file_size, file_mtime_ns, file_hash FROM content_source WHERE id = 1
+        """).fetchone()
+        if not row:
+            raise ValueError("Content is stored as offsets but the database records no source file")
+        file_path, file_size, file_mtime_ns, file_hash = row
+        if not os.path.exists(file_path):
+            raise FileNotFoundError(f"Source export {file_path} not found, it is needed to read message content")
+        stat = os.stat(file_path)
+        if (stat.st_size, stat.st_mtime_ns) != (file_size, file_mtime_ns) and hash_file(file_path) != file_hash:
+            raise ValueError(f"Source export {file_path} has changed since it was parsed; "
+                             f"re-run parse_chats.py before reading content")
+        self._file = open(file_path, 'rb')
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        return self._mmap
+
+    def _dictionary(self, dictionary_id: int) -> bytes:
+        if dictionary_id not in self._dictionaries:
+            row = self.conn.execute("SELECT dictionary FROM content_dictionaries WHERE id = ?",
+                                    (dictionary_id,)).fetchone()
+            if not row:
+                raise ValueError(f"Compression dictionary {dictionary_id} is missing from the database")
+            self._dictionaries[dictionary_id] = row[0]
+        return self._dictionaries[dictionary_id]
+
+    def resolve(self, content_text, source_offset: Optional[int], source_length: Optional[int],
+                dictionary_id: Optional[int] = None) -> Optional[str]:
+        """Return the text of a content row, decompressing it or reading it from the export as needed.
+
+        Args:
+            content_text: content_text column, text or a compressed BLOB
+            source_offset: Byte offset of the content in the source export
+            source_length: Length of the content in bytes
+            dictionary_id: Dictionary a compressed BLOB was compressed with
+
+        Returns:
+            Content text, or None if there is none
+        """
+        if isinstance(content_text, bytes):
+            return decompress_text(content_text, self._dictionary(dictionary_id))
+        if content_text is not None or source_offset is None:
+            return content_text
+        data = self._source()[source_offset:source_offset + source_length]
+        return data.decode('utf-8').replace('\r\n', '\n').replace('\r', '\n')
+
+    def get_text(self, message_id: int) -> Optional[str]:
+        """Content text of a message, or None if it has no content row."""
+        row = self.conn.execute(self._query, (message_id,)).fetchone()
+        return self.resolve(*row) if row else None
+
+    def close(self):
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = None
+            self._file = None
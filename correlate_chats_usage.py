@@ -1,10 +1,298 @@
 #!/usr/bin/env python3
+import os
 import sqlite3
 import argparse
-from typing import List, Dict, Tuple
+from bisect import bisect_left, bisect_right
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 import glob
-from task_builder import TaskBuilder
+from collections import defaultdict
+from datetime import datetime, timezone
+import numpy as np
+from task_builder import Task, TaskBuilder
+from parse_usage import UsageParser
 from db_utils import find_db_file, add_db_file_argument
+from usage_utils import UsageColumns
+
+
+# Stages in which a task can match a usage request, stored in task_usage_matches.stage
+STRICT_PASS = 1
+RELAXED_PASS = 2
+BACKFILL = 3
+
+# Tasks this long before the first usage request are never matched
+TASK_LOOKBACK_SECONDS = 172800
+
+# Task fields stored in task_usage_tasks, enough to rebuild the report without TaskBuilder
+STORED_TASK_FIELDS = ('user_timestamp', 'task_end_timestamp', 'total_content_length', 'user_content_length',
+                      'agent_total_length', 'agent_text_length')
+
+# Task length and matched token metrics, the columns of the correlation matrices
+CORRELATION_METRICS = ('content', 'user_content', 'agent_content', 'agent_text', 'total_tokens', 'input_tokens',
+                       'input_tokens_no_cache', 'output_tokens', 'tokens_no_cache')
+
+# (result key, x metric, y metric) of the correlations shown in the report
+REPORTED_CORRELATIONS = (
+    ('content_vs_total_tokens', 'content', 'total_tokens'),
+    ('content_vs_input_tokens', 'content', 'input_tokens'),
+    ('content_vs_input_tokens_no_cache', 'content', 'input_tokens_no_cache'),
+    ('content_vs_output_tokens', 'content', 'output_tokens'),
+    ('agent_content_vs_output_tokens', 'agent_content', 'output_tokens'),
+    ('agent_text_vs_output_tokens', 'agent_text', 'output_tokens'),
+    ('content_vs_tokens_no_cache', 'content', 'tokens_no_cache'),
+)
+
+BOOTSTRAP_RESAMPLES = 1000
+# Resamples are drawn in batches of at most this many resample weights
+BOOTSTRAP_BATCH_SIZE = 1 << 22
+
+# Report granularities of calculate_daily_stats() and their table headings
+PERIODS = {'day': 'Daily', 'week': 'Weekly', 'month': 'Monthly'}
+
+
+class UsageMatcher:
+    """Matches usage requests to the tasks whose user message is closest in time.
+    
+    Two passes go over the tasks in time order. A task not matched yet claims
+    the requests within the pass window of its user message, closest first,
+    as long as a request has fewer claims than allowed: 10/30 (within the
+    strict window / farther) in the strict pass and 300/500 in the relaxed
+    pass. Each request left unclaimed then goes to the task with the closest
+    user message within the relaxed window, if that task is matched.
+    
+    Requests and tasks are searched by binary search over their sorted
+    timestamps, so only the requests inside a window are looked at instead
+    of every request for every task. The steps are separate methods so that
+    matching can resume from stored matches: add_matches() replays earlier
+    matches before the step that originally made them.
+    """
+    
+    PASSES = {STRICT_PASS: (10, 30), RELAXED_PASS: (300, 500)}
+    
+    def __init__(self, usage_requests: List[Tuple], strict_window: float, relaxed_window: float,
+                 min_usage_timestamp: Optional[float] = None):
+        """
+        Args:
+            usage_requests: Usage rows (id, timestamp, ...) sorted by timestamp
+            strict_window: Seconds around a user message searched in the strict pass
+            relaxed_window: Seconds around a user message searched in the relaxed pass
+            min_usage_timestamp: Timestamp of the first usage request of all, if
+                usage_requests is only the later part of them
+        """
+        self.usage_requests = usage_requests
+        self.usage_timestamps = [req[1] for req in usage_requests]
+        self.strict_window = strict_window
+        self.relaxed_window = relaxed_window
+        if min_usage_timestamp is None:
+            min_usage_timestamp = self.usage_timestamps[0] if self.usage_timestamps else 0
+        self.min_task_timestamp = min_usage_timestamp - TASK_LOOKBACK_SECONDS
+        self.claimed_by: Dict[int, Set[int]] = {}
+        self.task_matches: Dict[int, List[Tuple]] = {}
+        self.match_stages: Dict[int, List[int]] = {}
+    
+    def add_matches(self, user_msg_id: int, matches: List[Tuple], stage: int):
+        """Record matches (request id, request, time difference) made earlier in the given stage."""
+        if not matches:
+            return
+        self.task_matches.setdefault(user_msg_id, []).extend(matches)
+        self.match_stages.setdefault(user_msg_id, []).extend([stage] * len(matches))
+        for req_id, _, _ in matches:
+            self.claimed_by.setdefault(req_id, set()).add(user_msg_id)
+    
+    def match_pass(self, tasks_sorted: List[Dict], stage: int):
+        """Let each task not matched yet claim the requests within the pass window."""
+        window = self.strict_window if stage == STRICT_PASS else self.relaxed_window
+        max_shares_close, max_shares_far = self.PASSES[stage]
+        for task in tasks_sorted:
+            user_ts = task['user_timestamp']
+            if task['user_msg_id'] in self.task_matches or user_ts < self.min_task_timestamp:
+                continue
+            
+            window_start = user_ts - window
+            window_end = max(task['task_end_timestamp'], user_ts) + window
+            # Requests past user_ts + window are too far however long the task is
+            first = bisect_left(self.usage_timestamps, window_start)
+            last = bisect_right(self.usage_timestamps, min(window_end, user_ts + window + 1))
+            
+            candidate_matches = []
+            for req_data in self.usage_requests[first:last]:
+                time_diff = abs(req_data[1] - user_ts)
+                if time_diff <= window:
+                    candidate_matches.append((req_data[0], req_data, time_diff))
+            candidate_matches.sort(key=lambda x: x[2])
+            
+            matches = []
+            for req_id, req_data, time_diff in candidate_matches:
+                max_shares = max_shares_close if time_diff <= self.strict_window else max_shares_far
+                if len(self.claimed_by.get(req_id, ())) < max_shares:
+                    matches.append((req_id, req_data, time_diff))
+                    self.claimed_by.setdefault(req_id, set()).add(task['user_msg_id'])
+            
+            if matches:
+                self.task_matches[task['user_msg_id']] = matches
+                self.match_stages[task['user_msg_id']] = [stage] * len(matches)
+    
+    def backfill(self, tasks_sorted: List[Dict]):
+        """Give each unclaimed request to the matched task with the closest user message."""
+        tasks_in_range = [task for task in tasks_sorted if task['user_timestamp'] >= self.min_task_timestamp]
+        task_timestamps = [task['user_timestamp'] for task in tasks_in_range]
+        for req_data in self.usage_requests:
+            req_id, req_ts = req_data[0], req_data[1]
+            if req_id in self.claimed_by:
+                continue
+            
+            # The closest task is the last one at or before req_ts or the first one after it;
+            # among tasks at the same time, and between the two sides, the earlier one wins
+            after = bisect_left(task_timestamps, req_ts)
+            candidates = []
+            if after > 0:
+                candidates.append(bisect_left(task_timestamps, task_timestamps[after - 1]))
+            if after < len(task_timestamps):
+                candidates.append(after)
+            best_match = None
+            best_time_diff = float('inf')
+            for idx in candidates:
+                time_diff = abs(req_ts - task_timestamps[idx])
+                if time_diff <= self.relaxed_window and time_diff < best_time_diff:
+                    best_match = tasks_in_range[idx]
+                    best_time_diff = time_diff
+            
+            if best_match and best_match['user_msg_id'] in self.task_matches:
+                self.add_matches(best_match['user_msg_id'], [(req_id, req_data, best_time_diff)], BACKFILL)
+
+
+def match_usage_to_tasks(tasks_sorted: List[Dict], usage_requests: List[Tuple], strict_window: float,
+                         relaxed_window: float) -> Tuple[Dict[int, List[Tuple]], Dict[int, Set[int]]]:
+    """Match usage requests to tasks from scratch, see UsageMatcher.
+    
+    Args:
+        tasks_sorted: Tasks sorted by user_timestamp
+        usage_requests: Usage rows (id, timestamp, ...) sorted by timestamp
+        strict_window: Seconds around a user message searched in the first pass
+        relaxed_window: Seconds around a user message searched in the second pass
+    
+    Returns:
+        Tuple of (matches by user_msg_id as lists of (request id, request,
+        time difference), user_msg_ids claiming each request id)
+    """
+    matcher = UsageMatcher(usage_requests, strict_window, relaxed_window)
+    matcher.match_pass(tasks_sorted, STRICT_PASS)
+    matcher.match_pass(tasks_sorted, RELAXED_PASS)
+    matcher.backfill(tasks_sorted)
+    return matcher.task_matches, matcher.claimed_by
+
+
+def correlation_matrix(values: np.ndarray) -> np.ndarray:
+    """Pearson correlation coefficients between all columns of values.
+    
+    Args:
+        values: (n, k) matrix with one observation per row
+    
+    Returns:
+        (k, k) matrix of coefficients, NaN where a column is constant
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n == 0:
+        return np.full((values.shape[1], values.shape[1]), np.nan)
+    centered = values - values.mean(axis=0)
+    norms = np.sqrt(np.einsum('ij,ij->j', centered, centered))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        scaled = centered / np.where(norms > 0, norms, np.nan)
+    return np.clip(scaled.T @ scaled, -1.0, 1.0)
+
+
+def rank_columns(values: np.ndarray) -> np.ndarray:
+    """Ranks (1-based) of each column of values, tied values getting the average of their ranks."""
+    values = np.asarray(values)
+    ranks = np.empty(values.shape, dtype=np.float64)
+    for column in range(values.shape[1]):
+        _, inverse, counts = np.unique(values[:, column], return_inverse=True, return_counts=True)
+        ends = np.cumsum(counts)
+        ranks[:, column] = (ends - (counts - 1) / 2.0)[inverse]
+    return ranks
+
+
+def bootstrap_correlation_intervals(values: np.ndarray, pairs: List[Tuple[int, int]],
+                                    resamples: int = BOOTSTRAP_RESAMPLES, confidence: float = 0.95,
+                                    seed: int = 0) -> List[Optional[Tuple[float, float]]]:
+    """Percentile bootstrap confidence intervals of Pearson correlations between columns.
+    
+    A resample is represented by how often it draws each row, so the
+    correlations of a whole batch of resamples come from one matrix product
+    of the (resamples, n) count matrix with the columns, their squares and
+    the pair products, instead of a loop over resamples. Columns are
+    standardized first to keep the sums of squares well conditioned.
+    
+    Args:
+        values: (n, k) matrix with one observation per row
+        pairs: (x column, y column) pairs to correlate
+        resamples: Number of bootstrap resamples
+        confidence: Coverage of the intervals
+        seed: Random seed, so reports are reproducible
+    
+    Returns:
+        (lower, upper) bounds for each pair, None where a column is constant
+        or there are fewer than 3 rows
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n, k = values.shape
+    std = values.std(axis=0) if n else np.zeros(k)
+    if n < 3 or not pairs:
+        return [None] * len(pairs)
+    left, right = (np.array(side) for side in zip(*pairs))
+    z = (values - values.mean(axis=0)) / np.where(std > 0, std, 1.0)
+    moments = np.hstack([z, z * z, z[:, left] * z[:, right]])
+    
+    rng = np.random.default_rng(seed)
+    batch_size = max(1, BOOTSTRAP_BATCH_SIZE // n)
+    correlations = []
+    for start in range(0, resamples, batch_size):
+        batch = min(batch_size, resamples - start)
+        draws = rng.integers(0, n, size=(batch, n)) + (np.arange(batch) * n)[:, None]
+        weights = np.bincount(draws.ravel(), minlength=batch * n).reshape(batch, n)
+        sums = (weights @ moments) / n
+        means, squares, products = sums[:, :k], sums[:, k:2 * k], sums[:, 2 * k:]
+        variances = squares - means ** 2
+        covariances = products - means[:, left] * means[:, right]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            correlations.append(covariances / np.sqrt(variances[:, left] * variances[:, right]))
+    correlations = np.concatenate(correlations)
+    
+    # Pairs with a constant column have no correlation; resamples drawing a single row are skipped
+    valid = (std[left] > 0) & (std[right] > 0)
+    tail = (1.0 - confidence) / 2.0 * 100
+    intervals = [None] * len(pairs)
+    if valid.any():
+        lower, upper = np.clip(np.nanpercentile(correlations[:, valid], [tail, 100 - tail], axis=0), -1.0, 1.0)
+        for index, low, high in zip(np.flatnonzero(valid).tolist(), lower.tolist(), upper.tolist()):
+            intervals[index] = (low, high)
+    return intervals
+
+
+def merged_usage_path(chats_db: str) -> str:
+    """Path of the store that usage from several databases is merged into, next to the chats database."""
+    return f"{chats_db}.usage-merged"
+
+
+def period_indices(timestamps: np.ndarray, period: str) -> np.ndarray:
+    """UTC period numbers of Unix timestamps: days or months since the epoch, or weeks starting on Monday."""
+    days = np.floor_divide(np.asarray(timestamps, dtype=np.float64), 86400).astype(np.int64)
+    if period == 'day':
+        return days
+    if period == 'week':
+        # 1970-01-01 was a Thursday
+        return np.floor_divide(days + 3, 7)
+    return days.astype('datetime64[D]').astype('datetime64[M]').astype(np.int64)
+
+
+def period_label(index: int, period: str) -> str:
+    """Label of a period number from period_indices(): 2025-01-31, 2025-W05 (ISO week) or 2025-01."""
+    if period == 'day':
+        return str(np.datetime64(index, 'D'))
+    if period == 'week':
+        year, week, _ = np.datetime64(index * 7 - 3, 'D').item().isocalendar()
+        return f"{year}-W{week:02d}"
+    return str(np.datetime64(index, 'M'))
 
 
 class ChatUsageCorrelator:
@@ -12,126 +300,271 @@ class ChatUsageCorrelator:
         self.chats_conn = sqlite3.connect(chats_db)
         self.chats_cursor = self.chats_conn.cursor()
         
-        usage_dbs = glob.glob(usage_db_pattern)
+        usage_dbs = sorted(glob.glob(usage_db_pattern))
+        merged_path = merged_usage_path(chats_db)
+        usage_dbs = [path for path in usage_dbs if os.path.abspath(path) != os.path.abspath(merged_path)]
         if not usage_dbs:
             raise ValueError(f"No usage databases found matching pattern: {usage_db_pattern}")
         
-        self.usage_conn = sqlite3.connect(usage_dbs[0])
-        self.usage_cursor = self.usage_conn.cursor()
-        
-        if len(usage_dbs) > 1:
-            for db_path in usage_dbs[1:]:
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-                cursor.execute("ATTACH DATABASE ? AS other", (db_path,))
-                self.usage_cursor.execute("""
-                    INSERT INTO usage SELECT * FROM other.usage
-                """)
-                conn.close()
+        if len(usage_dbs) == 1:
+            self.usage_conn = sqlite3.connect(usage_dbs[0])
+            self.usage_conn.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON usage(timestamp)")
             self.usage_conn.commit()
+        else:
+            # Several databases are imported into one store that persists between runs
+            merger = UsageParser(merged_path)
+            try:
+                merger.load_databases(usage_dbs)
+            finally:
+                merger.close()
+            self.usage_conn = sqlite3.connect(merged_path)
+        self.usage_cursor = self.usage_conn.cursor()
         
-        self.usage_cursor.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON usage(timestamp)")
-        self.usage_conn.commit()
-        
-        self.task_builder = TaskBuilder(chats_db)
+        self.task_builder = TaskBuilder(chats_db, self.chats_conn)
+        self._usage_columns = None
+        self._usage_rows = None
+        self._create_match_tables()
+    
+    def usage_columns(self) -> UsageColumns:
+        """Columnar usage data, read from the memory-mapped cache next to the usage database."""
+        if self._usage_columns is None:
+            self._usage_columns = UsageColumns.load(self.usage_conn)
+        return self._usage_columns
+    
+    def usage_rows(self) -> List[Tuple]:
+        """Usage rows (id, timestamp, <TOKEN_COLUMNS>, kind, model) in timestamp order."""
+        if self._usage_rows is None:
+            self._usage_rows = self.usage_columns().rows()
+        return self._usage_rows
+    
+    def iter_message_tasks(self) -> Iterator[Task]:
+        return self.task_builder.iter_message_tasks()
     
-    def get_message_tasks(self) -> List[Dict]:
-        return self.task_builder.get_message_tasks()
+    def _create_match_tables(self):
+        self.chats_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS task_usage_tasks (
+                user_msg_id INTEGER PRIMARY KEY,
+                position INTEGER,
+                user_timestamp REAL,
+                task_end_timestamp REAL,
+                total_content_length INTEGER,
+                user_content_length INTEGER,
+                agent_total_length INTEGER,
+                agent_text_length INTEGER
+            )
+        """)
+        self.chats_cursor.execute("CREATE INDEX IF NOT EXISTS idx_task_usage_tasks_timestamp ON task_usage_tasks(user_timestamp)")
+        self.chats_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS task_usage_matches (
+                user_msg_id INTEGER,
+                position INTEGER,
+                usage_id INTEGER,
+                usage_timestamp REAL,
+                time_diff REAL,
+                stage INTEGER,
+                PRIMARY KEY (user_msg_id, position)
+            )
+        """)
+        self.chats_cursor.execute("""
+            CREATE TABLE IF NOT EXISTS task_usage_state (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                strict_window REAL,
+                relaxed_window REAL,
+                usage_token TEXT,
+                min_usage_timestamp REAL,
+                max_usage_id INTEGER,
+                usage_id_count INTEGER,
+                max_message_id INTEGER,
+                message_id_count INTEGER,
+                task_watermark REAL,
+                usage_watermark REAL
+            )
+        """)
+        self.chats_conn.commit()
     
     def correlate_tasks_with_usage(self, tasks: List[Dict], strict_window: float = 600, relaxed_window: float = 7200) -> Tuple[List[Dict], List[Dict], Dict]:
-        all_usage_requests = self.usage_cursor.execute("""
-            SELECT id, timestamp, input_with_cache_write, input_without_cache_write,
-                   cache_read, output_tokens, total_tokens, kind, model
-            FROM usage
-            ORDER BY timestamp
-        """).fetchall()
-        
-        usage_request_map = {req[0]: req for req in all_usage_requests}
-        usage_request_claimed_by = {} 
-        task_matches = {}
+        """Match the given tasks with all usage requests from scratch, without storing the matches."""
+        all_usage_requests = self.usage_rows()
         
         tasks_sorted = sorted(tasks, key=lambda s: s['user_timestamp'])
-        
-        min_usage_ts = min(r[1] for r in all_usage_requests) if all_usage_requests else 0
-        max_usage_ts = max(r[1] for r in all_usage_requests) if all_usage_requests else 0
-        
-        for pass_num, (window, max_shares_close, max_shares_far) in enumerate([
-            (strict_window, 10, 30),
-            (relaxed_window, 300, 500)
-        ]):
-            for task in tasks_sorted:
-                if task['user_msg_id'] in task_matches:
-                    continue
-                    
-                user_ts = task['user_timestamp']
-                task_end_ts = task['task_end_timestamp']
-                
-                if user_ts < min_usage_ts - 172800:
-                    continue
-                
-                window_start = user_ts - window
-                window_end = max(task_end_ts, user_ts) + window
-                
-                candidate_matches = []
-                
-                for req_id, req_data in usage_request_map.items():
-                    req_ts = req_data[1]
-                    
-                    if req_ts < window_start or req_ts > window_end:
-                        continue
-                    
-                    time_diff = abs(req_ts - user_ts)
-                    
-                    if time_diff <= window:
-                        candidate_matches.append((req_id, req_data, time_diff))
-                
-                if candidate_matches:
-                    candidate_matches.sort(key=lambda x: x[2])
-                    
-                    matches = []
-                    
-                    for req_id, req_data, time_diff in candidate_matches:
-                        existing_claims = usage_request_claimed_by.get(req_id, set())
-                        
-                        max_shares = max_shares_close if time_diff <= strict_window else max_shares_far
-                        
-                        if len(existing_claims) < max_shares:
-                            matches.append((req_id, req_data, time_diff))
-                            if req_id not in usage_request_claimed_by:
-                                usage_request_claimed_by[req_id] = set()
-                            usage_request_claimed_by[req_id].add(task['user_msg_id'])
-                    
-                    if matches:
-                        task_matches[task['user_msg_id']] = matches
-        
-        for req_id, req_data in usage_request_map.items():
-            if req_id in usage_request_claimed_by:
-                continue
-            
-            req_ts = req_data[1]
-            
-            best_match = None
-            best_time_diff = float('inf')
-            
-            for task in tasks_sorted:
-                user_ts = task['user_timestamp']
-                
-                if user_ts < min_usage_ts - 172800:
-                    continue
-                
-                time_diff = abs(req_ts - user_ts)
-                
-                if time_diff <= relaxed_window and time_diff < best_time_diff:
-                    best_match = task
-                    best_time_diff = time_diff
-            
-            if best_match and best_match['user_msg_id'] in task_matches:
-                if req_id not in usage_request_claimed_by:
-                    usage_request_claimed_by[req_id] = set()
-                usage_request_claimed_by[req_id].add(best_match['user_msg_id'])
-                match_list = task_matches[best_match['user_msg_id']]
-                match_list.append((req_id, req_data, best_time_diff))
-        
+        task_matches, usage_request_claimed_by = match_usage_to_tasks(tasks_sorted, all_usage_requests,
+                                                                      strict_window, relaxed_window)
+        return self.summarize_matches(tasks, task_matches, set(usage_request_claimed_by))
+    
+    def update_task_usage_matches(self, strict_window: float = 600, relaxed_window: float = 7200,
+                                  force: bool = False) -> Tuple[List[Dict], Dict[int, List[Tuple]], Set[int]]:
+        """Bring the stored task-to-usage matches up to date and return them.
+        
+        Only tasks from _resume_timestamp() on are rebuilt with TaskBuilder and
+        matched again; earlier tasks and their matches are read from
+        task_usage_tasks and task_usage_matches and replayed into the matcher
+        before the step that made them, so the result equals matching
+        everything from scratch. Backfilled requests from relaxed_window
+        before that point are assigned again, as newer tasks may be closer.
+        
+        Args:
+            strict_window: Seconds around a user message searched in the first pass
+            relaxed_window: Seconds around a user message searched in the second pass
+            force: Match all tasks again instead of resuming
+        
+        Returns:
+            Tuple of (all tasks in time order, matches by user_msg_id as lists of
+            (request id, request, time difference), ids of matched requests)
+        """
+        all_usage_requests = self.usage_rows()
+        min_usage_ts = all_usage_requests[0][1] if all_usage_requests else 0
+        usage_token = self.usage_cursor.execute("SELECT token FROM usage_version WHERE id = 1").fetchone()[0]
+        
+        resume_from = None if force else self._resume_timestamp(min_usage_ts, usage_token, strict_window, relaxed_window)
+        if resume_from is None:
+            print("Matching all tasks")
+            resume_from = float('-inf')
+            self.chats_cursor.execute("DELETE FROM task_usage_tasks")
+            self.chats_cursor.execute("DELETE FROM task_usage_matches")
+        elif resume_from == float('inf'):
+            print("No new tasks or usage requests since the last run")
+        else:
+            print(f"Matching tasks from {datetime.fromtimestamp(resume_from, tz=timezone.utc):%Y-%m-%d %H:%M}Z on")
+        backfill_from = resume_from - relaxed_window
+        
+        stored_rows = self.chats_cursor.execute(f"""
+            SELECT user_msg_id, {', '.join(STORED_TASK_FIELDS)} FROM task_usage_tasks
+            WHERE user_timestamp < ? ORDER BY position
+        """, (resume_from,))
+        stored_tasks = [Task(**dict(zip(('user_msg_id',) + STORED_TASK_FIELDS, row))) for row in stored_rows]
+        new_tasks = []
+        if resume_from != float('inf'):
+            # Only the fields matching and the report use are read, not the task texts
+            new_tasks = list(self.task_builder.iter_message_tasks(None if resume_from == float('-inf') else resume_from,
+                                                                  fields=STORED_TASK_FIELDS))
+            new_tasks.sort(key=lambda s: s['user_timestamp'])
+        
+        usage_by_id = {req[0]: req for req in all_usage_requests}
+        stored_matches = defaultdict(list)
+        for user_msg_id, usage_id, usage_ts, time_diff, stage in self.chats_cursor.execute("""
+            SELECT m.user_msg_id, m.usage_id, m.usage_timestamp, m.time_diff, m.stage
+            FROM task_usage_matches m JOIN task_usage_tasks t ON t.user_msg_id = m.user_msg_id
+            WHERE t.user_timestamp < ? AND (m.stage != ? OR m.usage_timestamp < ?)
+            ORDER BY m.user_msg_id, m.position
+        """, (resume_from, BACKFILL, backfill_from)):
+            stored_matches[stage].append((user_msg_id, (usage_id, usage_by_id[usage_id], time_diff)))
+        
+        def replay(stage: int):
+            for user_msg_id, match in stored_matches[stage]:
+                matcher.add_matches(user_msg_id, [match], stage)
+        
+        usage_timestamps = [req[1] for req in all_usage_requests]
+        matcher = UsageMatcher(all_usage_requests[bisect_left(usage_timestamps, backfill_from):],
+                               strict_window, relaxed_window, min_usage_ts)
+        replay(STRICT_PASS)
+        matcher.match_pass(new_tasks, STRICT_PASS)
+        replay(RELAXED_PASS)
+        matcher.match_pass(new_tasks, RELAXED_PASS)
+        replay(BACKFILL)
+        kept_counts = {task['user_msg_id']: len(matcher.task_matches.get(task['user_msg_id'], ()))
+                       for task in stored_tasks}
+        matcher.backfill(stored_tasks + new_tasks)
+        
+        self._store_matches(resume_from, backfill_from, stored_tasks, new_tasks, matcher, kept_counts)
+        max_message_id = self.chats_cursor.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+        tasks = stored_tasks + new_tasks
+        self.chats_cursor.execute("""
+            INSERT OR REPLACE INTO task_usage_state (id, strict_window, relaxed_window, usage_token, min_usage_timestamp,
+                max_usage_id, usage_id_count, max_message_id, message_id_count, task_watermark, usage_watermark)
+            VALUES (1, ?, ?, ?, ?, ?, ?, ?, (SELECT COUNT(*) FROM messages), ?, ?)
+        """, (strict_window, relaxed_window, usage_token, min_usage_ts, max(usage_by_id, default=0),
+              len(all_usage_requests), max_message_id, tasks[-1]['user_timestamp'] if tasks else None,
+              usage_timestamps[-1] if usage_timestamps else None))
+        self.chats_conn.commit()
+        
+        print(f"Matched {len(new_tasks)} new or changed tasks, reused {len(stored_tasks)} stored tasks")
+        return tasks, matcher.task_matches, set(matcher.claimed_by)
+    
+    def _resume_timestamp(self, min_usage_ts: float, usage_token: str, strict_window: float,
+                          relaxed_window: float) -> Optional[float]:
+        """Timestamp from which tasks have to be matched again, None to match all of them.
+        
+        Chat parsing and usage loading only add and delete rows (edited chats
+        are stored again under new ids), so rows above the stored id watermarks
+        are new and any missing row below them forces a full match. Matching
+        works forward in time: a new request can only change strict-pass
+        claims of tasks up to strict_window before it, and a changed claim
+        only relaxed-pass claims up to strict_window + relaxed_window before
+        that. Tasks earlier than that keep their stored matches.
+        
+        Returns:
+            The timestamp, float('inf') if nothing changed, or None if the stored
+            matches cannot be resumed
+        """
+        state = self.chats_cursor.execute("""
+            SELECT strict_window, relaxed_window, usage_token, min_usage_timestamp, max_usage_id, usage_id_count,
+                   max_message_id, message_id_count
+            FROM task_usage_state WHERE id = 1
+        """).fetchone()
+        if state is None or state[:4] != (strict_window, relaxed_window, usage_token, min_usage_ts):
+            return None
+        max_usage_id, usage_id_count, max_message_id, message_id_count = state[4:]
+        
+        usage = self.usage_columns()
+        is_new_usage = usage['id'] > max_usage_id
+        if len(usage) - int(np.count_nonzero(is_new_usage)) != usage_id_count:
+            return None
+        kept_messages = self.chats_cursor.execute("SELECT COUNT(*) FROM messages WHERE id <= ?",
+                                                  (max_message_id,)).fetchone()[0]
+        if kept_messages != message_id_count:
+            return None
+        
+        changed = [float('inf')]
+        if is_new_usage.any():
+            changed.append(float(usage['timestamp'][is_new_usage].min()) - strict_window)
+        # New messages change the task of the closest user message before them in their chat
+        for (user_dt_str,) in self.chats_cursor.execute("""
+            SELECT DISTINCT u.message_datetime
+            FROM messages n
+            JOIN messages u ON u.id = (
+                SELECT MAX(p.id) FROM messages p
+                WHERE p.chat_id = n.chat_id AND p.message_type = 'User' AND p.id <= n.id
+            )
+            WHERE n.id > ? AND u.message_datetime IS NOT NULL
+        """, (max_message_id,)):
+            user_ts = self.task_builder.parse_chat_datetime(user_dt_str)
+            if user_ts:
+                changed.append(user_ts)
+        return min(changed) - strict_window - relaxed_window
+    
+    def _store_matches(self, resume_from: float, backfill_from: float, stored_tasks: List[Dict],
+                       new_tasks: List[Dict], matcher: UsageMatcher, kept_counts: Dict[int, int]):
+        """Replace stored tasks from resume_from on and the matches that changed with the matcher's results."""
+        self.chats_cursor.execute("DELETE FROM task_usage_tasks WHERE user_timestamp >= ?", (resume_from,))
+        self.chats_cursor.execute("""
+            DELETE FROM task_usage_matches
+            WHERE user_msg_id NOT IN (SELECT user_msg_id FROM task_usage_tasks)
+            OR (stage = ? AND usage_timestamp >= ?)
+        """, (BACKFILL, backfill_from))
+        self.chats_cursor.executemany(f"""
+            INSERT INTO task_usage_tasks (user_msg_id, position, {', '.join(STORED_TASK_FIELDS)})
+            VALUES (?, ?, {', '.join('?' * len(STORED_TASK_FIELDS))})
+        """, [(task['user_msg_id'], position) + tuple(task[field] for field in STORED_TASK_FIELDS)
+              for position, task in enumerate(new_tasks, len(stored_tasks))])
+        
+        def match_rows(tasks: List[Dict]):
+            for task in tasks:
+                user_msg_id = task['user_msg_id']
+                matches = matcher.task_matches.get(user_msg_id, [])
+                stages = matcher.match_stages.get(user_msg_id, [])
+                for position in range(kept_counts.get(user_msg_id, 0), len(matches)):
+                    usage_id, req_data, time_diff = matches[position]
+                    yield user_msg_id, position, usage_id, req_data[1], time_diff, stages[position]
+        
+        self.chats_cursor.executemany("""
+            INSERT INTO task_usage_matches (user_msg_id, position, usage_id, usage_timestamp, time_diff, stage)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, match_rows(stored_tasks + new_tasks))
+    
+    def summarize_matches(self, tasks: List[Dict], task_matches: Dict[int, List[Tuple]],
+                          matched_usage_ids: Set[int]) -> Tuple[List[Dict], List[Dict], List[Tuple], Dict]:
+        """Split tasks and usage requests into matched and unmatched and add matched token totals to tasks."""
+        all_usage_requests = self.usage_rows()
         correlated = []
         unmatched_tasks = []
         
@@ -163,161 +596,145 @@ class ChatUsageCorrelator:
                 'time_diff': match_list[0][2] if match_list else None
             })
         
-        all_matched_usage_ids = set(usage_request_claimed_by.keys())
-        
-        if all_matched_usage_ids:
-            placeholders = ','.join(['?'] * len(all_matched_usage_ids))
-            query = f"""
-                SELECT id, timestamp, input_with_cache_write, input_without_cache_write,
-                       cache_read, output_tokens, total_tokens, kind, model, date
-                FROM usage
-                WHERE id NOT IN ({placeholders})
-                ORDER BY timestamp
-            """
-            unmatched_usage = self.usage_cursor.execute(query, list(all_matched_usage_ids)).fetchall()
-        else:
-            unmatched_usage = self.usage_cursor.execute("""
-                SELECT id, timestamp, input_with_cache_write, input_without_cache_write,
-                       cache_read, output_tokens, total_tokens, kind, model, date
-                FROM usage
-                ORDER BY timestamp
-            """).fetchall()
+        # Set difference over the cached rows, already in timestamp order
+        unmatched_usage = [req for req in all_usage_requests if req[0] not in matched_usage_ids]
         
         stats = {
             'total_tasks': len(tasks),
             'matched_tasks': len(correlated),
             'unmatched_tasks': len(unmatched_tasks),
-            'matched_usage_requests': len(all_matched_usage_ids),
+            'matched_usage_requests': len(matched_usage_ids),
             'unmatched_usage_requests': len(unmatched_usage)
         }
         
         return correlated, unmatched_tasks, unmatched_usage, stats
     
     def calculate_correlations(self, correlated: List[Dict]) -> Dict:
-        if not correlated:
-            return {}
+        """Correlate task content lengths with matched token counts.
         
-        content_lengths = [s['total_content_length'] for s in correlated]
-        user_content_lengths = [s['user_content_length'] for s in correlated]
-        agent_content_lengths = [s['agent_total_length'] for s in correlated]
-        agent_text_lengths = [s['agent_text_length'] for s in correlated]
-        token_totals = [s['matched_total_tokens'] for s in correlated]
-        input_tokens_with_cache = [s['matched_input_w_cache'] + s['matched_input_wo_cache'] + s['matched_cache_read'] for s in correlated]
-        input_tokens_without_cache = [s['matched_input_w_cache'] + s['matched_input_wo_cache'] for s in correlated]
-        output_tokens = [s['matched_output'] for s in correlated]
-        tokens_without_cache = [s['matched_input_w_cache'] + s['matched_input_wo_cache'] + s['matched_output'] for s in correlated]
-        
-        def correlation(x, y):
-            if len(x) != len(y) or len(x) == 0:
-                return None
-            n = len(x)
-            mean_x = sum(x) / n
-            mean_y = sum(y) / n
-            
-            numerator = sum((x[i] - mean_x) * (y[i] - mean_y) for i in range(n))
-            denom_x = sum((x[i] - mean_x) ** 2 for i in range(n))
-            denom_y = sum((y[i] - mean_y) ** 2 for i in range(n))
-            
-            if denom_x == 0 or denom_y == 0:
-                return None
-            
-            return numerator / (denom_x ** 0.5 * denom_y ** 0.5)
-        
-        return {
-            'content_vs_total_tokens': correlation(content_lengths, token_totals),
-            'content_vs_input_tokens': correlation(content_lengths, input_tokens_with_cache),
-            'content_vs_input_tokens_no_cache': correlation(content_lengths, input_tokens_without_cache),
-            'content_vs_output_tokens': correlation(content_lengths, output_tokens),
-            'agent_content_vs_output_tokens': correlation(agent_content_lengths, output_tokens),
-            'agent_text_vs_output_tokens': correlation(agent_text_lengths, output_tokens),
-            'content_vs_tokens_no_cache': correlation(content_lengths, tokens_without_cache),
-            'avg_content_length': sum(content_lengths) / len(content_lengths) if content_lengths else 0,
-            'avg_user_content_length': sum(user_content_lengths) / len(user_content_lengths) if user_content_lengths else 0,
-            'avg_agent_content_length': sum(agent_content_lengths) / len(agent_content_lengths) if agent_content_lengths else 0,
-            'avg_agent_text_length': sum(agent_text_lengths) / len(agent_text_lengths) if agent_text_lengths else 0,
-            'avg_total_tokens': sum(token_totals) / len(token_totals) if token_totals else 0,
-            'avg_input_tokens': sum(input_tokens_with_cache) / len(input_tokens_with_cache) if input_tokens_with_cache else 0,
-            'avg_input_tokens_no_cache': sum(input_tokens_without_cache) / len(input_tokens_without_cache) if input_tokens_without_cache else 0,
-            'avg_output_tokens': sum(output_tokens) / len(output_tokens) if output_tokens else 0,
-            'avg_tokens_no_cache': sum(tokens_without_cache) / len(tokens_without_cache) if tokens_without_cache else 0,
-            'total_content': sum(content_lengths),
-            'total_user_content': sum(user_content_lengths),
-            'total_agent_content': sum(agent_content_lengths),
-            'total_agent_text': sum(agent_text_lengths),
-            'total_matched_tokens': sum(token_totals),
-            'total_matched_input': sum(input_tokens_with_cache),
-            'total_matched_input_no_cache': sum(input_tokens_without_cache),
-            'total_matched_output': sum(output_tokens),
-            'total_matched_tokens_no_cache': sum(tokens_without_cache)
-        }
-    
-    def calculate_daily_stats(self, correlated: List[Dict], unmatched_tasks: List[Dict],
-                              unmatched_usage: List[Tuple], all_tasks: List[Dict]) -> Dict:
-        from datetime import datetime, timezone
-        from collections import defaultdict
+        All metrics are columns of one matrix, so the Pearson and Spearman
+        correlation matrices and the bootstrap intervals of the reported
+        correlations are computed in a few vectorized passes.
         
-        daily_stats = defaultdict(lambda: {
-            'tasks': 0,
-            'matched_tasks': 0,
-            'unmatched_tasks': 0,
-            'usage_requests': 0,
-            'matched_usage_requests': 0,
-            'unmatched_usage_requests': 0,
-            'total_content_length': 0,
-            'matched_content_length': 0,
-            'total_tokens': 0,
-            'matched_tokens': 0,
-            'input_tokens': 0,
-            'output_tokens': 0,
-            'matched_input_tokens': 0,
-            'matched_output_tokens': 0
-        })
+        Args:
+            correlated: Matched tasks from summarize_matches()
         
-        all_matched_task_ids = {s['user_msg_id'] for s in correlated}
-        all_matched_usage_ids = set()
-        for task in correlated:
-            all_matched_usage_ids.update(task['matched_usage_ids'])
+        Returns:
+            Dictionary with the reported correlations (None where a metric is
+            constant), their '_spearman' and '_ci' (bootstrap interval)
+            variants, averages and totals per metric, and the full matrices
+            of all CORRELATION_METRICS under 'pearson' and 'spearman'
+        """
+        if not correlated:
+            return {}
         
-        for task in all_tasks:
-            user_ts = task['user_timestamp']
-            day_key = datetime.fromtimestamp(user_ts, tz=timezone.utc).strftime('%Y-%m-%d')
-            daily_stats[day_key]['tasks'] += 1
-            daily_stats[day_key]['total_content_length'] += task['total_content_length']
-            
-            if task['user_msg_id'] in all_matched_task_ids:
-                daily_stats[day_key]['matched_tasks'] += 1
-                daily_stats[day_key]['matched_content_length'] += task['total_content_length']
-            else:
-                daily_stats[day_key]['unmatched_tasks'] += 1
-        
-        all_usage_requests = self.usage_cursor.execute("""
-            SELECT id, timestamp, input_with_cache_write, input_without_cache_write,
-                   cache_read, output_tokens, total_tokens
-            FROM usage
-        """).fetchall()
-        
-        for req_id, req_ts, in_w, in_wo, cache, out, total in all_usage_requests:
-            day_key = datetime.fromtimestamp(req_ts, tz=timezone.utc).strftime('%Y-%m-%d')
-            daily_stats[day_key]['usage_requests'] += 1
-            daily_stats[day_key]['total_tokens'] += total
-            daily_stats[day_key]['input_tokens'] += (in_w + in_wo + cache)
-            daily_stats[day_key]['output_tokens'] += out
-            
-            if req_id in all_matched_usage_ids:
-                daily_stats[day_key]['matched_usage_requests'] += 1
-                daily_stats[day_key]['matched_tokens'] += total
-                daily_stats[day_key]['matched_input_tokens'] += (in_w + in_wo + cache)
-                daily_stats[day_key]['matched_output_tokens'] += out
-            else:
-                daily_stats[day_key]['unmatched_usage_requests'] += 1
-        
-        return dict(sorted(daily_stats.items()))
+        values = np.array([
+            (s['total_content_length'], s['user_content_length'], s['agent_total_length'], s['agent_text_length'],
+             s['matched_total_tokens'],
+             s['matched_input_w_cache'] + s['matched_input_wo_cache'] + s['matched_cache_read'],
+             s['matched_input_w_cache'] + s['matched_input_wo_cache'],
+             s['matched_output'],
+             s['matched_input_w_cache'] + s['matched_input_wo_cache'] + s['matched_output'])
+            for s in correlated
+        ], dtype=np.int64)
+        
+        pearson = correlation_matrix(values)
+        spearman = correlation_matrix(rank_columns(values))
+        column = {name: i for i, name in enumerate(CORRELATION_METRICS)}
+        pairs = [(column[x], column[y]) for _, x, y in REPORTED_CORRELATIONS]
+        intervals = bootstrap_correlation_intervals(values, pairs)
+        
+        def value(matrix, i, j):
+            return None if np.isnan(matrix[i, j]) else float(matrix[i, j])
+        
+        result = {'metrics': CORRELATION_METRICS, 'pearson': pearson, 'spearman': spearman}
+        for (key, _, _), (i, j), interval in zip(REPORTED_CORRELATIONS, pairs, intervals):
+            result[key] = value(pearson, i, j)
+            result[f"{key}_spearman"] = value(spearman, i, j)
+            result[f"{key}_ci"] = interval
+        
+        totals = values.sum(axis=0).tolist()
+        averages = (values.sum(axis=0) / len(values)).tolist()
+        for name, total_key, avg_key in (
+            ('content', 'total_content', 'avg_content_length'),
+            ('user_content', 'total_user_content', 'avg_user_content_length'),
+            ('agent_content', 'total_agent_content', 'avg_agent_content_length'),
+            ('agent_text', 'total_agent_text', 'avg_agent_text_length'),
+            ('total_tokens', 'total_matched_tokens', 'avg_total_tokens'),
+            ('input_tokens', 'total_matched_input', 'avg_input_tokens'),
+            ('input_tokens_no_cache', 'total_matched_input_no_cache', 'avg_input_tokens_no_cache'),
+            ('output_tokens', 'total_matched_output', 'avg_output_tokens'),
+            ('tokens_no_cache', 'total_matched_tokens_no_cache', 'avg_tokens_no_cache'),
+        ):
+            result[total_key] = totals[column[name]]
+            result[avg_key] = averages[column[name]]
+        return result
+    
+    def calculate_daily_stats(self, correlated: List[Dict], all_tasks: List[Dict], period: str = 'day') -> Dict:
+        """Roll tasks and usage requests up per UTC day, week or month.
+        
+        Tasks and the cached usage columns are mapped to period numbers and
+        summed with np.bincount, so the cost is a few array passes instead of
+        formatting a date for every task and request.
+        
+        Args:
+            correlated: Matched tasks from summarize_matches(); tasks and usage
+                requests not among them count as unmatched
+            all_tasks: All tasks
+            period: 'day', 'week' or 'month'
+        
+        Returns:
+            Statistics by period label, in time order
+        """
+        matched_task_ids = {s['user_msg_id'] for s in correlated}
+        matched_usage_ids = np.fromiter((usage_id for task in correlated for usage_id in task['matched_usage_ids']),
+                                        dtype=np.int64)
+        
+        task_timestamps = np.fromiter((task['user_timestamp'] for task in all_tasks), dtype=np.float64,
+                                      count=len(all_tasks))
+        task_lengths = np.fromiter((task['total_content_length'] for task in all_tasks), dtype=np.int64,
+                                   count=len(all_tasks))
+        task_matched = np.fromiter((task['user_msg_id'] in matched_task_ids for task in all_tasks), dtype=bool,
+                                   count=len(all_tasks))
+        
+        usage = self.usage_columns()
+        usage_matched = np.isin(usage['id'], matched_usage_ids)
+        input_tokens = usage['input_with_cache_write'] + usage['input_without_cache_write'] + usage['cache_read']
+        
+        task_periods = period_indices(task_timestamps, period)
+        usage_periods = period_indices(usage['timestamp'], period)
+        periods, inverse = np.unique(np.concatenate([task_periods, usage_periods]), return_inverse=True)
+        task_slots, usage_slots = inverse[:len(task_periods)], inverse[len(task_periods):]
+        
+        def total(slots, weights=None):
+            sums = np.bincount(slots, weights=weights, minlength=len(periods))
+            return np.rint(sums).astype(np.int64).tolist()
+        
+        sums = {
+            'tasks': total(task_slots),
+            'matched_tasks': total(task_slots[task_matched]),
+            'unmatched_tasks': total(task_slots[~task_matched]),
+            'usage_requests': total(usage_slots),
+            'matched_usage_requests': total(usage_slots[usage_matched]),
+            'unmatched_usage_requests': total(usage_slots[~usage_matched]),
+            'total_content_length': total(task_slots, task_lengths),
+            'matched_content_length': total(task_slots[task_matched], task_lengths[task_matched]),
+            'total_tokens': total(usage_slots, usage['total_tokens']),
+            'matched_tokens': total(usage_slots[usage_matched], usage['total_tokens'][usage_matched]),
+            'input_tokens': total(usage_slots, input_tokens),
+            'output_tokens': total(usage_slots, usage['output_tokens']),
+            'matched_input_tokens': total(usage_slots[usage_matched], input_tokens[usage_matched]),
+            'matched_output_tokens': total(usage_slots[usage_matched], usage['output_tokens'][usage_matched]),
+        }
+        return {period_label(index, period): {name: values[slot] for name, values in sums.items()}
+                for slot, index in enumerate(periods.tolist())}
     
     def print_report(self, correlated: List[Dict], unmatched_tasks: List[Dict], 
-                     unmatched_usage: List[Tuple], stats: Dict, correlations: Dict, daily_stats: Dict):
+                     unmatched_usage: List[Tuple], stats: Dict, correlations: Dict, daily_stats: Dict,
+                     period: str = 'day'):
         print("## Chat-Usage Correlation Report\n")
         
-        print("### Daily Statistics\n")
+        print(f"### {PERIODS[period]} Statistics\n")
         print("| Date | Chats | Matched | Unmatched | Usage Req | Matched | Unmatched | Content (KB) | Matched Content (KB) | Total Tokens (M) | Matched Tokens (M) | Input Tokens (M) | Output Tokens (K) |")
         print("|------|-------|---------|-----------|-----------|---------|-----------|--------------|---------------------|------------------|-------------------|------------------|-------------------|")
         
@@ -391,13 +808,6 @@ class ChatUsageCorrelator:
         if correlations:
             print("### Content Size vs Token Count Correlations\n")
             
-            corr_no_cache = correlations.get('content_vs_tokens_no_cache')
-            corr_input_no_cache = correlations.get('content_vs_input_tokens_no_cache')
-            corr_output = correlations.get('content_vs_output_tokens')
-            corr_agent_output = correlations.get('agent_content_vs_output_tokens')
-            corr_agent_text_output = correlations.get('agent_text_vs_output_tokens')
-            corr_total = correlations.get('content_vs_total_tokens')
-            
             avg_content = correlations.get('avg_content_length', 0)
             avg_user_content = correlations.get('avg_user_content_length', 0)
             avg_agent_content = correlations.get('avg_agent_content_length', 0)
@@ -421,72 +831,79 @@ class ChatUsageCorrelator:
             chars_per_token_output_total = (avg_content / avg_output) if avg_output > 0 else 0
             chars_per_token_no_cache = (avg_content / avg_tokens_no_cache) if avg_tokens_no_cache > 0 else 0
             
-            print("| Type | Correlation | Average | Total |")
-            print("|------|-------------|---------|-------|")
+            def corr_cells(key):
+                corr = correlations.get(key)
+                ci = correlations.get(f"{key}_ci")
+                spearman = correlations.get(f"{key}_spearman")
+                corr_str = f"{corr:.4f}" if corr is not None else "N/A"
+                ci_str = f"[{ci[0]:.4f}, {ci[1]:.4f}]" if ci is not None else "N/A"
+                spearman_str = f"{spearman:.4f}" if spearman is not None else "N/A"
+                return f"{corr_str} | {ci_str} | {spearman_str}"
+            
+            print("| Type | Correlation | 95% CI | Spearman | Average | Total |")
+            print("|------|-------------|--------|----------|---------|-------|")
             
-            corr_str = f"{corr_no_cache:.4f}" if corr_no_cache is not None else "N/A"
             avg_str = f"{avg_tokens_no_cache:,.0f}" if avg_tokens_no_cache > 0 else "0"
             total_str = f"{total_tokens_no_cache:,}" if total_tokens_no_cache > 0 else "0"
-            print(f"| Tokens (excluding cache) | {corr_str} | {avg_str} tokens | {total_str} tokens |")
+            print(f"| Tokens (excluding cache) | {corr_cells('content_vs_tokens_no_cache')} | {avg_str} tokens | {total_str} tokens |")
             
-            corr_str = f"{corr_input_no_cache:.4f}" if corr_input_no_cache is not None else "N/A"
             avg_str = f"{avg_input_no_cache:,.0f}" if avg_input_no_cache > 0 else "0"
             total_str = f"{total_input_no_cache:,}" if total_input_no_cache > 0 else "0"
-            print(f"| Input Tokens (excluding cache) | {corr_str} | {avg_str} tokens | {total_str} tokens |")
+            print(f"| Input Tokens (excluding cache) | {corr_cells('content_vs_input_tokens_no_cache')} | {avg_str} tokens | {total_str} tokens |")
             
-            corr_str = f"{corr_output:.4f}" if corr_output is not None else "N/A"
             avg_str = f"{avg_output:,.0f}" if avg_output > 0 else "0"
             total_str = f"{total_output:,}" if total_output > 0 else "0"
-            print(f"| Output Tokens | {corr_str} | {avg_str} tokens | {total_str} tokens |")
+            print(f"| Output Tokens | {corr_cells('content_vs_output_tokens')} | {avg_str} tokens | {total_str} tokens |")
             
-            corr_str = f"{corr_agent_output:.4f}" if corr_agent_output is not None else "N/A"
-            print(f"| Agent Content (all) vs Output Tokens | {corr_str} | - | - |")
+            print(f"| Agent Content (all) vs Output Tokens | {corr_cells('agent_content_vs_output_tokens')} | - | - |")
             
-            corr_str = f"{corr_agent_text_output:.4f}" if corr_agent_text_output is not None else "N/A"
-            print(f"| Agent Text (no tool calls) vs Output Tokens | {corr_str} | - | - |")
+            print(f"| Agent Text (no tool calls) vs Output Tokens | {corr_cells('agent_text_vs_output_tokens')} | - | - |")
             
-            corr_str = f"{corr_total:.4f}" if corr_total is not None else "N/A"
             avg_str = f"{avg_total:,.0f}" if avg_total > 0 else "0"
             total_str = f"{total_tokens:,}" if total_tokens > 0 else "0"
-            print(f"| Total Tokens (with cache) | {corr_str} | {avg_str} tokens | {total_str} tokens |")
+            print(f"| Total Tokens (with cache) | {corr_cells('content_vs_total_tokens')} | {avg_str} tokens | {total_str} tokens |")
             
             avg_content_str = f"{avg_content:,.0f}" if avg_content > 0 else "0"
             total_content_str = f"{total_content:,}" if total_content > 0 else "0"
-            print(f"| Total Content Length (user+agent) | - | {avg_content_str} characters | {total_content_str} characters |")
+            print(f"| Total Content Length (user+agent) | - | - | - | {avg_content_str} characters | {total_content_str} characters |")
             
             avg_agent_content_str = f"{avg_agent_content:,.0f}" if avg_agent_content > 0 else "0"
             total_agent_content_str = f"{total_agent_content:,}" if total_agent_content > 0 else "0"
-            print(f"| Agent Content Length (all) | - | {avg_agent_content_str} characters | {total_agent_content_str} characters |")
+            print(f"| Agent Content Length (all) | - | - | - | {avg_agent_content_str} characters | {total_agent_content_str} characters |")
             
             avg_agent_text_str = f"{avg_agent_text:,.0f}" if avg_agent_text > 0 else "0"
             total_agent_text_str = f"{total_agent_text:,}" if total_agent_text > 0 else "0"
-            print(f"| Agent Text Length (no tool calls) | - | {avg_agent_text_str} characters | {total_agent_text_str} characters |")
+            print(f"| Agent Text Length (no tool calls) | - | - | - | {avg_agent_text_str} characters | {total_agent_text_str} characters |")
             
             if avg_output > 0 and avg_agent_text > 0 and chars_per_token_output_agent_text > 0:
                 chars_per_token_str = f"{chars_per_token_output_agent_text:.2f}"
-                print(f"| Characters per Token (agent text vs output) | - | {chars_per_token_str} | - |")
+                print(f"| Characters per Token (agent text vs output) | - | - | - | {chars_per_token_str} | - |")
             
             if avg_output > 0 and avg_agent_content > 0 and chars_per_token_output_agent_total > 0:
                 chars_per_token_str = f"{chars_per_token_output_agent_total:.2f}"
-                print(f"| Characters per Token (agent all vs output) | - | {chars_per_token_str} | - |")
+                print(f"| Characters per Token (agent all vs output) | - | - | - | {chars_per_token_str} | - |")
             
             if avg_output > 0 and chars_per_token_output_total > 0:
                 chars_per_token_str = f"{chars_per_token_output_total:.2f}"
-                print(f"| Characters per Token (total content vs output) | - | {chars_per_token_str} | - |")
+                print(f"| Characters per Token (total content vs output) | - | - | - | {chars_per_token_str} | - |")
             
             print()
             print("**Correlation values** are Pearson correlation coefficients (ranging from -1 to +1) measuring the linear relationship between content size and token counts. ")
             print("A value close to +1 indicates a strong positive correlation (larger content = more tokens), ")
             print("while a value close to -1 indicates a strong negative correlation (larger content = fewer tokens). ")
             print("Values near 0 indicate weak or no linear relationship. ")
+            print("The **95% CI** is a bootstrap percentile interval of the Pearson coefficient; **Spearman** is the rank correlation, ")
+            print("which measures any monotonic relationship and is less sensitive to a few very large tasks. ")
             print("Negative correlations may occur when token counts are influenced by factors other than content size, ")
             print("such as caching effects, tokenization differences, or the matching algorithm pairing tasks with usage requests from different contexts.\n")
         
         if unmatched_usage or unmatched_tasks:
-            all_usage_total_tokens = self.usage_cursor.execute("SELECT SUM(total_tokens) FROM usage").fetchone()[0] or 0
-            all_usage_total_input = self.usage_cursor.execute("SELECT SUM(input_with_cache_write + input_without_cache_write + cache_read) FROM usage").fetchone()[0] or 0
-            all_usage_total_output = self.usage_cursor.execute("SELECT SUM(output_tokens) FROM usage").fetchone()[0] or 0
-            all_usage_count = self.usage_cursor.execute("SELECT COUNT(*) FROM usage").fetchone()[0] or 0
+            usage = self.usage_columns()
+            all_usage_total_tokens = int(usage['total_tokens'].sum())
+            all_usage_total_input = int(usage['input_with_cache_write'].sum() + usage['input_without_cache_write'].sum() +
+                                        usage['cache_read'].sum())
+            all_usage_total_output = int(usage['output_tokens'].sum())
+            all_usage_count = len(usage)
             
             total_tasks = stats.get('total_tasks', 0)
             matched_tasks = stats.get('matched_tasks', 0)
@@ -534,21 +951,20 @@ class ChatUsageCorrelator:
             
             print()
     
-    def run(self):
-        print("Extracting message tasks...")
-        tasks = self.get_message_tasks()
-        print(f"Found {len(tasks)} user message tasks\n")
-        
+    def run(self, force: bool = False, period: str = 'day'):
         print("Correlating with usage requests...")
-        correlated, unmatched_tasks, unmatched_usage, stats = self.correlate_tasks_with_usage(tasks, strict_window=600, relaxed_window=7200)
+        tasks, task_matches, matched_usage_ids = self.update_task_usage_matches(strict_window=600, relaxed_window=7200,
+                                                                                force=force)
+        print(f"Found {len(tasks)} user message tasks\n")
+        correlated, unmatched_tasks, unmatched_usage, stats = self.summarize_matches(tasks, task_matches, matched_usage_ids)
         
         print("Calculating correlations...")
         correlations = self.calculate_correlations(correlated)
         
-        print("Calculating daily statistics...")
-        daily_stats = self.calculate_daily_stats(correlated, unmatched_tasks, unmatched_usage, tasks)
+        print(f"Calculating {PERIODS[period].lower()} statistics...")
+        daily_stats = self.calculate_daily_stats(correlated, tasks, period)
         
-        self.print_report(correlated, unmatched_tasks, unmatched_usage, stats, correlations, daily_stats)
+        self.print_report(correlated, unmatched_tasks, unmatched_usage, stats, correlations, daily_stats, period)
     
     def close(self):
         self.chats_conn.close()
@@ -559,6 +975,8 @@ def main():
     parser = argparse.ArgumentParser(description='Correlate chat messages with usage API requests')
     add_db_file_argument(parser, "(chats database)")
     parser.add_argument('--usage-db-file', default=None, help='Path/pattern to usage database file(s) (default: uses --db-file if not specified)')
+    parser.add_argument('--force', action='store_true', help='Match all tasks again instead of only new ones')
+    parser.add_argument('--period', choices=list(PERIODS), default='day', help='Granularity of the statistics table (default: day)')
     
     args = parser.parse_args()
     
@@ -571,7 +989,7 @@ def main():
     
     correlator = ChatUsageCorrelator(chats_db, usage_db)
     try:
-        correlator.run()
+        correlator.run(force=args.force, period=args.period)
     finally:
         correlator.close()
 
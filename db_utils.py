@@ -4,7 +4,7 @@ import argparse
 import os
 import glob
 from contextlib import contextmanager
-from typing import Optional
+from typing import Iterable, Optional
 
 
 DEFAULT_DB_FILE_ERROR = "No database files found. Please specify --db-file or create a database with parse_chats.py"
@@ -95,3 +95,19 @@ def safe_add_column(cursor, table_name: str, column_def: str):
     except sqlite3.OperationalError:
         pass
 
+
+def fill_temp_id_table(cursor, table_name: str, ids: Iterable[int]):
+    """Create or refill a temporary table holding a set of ids.
+    
+    Queries join on the table or use "IN (SELECT id FROM temp.<table_name>)"
+    instead of binding one placeholder per id, which is slow for many ids and
+    fails past SQLite's bound-variable limit.
+    
+    Args:
+        cursor: Database cursor
+        table_name: Name of the temporary table
+        ids: Ids to store; duplicates are stored once
+    """
+    cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {table_name} (id INTEGER PRIMARY KEY)")
+    cursor.execute(f"DELETE FROM temp.{table_name}")
+    cursor.executemany(f"INSERT OR IGNORE INTO temp.{table_name} (id) VALUES (?)", ((id_,) for id_ in ids))
@@ -1,28 +1,21 @@
 #!/usr/bin/env python3
-import sqlite3
 import argparse
 from db_utils import find_db_file
+from task_builder import TaskBuilder
 
 
 def analyze_long_tasks(db_path: str, limit: int = 3):
-    conn = sqlite3.connect(db_path)
+    task_builder = TaskBuilder(db_path)
+    task_builder.refresh_tasks()
+    conn = task_builder.chats_conn
     cursor = conn.cursor()
+    content_reader = task_builder.content_reader
     
     tasks_with_lengths = cursor.execute("""
-        SELECT se.user_msg_id, se.message_count,
-               (SELECT SUM(LENGTH(c.content_text)) 
-                FROM messages m 
-                JOIN content c ON m.id = c.message_id 
-                WHERE m.chat_id = (SELECT chat_id FROM messages WHERE id = se.user_msg_id)
-                AND m.id >= se.user_msg_id
-                AND m.id < COALESCE(
-                    (SELECT MIN(id) FROM messages 
-                     WHERE chat_id = (SELECT chat_id FROM messages WHERE id = se.user_msg_id) 
-                     AND message_type = 'User' AND id > se.user_msg_id),
-                    999999999
-                )) as total_length
+        SELECT se.user_msg_id, se.message_count, t.total_content_length, t.chat_id, t.next_user_msg_id
         FROM task_embeddings se
-        ORDER BY total_length DESC
+        JOIN tasks t ON t.user_msg_id = se.user_msg_id
+        ORDER BY t.total_content_length DESC
         LIMIT ?
     """, (limit,)).fetchall()
     
@@ -32,28 +25,21 @@ def analyze_long_tasks(db_path: str, limit: int = 3):
     
     print(f"Analyzing {len(tasks_with_lengths)} longest tasks:\n")
     
-    for user_msg_id, msg_count, total_length in tasks_with_lengths:
+    for user_msg_id, msg_count, total_length, chat_id, next_user_msg_id in tasks_with_lengths:
         print("=" * 80)
         print(f"Task {user_msg_id}: {msg_count} messages, {total_length:,} total characters\n")
         
-        chat_id = cursor.execute("""
-            SELECT chat_id FROM messages WHERE id = ?
-        """, (user_msg_id,)).fetchone()[0]
-        
+        # The stored task spans the message ids up to the chat's next user message
         messages = cursor.execute("""
-            SELECT m.id, m.message_type, m.content_type, m.content_length, m.summary,
-                   c.content_text
+            SELECT m.id, m.message_type, m.content_type, m.content_length, m.summary
             FROM messages m
-            LEFT JOIN content c ON m.id = c.message_id
             WHERE m.chat_id = ?
             AND m.id >= ?
-            AND m.id < COALESCE(
-                (SELECT MIN(id) FROM messages 
-                 WHERE chat_id = ? AND message_type = 'User' AND id > ?),
-                999999999
-            )
+            AND m.id < COALESCE(?, 9223372036854775807)
             ORDER BY m.message_datetime, m.start_line
-        """, (chat_id, user_msg_id, chat_id, user_msg_id)).fetchall()
+        """, (chat_id, user_msg_id, next_user_msg_id)).fetchall()
+        # Content may be stored as offsets into the export, so it is read through ContentReader
+        messages = [row + (content_reader.get_text(row[0]),) for row in messages]
         
         print("Messages in task:")
         print("-" * 80)
@@ -95,6 +81,7 @@ def analyze_long_tasks(db_path: str, limit: int = 3):
             print(f"... ({len(lines) - 20} more lines)")
         print()
     
+    content_reader.close()
     conn.close()
 
 
@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 import sqlite3
 import argparse
-from typing import List, Dict, Optional
+from typing import Dict, Iterable, Iterator, List, Optional
 import numpy as np
 from dotenv import load_dotenv
 from task_builder import TaskBuilder
@@ -17,7 +17,8 @@ class TaskEmbedder:
         self.chats_cursor = self.chats_conn.cursor()
         self.emb_model = emb_model
         self.client = create_openai_client(emb_url, emb_api_key, 'EMB_API_KEY')
-        self.task_builder = TaskBuilder(chats_db)
+        # Embeddings are stored while tasks are read, so both use one connection
+        self.task_builder = TaskBuilder(chats_db, self.chats_conn)
         context_size_tokens = self._get_model_context_size()
         self.context_size_chars = tokens_to_chars(context_size_tokens)
         self._create_tables()
@@ -65,8 +66,8 @@ class TaskEmbedder:
             parts.append(f"Agent: {summary}")
         return "\n".join(parts)
     
-    def get_message_tasks(self) -> List[Dict]:
-        return self.task_builder.get_message_tasks()
+    def iter_message_tasks(self) -> Iterator[Dict]:
+        return self.task_builder.iter_message_tasks()
     
     def get_embedding(self, text: str) -> Optional[np.ndarray]:
         from llm_utils import retry_with_backoff
@@ -106,9 +107,10 @@ class TaskEmbedder:
         """, (user_msg_id, encoded, message_count, formatted_length))
         self.chats_conn.commit()
     
-    def extract_and_store_embeddings(self, tasks: List[Dict]):
+    def extract_and_store_embeddings(self, tasks: Iterable[Dict], total: Optional[int] = None):
         import sys
-        total = len(tasks)
+        if total is None:
+            total = len(tasks)
         print(f"Extracting embeddings for {total} tasks...")
         sys.stdout.flush()
         
@@ -193,11 +195,11 @@ class TaskEmbedder:
         sys.stdout.flush()
         print("Extracting message tasks...")
         sys.stdout.flush()
-        tasks = self.get_message_tasks()
-        print(f"Found {len(tasks)} user message tasks\n")
+        total = self.task_builder.count_message_tasks()
+        print(f"Found {total} user message tasks\n")
         sys.stdout.flush()
         
-        self.extract_and_store_embeddings(tasks)
+        self.extract_and_store_embeddings(self.iter_message_tasks(), total)
     
     def close(self):
         self.chats_conn.close()
@@ -8,7 +8,7 @@ from datetime import datetime
 from dotenv import load_dotenv
 from task_builder import TaskBuilder
 from llm_utils import tokens_to_chars, chars_to_tokens, get_effective_context_size, create_openai_client, load_api_config, DEFAULT_SUMMARY_PARAMS, get_llm_params, retry_with_backoff, clean_llm_response, get_llm_context_limit_and_max_tokens
-from db_utils import find_db_file, add_db_file_argument
+from db_utils import find_db_file, add_db_file_argument, fill_temp_id_table
 from common_utils import ProgressReporter
 
 
@@ -52,7 +52,7 @@ class GroupSummarizer:
         
         self.input_context_size_chars = tokens_to_chars(self.input_context_size_tokens)
         self.max_group_size_chars = self.input_context_size_chars
-        self.task_builder = TaskBuilder(chats_db)
+        self.task_builder = TaskBuilder(chats_db, self.chats_conn)
         self._create_tables()
         
         summary_prompt_template = os.getenv('SUMMARY_SYSTEM_PROMPT', SUMMARY_SYSTEM_PROMPT)
@@ -90,9 +90,7 @@ class GroupSummarizer:
         for user_msg_id, msg_datetime, chat_id in tasks:
             task = self.task_builder.get_task_for_user_message(user_msg_id)
             if task:
-                task['message_datetime'] = msg_datetime
-                task['chat_id'] = chat_id
-                result.append(task)
+                result.append({**task, 'message_datetime': msg_datetime, 'chat_id': chat_id})
         
         return result
     
@@ -103,12 +101,12 @@ class GroupSummarizer:
         
         stored_lengths = {}
         if user_msg_ids:
-            placeholders = ','.join('?' * len(user_msg_ids))
-            stored_data = self.chats_cursor.execute(f"""
-                SELECT user_msg_id, formatted_length 
-                FROM task_embeddings 
-                WHERE user_msg_id IN ({placeholders})
-            """, user_msg_ids).fetchall()
+            fill_temp_id_table(self.chats_cursor, 'group_user_msg_ids', user_msg_ids)
+            stored_data = self.chats_cursor.execute("""
+                SELECT te.user_msg_id, te.formatted_length
+                FROM task_embeddings te
+                JOIN temp.group_user_msg_ids g ON g.id = te.user_msg_id
+            """).fetchall()
             stored_lengths = {user_msg_id: length for user_msg_id, length in stored_data}
         
         parts = []
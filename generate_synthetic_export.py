@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+import random
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, TextIO
+
+
+# (data-tool-type, data-tool-name, summary template) of the tool-use blocks written
+TOOLS = [
+    ('read', 'read_file', 'Read file: src/{module}.py'),
+    ('write', 'search_replace', 'Edit file: src/{module}.py'),
+    ('bash', 'run_terminal_cmd', 'Run command: python -m pytest -q tests/test_{module}.py'),
+    ('grep', 'grep', 'Grep for "{word}" in src'),
+    ('search', 'codebase_search', 'Searched codebase "where is {word} handled"'),
+    ('generic', 'todo_write', 'Todo List'),
+]
+
+WORDS = ['parser', 'config', 'session', 'cache', 'index', 'request', 'handler', 'buffer', 'record', 'worker',
+         'schema', 'token', 'stream', 'filter', 'report', 'batch', 'queue', 'result', 'client', 'module']
+
+
+def _words(rng: random.Random, count: int) -> str:
+    return ' '.join(rng.choice(WORDS) for _ in range(count))
+
+
+def _user_lines(rng: random.Random, message_lines: int) -> List[str]:
+    return [f"Please {_words(rng, rng.randint(3, 12))}.\n" for _ in range(rng.randint(1, message_lines))]
+
+
+def _tool_use_lines(rng: random.Random, message_lines: int) -> List[str]:
+    tool_type, tool_name, template = rng.choice(TOOLS)
+    summary = template.format(module=rng.choice(WORDS), word=rng.choice(WORDS))
+    lines = [f'<tool-use data-tool-type="{tool_type}" data-tool-name="{tool_name}">\n',
+             f'<details><summary>Tool use: **{tool_name}** • {summary}</summary>\n', '\n']
+    for i in range(rng.randint(0, message_lines)):
+        lines.append(f"{i + 1:>4}| {rng.choice(WORDS)} = {_words(rng, rng.randint(1, 8))}\n")
+    lines.extend(['</details>\n', '</tool-use>\n'])
+    return lines
+
+
+def _think_lines(rng: random.Random, message_lines: int) -> List[str]:
+    lines = ['<think><details><summary>Thought Process</summary>\n']
+    lines.extend(f"I should check the {_words(rng, rng.randint(2, 10))}.\n"
+                 for _ in range(rng.randint(1, message_lines)))
+    lines.append('</details></think>\n')
+    return lines
+
+
+def _text_lines(rng: random.Random, message_lines: int) -> List[str]:
+    lines = [f"The {_words(rng, rng.randint(2, 10))} now works.\n" for _ in range(rng.randint(1, message_lines))]
+    if rng.random() < 0.3:
+        # Code blocks may contain separator lines, which must not end the message
+        lines.extend(['\n', '```python\n', f"{rng.choice(WORDS)} = 1\n", '---\n', f"{rng.choice(WORDS)} = 2\n",
+                      '```\n'])
+    return lines
+
+
+def generate_export(out: TextIO, chats: int = 100, user_messages: int = 3, tool_uses: int = 3, thinks: int = 1,
+                    texts: int = 1, message_lines: int = 10, seed: int = 0) -> Dict[str, int]:
+    """Write a synthetic SpecStory markdown export.
+    
+    Every chat has user_messages user messages, each answered by tool_uses
+    tool-use blocks, thinks think blocks and texts text blocks in random
+    order, all separated by '---' like a real export. Message sizes vary
+    randomly up to message_lines lines; the output is reproducible for a seed.
+    
+    Args:
+        out: Text stream to write to
+        chats: Number of chats
+        user_messages: User messages per chat
+        tool_uses: Tool-use blocks per user message
+        thinks: Think blocks per user message
+        texts: Agent text blocks per user message
+        message_lines: Maximum number of content lines per message
+        seed: Random seed
+    
+    Returns:
+        Counts of what was written: chats, user_messages, agent_messages,
+        tool_uses, thinks, lines and bytes
+    """
+    rng = random.Random(seed)
+    counts = dict.fromkeys(('chats', 'user_messages', 'agent_messages', 'tool_uses', 'thinks', 'lines', 'bytes'), 0)
+    
+    def write(lines: List[str]):
+        chunk = ''.join(lines)
+        out.write(chunk)
+        counts['lines'] += len(lines)
+        counts['bytes'] += len(chunk.encode('utf-8'))
+    
+    write(['<!-- Generated by SpecStory -->\n', '\n'])
+    timestamp = datetime(2025, 1, 1, 9, 0)
+    for chat_num in range(chats):
+        timestamp += timedelta(minutes=rng.randint(5, 600))
+        write([f"# {_words(rng, rng.randint(2, 6)).capitalize()} {chat_num} ({timestamp:%Y-%m-%d %H:%MZ})\n", '\n'])
+        counts['chats'] += 1
+        for _ in range(user_messages):
+            timestamp += timedelta(minutes=rng.randint(1, 10))
+            write([f"_**User ({timestamp:%Y-%m-%d %H:%MZ})**_\n", '\n'] + _user_lines(rng, message_lines) +
+                  ['\n', '---\n', '\n'])
+            counts['user_messages'] += 1
+            
+            blocks = ['tool_use'] * tool_uses + ['think'] * thinks + ['text'] * texts
+            rng.shuffle(blocks)
+            if not blocks:
+                continue
+            write(['_**Agent (model gpt-5, mode Agent)**_\n', '\n'])
+            for block in blocks:
+                if block == 'tool_use':
+                    lines = _tool_use_lines(rng, message_lines)
+                    counts['tool_uses'] += 1
+                elif block == 'think':
+                    lines = _think_lines(rng, message_lines)
+                    counts['thinks'] += 1
+                else:
+                    lines = _text_lines(rng, message_lines)
+                write(lines + ['\n', '---\n', '\n'])
+                counts['agent_messages'] += 1
+    return counts
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Write a synthetic SpecStory markdown export for testing and benchmarks')
+    parser.add_argument('md_file', help='Path of markdown file to write')
+    parser.add_argument('--chats', type=int, default=100, help='Number of chats (default: 100)')
+    parser.add_argument('--user-messages', type=int, default=3, help='User messages per chat (default: 3)')
+    parser.add_argument('--tool-uses', type=int, default=3, help='Tool-use blocks per user message (default: 3)')
+    parser.add_argument('--thinks', type=int, default=1, help='Think blocks per user message (default: 1)')
+    parser.add_argument('--texts', type=int, default=1, help='Agent text blocks per user message (default: 1)')
+    parser.add_argument('--message-lines', type=int, default=10, help='Maximum content lines per message (default: 10)')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed (default: 0)')
+    
+    args = parser.parse_args()
+    
+    with open(args.md_file, 'w', encoding='utf-8') as f:
+        counts = generate_export(f, chats=args.chats, user_messages=args.user_messages, tool_uses=args.tool_uses,
+                                 thinks=args.thinks, texts=args.texts, message_lines=args.message_lines,
+                                 seed=args.seed)
+    print(f"Wrote {args.md_file}: {counts['chats']} chats, {counts['user_messages']} user and "
+          f"{counts['agent_messages']} agent messages ({counts['tool_uses']} tool uses, {counts['thinks']} thinks), "
+          f"{counts['lines']:,} lines, {counts['bytes']:,} bytes")
+
+
+if __name__ == '__main__':
+    main()
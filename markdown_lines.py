@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+import os
+import re
+import hashlib
+from array import array
+from typing import BinaryIO, Callable, Iterator, List, Optional, Tuple
+
+
+# Line kinds assigned by classify_line(). They are bit flags because a line can be
+# several things at once, e.g. a message marker that also closes a tool-use block.
+TEXT = 0
+BLANK = 1
+CHAT_HEADER = 2
+MARKER = 4
+USER_MARKER = 8
+AGENT_MARKER = 16
+SEPARATOR = 32
+CODE_FENCE = 64
+TOOL_USE_OPEN = 128
+TOOL_USE_CLOSE = 256
+THINK = 512
+
+CHAT_HEADER_RE = re.compile(r'^# (.+?)\s*\((.+?)\)')
+
+# Only lines whose first non-blank character is one of these, or that contain '<', can be
+# anything but TEXT or BLANK
+_SPECIAL_PREFIXES = ('_', '#', '-', '`')
+
+
+def classify_line(line: str) -> int:
+    """Classify a markdown line into TEXT or a combination of line-kind flags.
+
+    Args:
+        line: Line including its newline
+
+    Returns:
+        Bitwise OR of the flags that apply to the line
+    """
+    stripped = line.strip()
+    if not stripped:
+        return BLANK
+    if not stripped.startswith(_SPECIAL_PREFIXES) and '<' not in line:
+        return TEXT
+    kind = TEXT
+    if line.startswith('_**'):
+        kind = MARKER
+        if line.startswith('_**User'):
+            kind |= USER_MARKER
+        elif line.startswith('_**Agent'):
+            kind |= AGENT_MARKER
+    elif line.startswith('# ') and CHAT_HEADER_RE.match(line):
+        kind = CHAT_HEADER
+    if stripped == '---':
+        kind |= SEPARATOR
+    elif stripped.startswith('```'):
+        kind |= CODE_FENCE
+    if '<' in line:
+        if '<tool-use' in line:
+            kind |= TOOL_USE_OPEN
+        if '</tool-use>' in line:
+            kind |= TOOL_USE_CLOSE
+        if '<think>' in line:
+            kind |= THINK
+    return kind
+
+
+def classify_lines(lines: List[str]) -> List[int]:
+    """Classify every line once; the result is indexed like lines.
+
+    Plain text and blank lines, the bulk of an export, are recognized inline
+    and only the remaining lines go through classify_line().
+    """
+    kinds = []
+    append = kinds.append
+    for line in lines:
+        stripped = line.lstrip()
+        if not stripped:
+            append(BLANK)
+        elif stripped.startswith(_SPECIAL_PREFIXES) or '<' in line:
+            append(classify_line(line))
+        else:
+            append(TEXT)
+    return kinds
+
+
+# A line ending in '\n', '\r\n' or a lone '\r', or the unterminated last line
+_RAW_LINE_RE = re.compile(rb'[^\r\n]*(?:\r\n?|\n)|[^\r\n]+')
+
+
+def decode_line(raw: bytes) -> str:
+    """Decode a raw line, normalizing '\r\n' and '\r' endings to '\n' like text mode does."""
+    line = raw.decode('utf-8')
+    if line.endswith('\r\n'):
+        line = line[:-2] + '\n'
+    elif line.endswith('\r'):
+        line = line[:-1] + '\n'
+    return line
+
+
+def iter_raw_lines(f: BinaryIO) -> Iterator[bytes]:
+    """Yield raw lines from the current position of a binary file, split the way text mode splits them.
+
+    Lines end at '\n', '\r\n' or a lone '\r' (universal newlines), so line
+    numbers match open(path, 'r').readlines() while byte offsets stay exact.
+    """
+    for raw in f:
+        if b'\r' in raw:
+            yield from _RAW_LINE_RE.findall(raw)
+        else:
+            yield raw
+
+
+def raw_line_reader(f: BinaryIO, lone_cr: bool = True) -> Callable[[], bytes]:
+    """Function returning the next raw line of f, or b'' at the end, as split by iter_raw_lines().
+
+    Files without a lone '\r' split the same at '\n' only, so f.readline is used for them.
+    """
+    if not lone_cr:
+        return f.readline
+    lines = iter_raw_lines(f)
+    return lambda: next(lines, b'')
+
+
+def scan_file(filepath: str) -> Tuple[str, bool]:
+    """SHA-256 of a file and whether it has a lone '\r', which text mode reads as a line end."""
+    hasher = hashlib.sha256()
+    lone_cr = False
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            # Chunks end at a line end, so no '\r\n' is split between two of them
+            chunk += f.readline()
+            hasher.update(chunk)
+            if not lone_cr and b'\r' in chunk:
+                lone_cr = chunk.count(b'\r') != chunk.count(b'\r\n')
+    return hasher.hexdigest(), lone_cr
+
+
+def count_lines(filepath: str) -> int:
+    """Count lines in a text file without loading it into memory.
+
+    Args:
+        filepath: Path to text file
+
+    Returns:
+        Number of lines, as f.readlines() in text mode would return them
+    """
+    with open(filepath, 'rb') as f:
+        return sum(1 for _ in iter_raw_lines(f))
+
+
+class StreamingLines:
+    """List-like lazy view over lines [start_line, end_line) of a text file.
+
+    Lines are read on demand and kept in a look-ahead buffer until release() is
+    called, so memory depends on how far the parser looks ahead rather than on
+    file size. Indexes are absolute 0-indexed line numbers, exactly like indexes
+    into the list returned by f.readlines(); lines before start_line are never
+    read and cannot be accessed. Lines are classified as they are read and
+    their kinds are available through the kinds attribute; byte_offset() gives
+    where a buffered line starts in the file.
+    """
+
+    def __init__(self, filepath: str, start_line: int = 0, end_line: Optional[int] = None,
+                 line_index: Optional['LineIndex'] = None):
+        """Open a lazy view over a file.
+
+        Args:
+            filepath: Path to text file
+            start_line: First line of the view (0-indexed)
+            end_line: Line to stop at (0-indexed, exclusive), None for whole file
+            line_index: Index of the file, used to seek to start_line and to get
+                the line count (lines are skipped and counted if None)
+        """
+        total = line_index.line_count if line_index is not None else count_lines(filepath)
+        self._length = total if end_line is None else min(total, end_line)
+        self._file: BinaryIO = open(filepath, 'rb')
+        self._next_byte_offset = line_index.line_offset(start_line + 1) if line_index is not None else 0
+        self._file.seek(self._next_byte_offset)
+        self._readline = raw_line_reader(self._file, line_index.lone_cr if line_index is not None else True)
+        if line_index is None:
+            for _ in range(start_line):
+                self._next_byte_offset += len(self._readline())
+        self._buffer: List[str] = []
+        self._kinds: List[int] = []
+        self._byte_offsets: List[int] = []
+        self._offset = start_line
+        self.peak_buffered = 0
+        self.kinds = _StreamingKinds(self)
+
+    def __len__(self) -> int:
+        return self._length
+
+    def _fill(self, idx: int):
+        needed = idx - self._offset + 1 - len(self._buffer)
+        for _ in range(needed):
+            raw = self._readline()
+            line = decode_line(raw)
+            self._buffer.append(line)
+            self._kinds.append(classify_line(line))
+            self._byte_offsets.append(self._next_byte_offset)
+            self._next_byte_offset += len(raw)
+        if len(self._buffer) > self.peak_buffered:
+            self.peak_buffered = len(self._buffer)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            start, stop, step = idx.indices(self._length)
+            if start >= stop:
+                return []
+            self._check_released(start)
+            self._fill(stop - 1)
+            return self._buffer[start - self._offset:stop - self._offset:step]
+
+        if idx < 0:
+            idx += self._length
+        if idx < 0 or idx >= self._length:
+            raise IndexError("line index out of range")
+        self._check_released(idx)
+        self._fill(idx)
+        return self._buffer[idx - self._offset]
+
+    def _check_released(self, idx: int):
+        if idx < self._offset:
+            raise IndexError(f"line {idx} was already released (buffer starts at {self._offset})")
+
+    def release(self, idx: int):
+        """Drop buffered lines before idx; they can no longer be accessed."""
+        drop = min(idx, self._offset + len(self._buffer)) - self._offset
+        if drop > 0:
+            del self._buffer[:drop]
+            del self._kinds[:drop]
+            del self._byte_offsets[:drop]
+            self._offset += drop
+        if idx > self._offset:
+            for _ in range(min(idx, self._length) - self._offset):
+                self._next_byte_offset += len(self._readline())
+            self._offset = idx
+
+    def kind(self, idx: int) -> int:
+        """Line-kind flags of a line, see classify_line()."""
+        if idx < 0 or idx >= self._length:
+            raise IndexError("line index out of range")
+        self._check_released(idx)
+        self._fill(idx)
+        return self._kinds[idx - self._offset]
+
+    def byte_offset(self, idx: int) -> int:
+        """Byte offset in the file where a line starts; len(self) gives the end of the view."""
+        if idx < 0 or idx > self._length:
+            raise IndexError("line index out of range")
+        self._check_released(idx)
+        if idx == self._length:
+            self._fill(idx - 1)
+            return self._next_byte_offset
+        self._fill(idx)
+        return self._byte_offsets[idx - self._offset]
+
+    def close(self):
+        self._file.close()
+
+
+class _StreamingKinds:
+    """Index-only view of StreamingLines.kind(), so kinds[i] works like for a list."""
+
+    def __init__(self, lines: StreamingLines):
+        self._lines = lines
+
+    def __getitem__(self, idx: int) -> int:
+        return self._lines.kind(idx)
+
+
+class LineIndex:
+    """Sparse byte-offset index of line starts in a text file.
+
+    The offset of every CHECKPOINT_INTERVAL-th line is kept, so any line can be
+    reached with one seek and at most CHECKPOINT_INTERVAL - 1 readline calls.
+    The index is persisted in the line_index table and reused while the file
+    size, mtime and SHA-256 are unchanged. Lines are split like in text mode,
+    at '\n', '\r\n' and lone '\r' (see iter_raw_lines()), and their endings are
+    normalized to '\n' when decoded.
+    """
+
+    CHECKPOINT_INTERVAL = 256
+
+    def __init__(self, filepath: str, offsets: array, line_count: int, file_size: int,
+                 file_mtime_ns: int, file_hash: str, lone_cr: bool = True):
+        self.filepath = filepath
+        self.offsets = offsets
+        self.line_count = line_count
+        self.file_size = file_size
+        self.file_mtime_ns = file_mtime_ns
+        self.file_hash = file_hash
+        self.lone_cr = lone_cr
+        self._file = open(filepath, 'rb')
+        self._readline = self._file.readline
+        self._position = 0
+
+    @classmethod
+    def build(cls, filepath: str) -> 'LineIndex':
+        """Scan the file, recording checkpoint offsets, the file SHA-256 and whether it has lone '\r's."""
+        stat = os.stat(filepath)
+        file_hash, lone_cr = scan_file(filepath)
+        offsets = array('Q')
+        line_count = 0
+        pos = 0
+        with open(filepath, 'rb') as f:
+            for line in iter_raw_lines(f) if lone_cr else f:
+                if line_count % cls.CHECKPOINT_INTERVAL == 0:
+                    offsets.append(pos)
+                pos += len(line)
+                line_count += 1
+        return cls(filepath, offsets, line_count, stat.st_size, stat.st_mtime_ns, file_hash, lone_cr)
+
+    @classmethod
+    def load_or_build(cls, conn, filepath: str) -> 'LineIndex':
+        """Load the stored index for filepath, rebuilding and storing it if the file changed.
+
+        Args:
+            conn: SQLite connection holding the line_index table
+            filepath: Path to indexed text file
+
+        Returns:
+            LineIndex matching the current file contents
+        """
+        cursor = conn.cursor()
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS line_index (
+                file_path TEXT PRIMARY KEY,
+                file_size INTEGER,
+                file_mtime_ns INTEGER,
+                file_hash TEXT,
+                checkpoint_interval INTEGER,
+                line_count INTEGER,
+                offsets BLOB
+            )
+        """)
+        key = os.path.abspath(filepath)
+        stat = os.stat(filepath)
+        row = cursor.execute("""
+            SELECT file_size, file_mtime_ns, file_hash, checkpoint_interval, line_count, offsets
+            FROM line_index WHERE file_path = ?
+        """, (key,)).fetchone()
+        # Size rules a stored index out cheaply; otherwise the file hash decides, which catches edits
+        # that keep size and mtime and keeps the index of a file that was only touched
+        if row and row[0] == stat.st_size and row[3] == cls.CHECKPOINT_INTERVAL:
+            file_hash, lone_cr = scan_file(filepath)
+            if row[2] == file_hash:
+                if row[1] != stat.st_mtime_ns:
+                    cursor.execute("UPDATE line_index SET file_mtime_ns = ? WHERE file_path = ?",
+                                   (stat.st_mtime_ns, key))
+                    conn.commit()
+                offsets = array('Q')
+                offsets.frombytes(row[5])
+                return cls(filepath, offsets, row[4], row[0], stat.st_mtime_ns, file_hash, lone_cr)
+
+        index = cls.build(filepath)
+        cursor.execute("""
+            INSERT OR REPLACE INTO line_index
+                (file_path, file_size, file_mtime_ns, file_hash, checkpoint_interval, line_count, offsets)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        """, (key, index.file_size, index.file_mtime_ns, index.file_hash, cls.CHECKPOINT_INTERVAL,
+              index.line_count, index.offsets.tobytes()))
+        conn.commit()
+        return index
+
+    def _seek_line(self, line_num: int):
+        idx = line_num - 1
+        checkpoint = idx // self.CHECKPOINT_INTERVAL
+        self._position = self.offsets[checkpoint]
+        self._file.seek(self._position)
+        self._readline = raw_line_reader(self._file, self.lone_cr)
+        for _ in range(idx - checkpoint * self.CHECKPOINT_INTERVAL):
+            self._position += len(self._readline())
+
+    def line_offset(self, line_num: int) -> int:
+        """Byte offset where a line (1-indexed) starts, or the file size past the last line."""
+        if line_num > self.line_count:
+            return self.file_size
+        self._seek_line(line_num)
+        return self._position
+
+    def hash_lines(self, start_line_num: int, end_line_num: int) -> str:
+        """SHA-256 of the raw bytes of lines start_line_num..end_line_num (1-indexed, inclusive)."""
+        start = self.line_offset(start_line_num)
+        remaining = self.line_offset(end_line_num + 1) - start
+        hasher = hashlib.sha256()
+        self._file.seek(start)
+        while remaining > 0:
+            chunk = self._file.read(min(remaining, 1 << 20))
+            if not chunk:
+                break
+            hasher.update(chunk)
+            remaining -= len(chunk)
+        return hasher.hexdigest()
+
+    def read_line(self, line_num: int) -> Optional[str]:
+        """Read a specific line (1-indexed), or None if the file is shorter."""
+        if line_num < 1 or line_num > self.line_count:
+            return None
+        self._seek_line(line_num)
+        return decode_line(self._readline())
+
+    def iter_lines(self, start_line_num: int = 1) -> Iterator[Tuple[int, str]]:
+        """Yield (line_num, line) pairs from start_line_num (1-indexed) to end of file."""
+        start_line_num = max(1, start_line_num)
+        if start_line_num > self.line_count:
+            return
+        self._seek_line(start_line_num)
+        for line_num in range(start_line_num, self.line_count + 1):
+            yield line_num, decode_line(self._readline())
+
+    def close(self):
+        self._file.close()
@@ -4,14 +4,44 @@ import re
 import sqlite3
 import argparse
 import os
-from typing import Optional, List
-from db_utils import safe_add_column
+import io
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout
+from bisect import bisect_left
+from collections import defaultdict
+from itertools import islice, repeat
+from typing import Optional, List, Dict, Tuple
+from db_utils import safe_add_column, fill_temp_id_table
+from content_utils import (create_content_source_table, create_content_dictionaries_table, train_dictionary,
+                           compress_text)
+from markdown_lines import (StreamingLines, LineIndex, classify_lines, CHAT_HEADER_RE, BLANK, CHAT_HEADER,
+                            MARKER, USER_MARKER, AGENT_MARKER, SEPARATOR, CODE_FENCE, TOOL_USE_OPEN,
+                            TOOL_USE_CLOSE)
+
+
+MESSAGE_COLUMNS = ('id', 'chat_id', 'message_type', 'message_datetime', 'summary', 'data_tool_type',
+                   'data_tool_name', 'content_type', 'content_length', 'start_line', 'end_line')
+
+USER_MESSAGE_RE = re.compile(r'^_\*\*User\s*\((.+?)\)\*\*_')
+AGENT_MESSAGE_RE = re.compile(r'^_\*\*Agent\s*(?:\((.+?)\))?.*\*\*_')
+AGENT_DATETIME_RE = re.compile(r'\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}Z')
+
+# (dimension, key expression, condition) of the chat_stats rollup, over messages m joined to chats c
+CHAT_STATS_DIMENSIONS = (
+    ('messages', "''", "1"),
+    ('message_type', 'm.message_type', 'm.message_type IS NOT NULL'),
+    ('agent_content_type', 'm.content_type', "m.message_type = 'Agent' AND m.content_type IS NOT NULL"),
+    ('tool_type', 'm.data_tool_type', 'm.data_tool_type IS NOT NULL'),
+    ('tool_name', 'm.data_tool_name', 'm.data_tool_name IS NOT NULL'),
+    ('day', 'SUBSTR(c.chat_datetime, 1, 10)', 'c.chat_datetime IS NOT NULL'),
+)
 
 
 class ChatParser:
     def __init__(self, db_path: str = "chats.db", max_lines: Optional[int] = None, 
                  max_chats: Optional[int] = None, max_messages: Optional[int] = None,
-                 start_chat: int = 0):
+                 start_chat: int = 0, streaming: bool = False, batch_chats: int = 100, workers: int = 1,
+                 content_offsets: bool = False, compress_content: bool = False):
         self.conn = sqlite3.connect(db_path)
         self.cursor = self.conn.cursor()
         self._create_tables()
@@ -21,10 +51,33 @@ class ChatParser:
         self.max_chats = max_chats
         self.max_messages = max_messages
         self.start_chat = start_chat
+        self.streaming = streaming
+        self.batch_chats = max(1, batch_chats)
+        self.workers = max(1, workers)
+        self.content_offsets = content_offsets
+        self.compress_content = compress_content
+        self.content_dictionary: Optional[Tuple[int, bytes]] = None
+        self.report_progress = True
         self.chat_count = 0
         self.message_count = 0
         self.chats_skipped = 0
         self.current_chat_start = None
+        self.last_progress_report = 0
+        self.resumed_chat_ids = []
+        self.kept_chat_starts = {}
+        self.line_index: Optional[LineIndex] = None
+        # Line-kind flags of the lines being parsed, from markdown_lines.classify_lines()
+        self.kinds: List[int] = []
+        # Most lines a StreamingLines look-ahead buffer held at once
+        self.peak_buffered_lines = 0
+        
+        # Rows built in memory and flushed with executemany once per batch_chats chats
+        self.pending_chats = {}
+        self.pending_messages = []
+        self.pending_content = []
+        self.current_chat_messages = []
+        self.next_chat_id = 1
+        self.next_message_id = 1
         
         # Load truncation limits from environment with defaults
         self.user_text_max_lines = int(os.getenv('USER_TEXT_MAX_LINES', '20'))
@@ -38,7 +91,9 @@ class ChatParser:
                 title TEXT,
                 chat_datetime TEXT,
                 start_line INTEGER,
-                end_line INTEGER
+                end_line INTEGER,
+                content_hash TEXT,
+                start_offset INTEGER
             )
         """)
         
@@ -46,6 +101,8 @@ class ChatParser:
         if existing_chats > 0:
             safe_add_column(self.cursor, 'chats', 'start_line INTEGER')
             safe_add_column(self.cursor, 'chats', 'end_line INTEGER')
+        safe_add_column(self.cursor, 'chats', 'content_hash TEXT')
+        safe_add_column(self.cursor, 'chats', 'start_offset INTEGER')
         
         self.cursor.execute("""
             CREATE TABLE IF NOT EXISTS messages (
@@ -70,107 +127,289 @@ class ChatParser:
             safe_add_column(self.cursor, 'messages', 'start_line INTEGER')
             safe_add_column(self.cursor, 'messages', 'end_line INTEGER')
             safe_add_column(self.cursor, 'messages', 'agent_summary TEXT')
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_chat_id ON messages(chat_id)")
         
         self.cursor.execute("""
             CREATE TABLE IF NOT EXISTS content (
                 message_id INTEGER PRIMARY KEY,
                 content_text TEXT,
+                text_length INTEGER,
+                dictionary_id INTEGER,
+                source_offset INTEGER,
+                source_length INTEGER,
                 FOREIGN KEY (message_id) REFERENCES messages(id)
             )
         """)
+        safe_add_column(self.cursor, 'content', 'text_length INTEGER')
+        safe_add_column(self.cursor, 'content', 'dictionary_id INTEGER')
+        safe_add_column(self.cursor, 'content', 'source_offset INTEGER')
+        safe_add_column(self.cursor, 'content', 'source_length INTEGER')
+        create_content_source_table(self.cursor)
+        create_content_dictionaries_table(self.cursor)
+        
+        has_chat_stats = self.cursor.execute("""
+            SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_stats'
+        """).fetchone()
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS chat_stats (
+                dimension TEXT,
+                key TEXT,
+                count INTEGER,
+                length_count INTEGER,
+                total_length INTEGER,
+                PRIMARY KEY (dimension, key)
+            )
+        """)
+        if not has_chat_stats and existing_chats > 0:
+            # Database parsed before the rollup was kept, build it once from scratch
+            self._update_chat_stats("1", [{}], 1)
+            self._add_chat_count(existing_chats)
         
         self.conn.commit()
     
     def parse_file(self, filepath: str):
         self.filepath = filepath
+        line_index = self._get_line_index(filepath)
+        end_line = line_index.line_count
+        if self.max_lines:
+            end_line = min(end_line, self.max_lines)
+        
+        segments = self._plan_incremental_parse(line_index, end_line)
+        if self.compress_content:
+            self.content_dictionary = self._load_content_dictionary()
+            if self.content_dictionary is None and \
+                    self.cursor.execute("SELECT 1 FROM content WHERE typeof(content_text) = 'text' LIMIT 1").fetchone():
+                # Content stored by an earlier run without --compress-content
+                self._train_content_dictionary(self._sample_content('tool_call', 1000) or
+                                               self._sample_content('text', 1000))
+                self._compress_stored_content()
+        self.next_chat_id = self._next_autoincrement_id('chats')
+        self.next_message_id = self._next_autoincrement_id('messages')
+        
+        if self.workers > 1 and (self.max_chats or self.max_messages or self.start_chat):
+            print("--max-chats, --max-messages and --start-chat need sequential parsing, using 1 worker")
+            self.workers = 1
+        
+        # Content offsets are byte positions, which only StreamingLines tracks. LineIndex and
+        # StreamingLines split lines like text mode, so every path sees the same line numbers.
+        if segments == [(0, end_line, None)] and not self.streaming and not self.content_offsets and \
+                self.workers == 1:
+            with open(filepath, 'r', encoding='utf-8') as f:
+                lines = list(islice(f, end_line))
+            self._parse_lines(lines, 0)
+        else:
+            position = 0
+            continue_idx = None
+            for start_idx, end_idx, resume_chat_id in segments:
+                if self._limits_reached():
+                    break
+                if end_idx <= position:
+                    continue
+                if continue_idx is not None:
+                    # The previous segment ran over chats kept from the last parse, which
+                    # were deleted, so pick up where it stopped
+                    start_idx, resume_chat_id, continue_idx = continue_idx, None, None
+                if start_idx >= end_idx:
+                    continue
+                position = self._parse_segment(filepath, line_index, start_idx, end_idx, end_line, resume_chat_id)
+                if position > end_idx:
+                    continue_idx = self._delete_overrun_chats(end_idx, position)
         
-        start_line = self._find_start_position(filepath)
-        
-        with open(filepath, 'r', encoding='utf-8') as f:
-            if self.max_lines:
-                lines = []
-                for i, line in enumerate(f):
-                    if i < start_line:
-                        continue
-                    if i >= self.max_lines:
-                        break
-                    lines.append(line)
-            else:
-                for i in range(start_line):
-                    f.readline()
-                lines = f.readlines()
+        self._flush_pending()
+        self._update_resumed_chat_hashes()
+        self._record_content_source(line_index)
         
-        total_lines = len(lines) + start_line
-        i = 0
-        last_progress_report = 0
+        if self.message_count > 0:
+            print(f"\nParsing complete: {self.message_count} messages parsed in {self.chat_count} chats")
+        if self.peak_buffered_lines:
+            print(f"Look-ahead buffer peak: {self.peak_buffered_lines} lines")
+    
+    def _parse_segment(self, filepath: str, line_index: LineIndex, start_idx: int, end_idx: int, end_line: int,
+                       resume_chat_id: Optional[int]) -> int:
+        """Parse from start_idx up to the first chat starting at or after end_idx.
+        
+        Lines past end_idx are only parsed if a message started before it runs
+        on, the way it would in a parse of the whole file.
+        
+        Returns:
+            Index where parsing stopped, end_idx unless a message ran past it
+        """
+        stop_chat_idx = end_idx if end_idx < end_line else None
+        if self.workers > 1 and resume_chat_id is None:
+            return self._parse_segment_parallel(filepath, line_index, start_idx, end_line, stop_chat_idx)
+        self.current_chat_id = resume_chat_id
+        self.current_chat_messages = []
+        lines = StreamingLines(filepath, start_idx, end_line, line_index)
+        try:
+            return self._parse_lines(lines, start_idx, stop_chat_idx)
+        finally:
+            self.peak_buffered_lines = max(self.peak_buffered_lines, lines.peak_buffered)
+            lines.close()
+    
+    def _delete_overrun_chats(self, end_idx: int, stop_idx: int) -> Optional[int]:
+        """Delete kept chats starting in [end_idx, stop_idx), which a re-parsed message ran over.
+        
+        Returns:
+            Index to continue parsing from, or None if stop_idx is the start of a kept chat
+        """
+        overrun = [start_idx for start_idx in self.kept_chat_starts if end_idx <= start_idx < stop_idx]
+        chat_ids = [self.kept_chat_starts.pop(start_idx) for start_idx in overrun]
+        print(f"  New lines before line {stop_idx + 1} extend an earlier message over {len(chat_ids)} unchanged chats")
+        self._delete_chats(chat_ids)
+        self.resumed_chat_ids = [chat_id for chat_id in self.resumed_chat_ids if chat_id not in chat_ids]
+        return None if stop_idx in self.kept_chat_starts else stop_idx
+    
+    def _parse_segment_parallel(self, filepath: str, line_index: LineIndex, start_idx: int, end_idx: int,
+                                stop_chat_idx: Optional[int] = None) -> int:
+        """Parse lines [start_idx, end_idx) in a process pool, split at chat headers.
+        
+        Each worker parses its chunk and keeps going until the first chat that
+        starts at or after the next chunk, so it reports where the sequential
+        parser would have started that chat. Chunks are merged in file order
+        with ids remapped; a chunk whose start does not line up with where the
+        previous one stopped (its header was inside a message) is re-parsed
+        from the right position, so results match a single-process parse.
+        
+        Returns:
+            Index where parsing stopped, see _parse_lines()
+        """
+        chunk_starts = self._chunk_starts(line_index, start_idx,
+                                          end_idx if stop_chat_idx is None else stop_chat_idx)
+        stops = chunk_starts[1:] + [stop_chat_idx]
+        index_state = (line_index.offsets, line_index.line_count, line_index.file_size,
+                       line_index.file_mtime_ns, line_index.file_hash, line_index.lone_cr)
+        print(f"Parsing {len(chunk_starts)} chunks with {self.workers} worker processes")
+        sys.stdout.flush()
+        
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            results = pool.map(_parse_chunk, repeat(filepath), repeat(index_state), chunk_starts,
+                               repeat(end_idx), stops, repeat(self.content_offsets))
+            position = start_idx
+            for chunk_start, stop_idx, result in zip(chunk_starts, stops, results):
+                if stop_idx is not None and position >= stop_idx:
+                    continue
+                if chunk_start != position:
+                    result = _parse_chunk(filepath, index_state, position, end_idx, stop_idx,
+                                          self.content_offsets)
+                position = self._merge_chunk(result)
+        self.current_chat_id = None
+        return position
+    
+    def _chunk_starts(self, line_index: LineIndex, start_idx: int, end_idx: int) -> List[int]:
+        """Pick chunk start lines (0-indexed) at chat headers, about four chunks per worker."""
+        target_size = max(1, (end_idx - start_idx) // (self.workers * 4))
+        chunk_starts = [start_idx]
+        for line_num, line in line_index.iter_lines(start_idx + 1):
+            if line_num > end_idx:
+                break
+            if line_num - 1 - chunk_starts[-1] >= target_size and line.startswith('# ') and \
+                    CHAT_HEADER_RE.match(line):
+                chunk_starts.append(line_num - 1)
+        return chunk_starts
+    
+    def _merge_chunk(self, result: Tuple) -> int:
+        """Add rows parsed by a worker to the pending batch, shifting their chunk-local ids."""
+        stop_idx, chats, messages, content, output = result
+        print(output, end='')
+        chat_offset = self.next_chat_id - 1
+        message_offset = self.next_message_id - 1
+        for chat in chats:
+            chat[0] += chat_offset
+            self.pending_chats[chat[0]] = chat
+        for message in messages:
+            message['id'] += message_offset
+            message['chat_id'] += chat_offset
+        self.pending_messages.extend(messages)
+        self.pending_content.extend((message_id + message_offset, text, source_offset, source_length)
+                                    for message_id, text, source_offset, source_length in content)
+        self.next_chat_id += len(chats)
+        self.next_message_id += len(messages)
+        self.chat_count += len(chats)
+        self.message_count += len(messages)
+        
+        if len(self.pending_chats) >= self.batch_chats:
+            self._flush_pending()
+        if self.chat_count >= self.last_progress_report + 100:
+            print(f"  Progress: {self.chat_count} chats parsed ({self.message_count} messages)")
+            sys.stdout.flush()
+            self.last_progress_report = self.chat_count
+        return stop_idx
+    
+    def _limits_reached(self) -> bool:
+        return bool((self.max_chats and self.chat_count >= self.max_chats) or
+                    (self.max_messages and self.message_count >= self.max_messages))
+    
+    def _parse_lines(self, lines: List[str], start_idx: int, stop_chat_idx: Optional[int] = None) -> int:
+        """Parse lines[start_idx:]; indexes into lines are absolute 0-indexed line numbers.
+        
+        Every line is classified once (see markdown_lines.classify_line) and the
+        block-finding helpers below work from those line kinds.
+        
+        Args:
+            lines: Lines of the file (list or StreamingLines)
+            start_idx: Index of the first line to parse
+            stop_chat_idx: Stop before the first chat that starts at or after this index
+        
+        Returns:
+            Index where parsing stopped
+        """
+        streamed = isinstance(lines, StreamingLines)
+        self.kinds = lines.kinds if streamed else classify_lines(lines)
+        self.lines = lines
+        kinds = self.kinds
+        i = start_idx
         while i < len(lines):
             if self.max_lines and i >= self.max_lines:
                 break
             
-            line = lines[i].strip()
+            if streamed:
+                lines.release(i)
             
-            if re.match(r'^_\*\*', lines[i]):
+            kind = kinds[i]
+            if kind & MARKER:
                 if self.chats_skipped < self.start_chat or self.current_chat_id is None:
                     i = self._skip_until_next_chat(lines, i)
                 else:
                     i = self._handle_message(lines, i)
-            elif line == '':
+            elif kind & BLANK:
                 i += 1
+            elif kind & CHAT_HEADER:
+                if self.current_chat_id:
+                    if self._has_overlapping_message(i + 1):
+                        i += 1
+                        continue
+                    self._set_chat_end_line(self.current_chat_id, i)
+                if stop_chat_idx is not None and i >= stop_chat_idx:
+                    self.current_chat_id = None
+                    return i
+                i = self._handle_chat_start(lines, i)
+                if self.report_progress and self.chat_count >= self.last_progress_report + 100:
+                    print(f"  Progress: {self.chat_count} chats parsed ({self.message_count} messages)")
+                    sys.stdout.flush()
+                    self.last_progress_report = self.chat_count
             else:
-                chat_start_match = re.match(r'^# (.+?)\s*\((.+?)\)', lines[i])
-                if chat_start_match:
-                    if self.current_chat_id:
-                        overlapping_msg = self.cursor.execute("""
-                            SELECT id FROM messages 
-                            WHERE chat_id = ? AND start_line <= ? AND (end_line IS NULL OR end_line > ?)
-                        """, (self.current_chat_id, i + 1, i + 1)).fetchone()
-                        if overlapping_msg:
-                            i += 1
-                            continue
-                        self.cursor.execute("""
-                            UPDATE chats SET end_line = ? WHERE id = ?
-                        """, (i, self.current_chat_id))
-                        self.conn.commit()
-                    i = self._handle_chat_start(lines, i)
-                    if self.chat_count >= last_progress_report + 100:
-                        print(f"  Progress: {self.chat_count} chats parsed ({self.message_count} messages)")
-                        sys.stdout.flush()
-                        last_progress_report = self.chat_count
+                if self.chats_skipped < self.start_chat or self.current_chat_id is None:
+                    i = self._skip_until_next_chat(lines, i)
                 else:
-                    if self.chats_skipped < self.start_chat or self.current_chat_id is None:
-                        i = self._skip_until_next_chat(lines, i)
-                    else:
-                        i = self._handle_unknown_block(lines, i)
+                    i = self._handle_unknown_block(lines, i)
             
             if self.max_chats and self.chat_count >= self.max_chats:
                 if self.current_chat_id:
-                    last_chat_end = i
-                    self.cursor.execute("""
-                        UPDATE chats SET end_line = ? WHERE id = ?
-                    """, (last_chat_end, self.current_chat_id))
-                    self.conn.commit()
+                    self._set_chat_end_line(self.current_chat_id, i)
                 break
             if self.max_messages and self.message_count >= self.max_messages:
                 if self.current_chat_id:
-                    last_chat_end = i
-                    self.cursor.execute("""
-                        UPDATE chats SET end_line = ? WHERE id = ?
-                    """, (last_chat_end, self.current_chat_id))
-                    self.conn.commit()
+                    self._set_chat_end_line(self.current_chat_id, i)
                 break
         
         if self.current_chat_id:
-            self.cursor.execute("""
-                UPDATE chats SET end_line = ? WHERE id = ?
-            """, (len(lines), self.current_chat_id))
-            self.conn.commit()
-        
-        if self.message_count > 0:
-            print(f"\nParsing complete: {self.message_count} messages parsed in {self.chat_count} chats")
+            self._set_chat_end_line(self.current_chat_id, len(lines))
+        return i
     
     def _skip_until_next_chat(self, lines: List[str], start_idx: int) -> int:
+        kinds = self.kinds
         for i in range(start_idx, len(lines)):
-            if re.match(r'^# (.+?)\s*\((.+?)\)', lines[i]):
+            if kinds[i] & CHAT_HEADER:
                 return i
         return len(lines)
     
@@ -179,7 +418,7 @@ class ChatParser:
             return len(lines)
         
         line = lines[start_idx]
-        match = re.match(r'^# (.+?)\s*\((.+?)\)', line)
+        match = CHAT_HEADER_RE.match(line)
         if match:
             title = match.group(1).strip()
             dt = match.group(2).strip()
@@ -191,13 +430,16 @@ class ChatParser:
             
             self.current_chat_start = start_idx + 1
             
-            self.cursor.execute(
-                "INSERT INTO chats (title, chat_datetime, start_line) VALUES (?, ?, ?)",
-                (title, dt, start_idx + 1)
-            )
-            self.current_chat_id = self.cursor.lastrowid
+            if len(self.pending_chats) >= self.batch_chats:
+                self._flush_pending()
+            
+            self.current_chat_id = self.next_chat_id
+            self.next_chat_id += 1
+            start_offset = lines.byte_offset(start_idx) if self.content_offsets else None
+            self.pending_chats[self.current_chat_id] = [self.current_chat_id, title, dt, start_idx + 1, None, None,
+                                                        start_offset]
+            self.current_chat_messages = []
             self.chat_count += 1
-            self.conn.commit()
             return start_idx + 1
         else:
             end_idx = self._find_next_break(lines, start_idx)
@@ -207,9 +449,10 @@ class ChatParser:
     
     def _handle_message(self, lines: List[str], start_idx: int) -> int:
         line = lines[start_idx]
+        kinds = self.kinds
         
-        user_match = re.match(r'^_\*\*User\s*\((.+?)\)\*\*_', line)
-        agent_match = re.match(r'^_\*\*Agent\s*(?:\((.+?)\))?.*\*\*_', line)
+        user_match = USER_MESSAGE_RE.match(line)
+        agent_match = AGENT_MESSAGE_RE.match(line)
         
         if not user_match and not agent_match:
             end_idx = self._find_next_break(lines, start_idx)
@@ -229,51 +472,39 @@ class ChatParser:
         if user_match:
             dt = user_match.group(1).strip()
             msg_type = 'User'
-            existing_msg = self.cursor.execute("""
-                SELECT id FROM messages 
-                WHERE start_line = ? AND message_type = 'User' AND chat_id = ?
-            """, (start_idx + 1, self.current_chat_id)).fetchone()
-            if existing_msg:
-                self.current_message_id = existing_msg[0]
-                message_end_idx = self._find_message_end(lines, start_idx)
+            existing_msg_id = self._find_existing_user_message(start_idx + 1)
+            if existing_msg_id:
+                self.current_message_id = existing_msg_id
+                message_end_idx = self._find_message_end(lines, start_idx, True)
                 return message_end_idx + 1
         else:
             captured = agent_match.group(1).strip() if agent_match.group(1) else None
-            datetime_pattern = r'\d{4}-\d{2}-\d{2}\s+\d{2}:\d{2}Z'
-            if captured and re.match(datetime_pattern, captured):
+            if captured and AGENT_DATETIME_RE.match(captured):
                 dt = captured
             else:
                 dt = None
             msg_type = 'Agent'
         
-        message_end_idx = self._find_message_end(lines, start_idx)
+        message_end_idx = self._find_message_end(lines, start_idx, msg_type == 'User')
         message_content_start = start_idx + 1
         
-        self.cursor.execute("""
-            INSERT INTO messages (chat_id, message_type, message_datetime, start_line)
-            VALUES (?, ?, ?, ?)
-        """, (self.current_chat_id, msg_type, dt, start_idx + 1))
-        self.current_message_id = self.cursor.lastrowid
-        self.message_count += 1
+        message = self._new_message(msg_type, dt, start_idx + 1)
         
         content_lines = lines[message_content_start:message_end_idx]
-        has_content_before_dash = any(l.strip() for l in content_lines if l.strip() != '---')
+        content_range = range(message_content_start, max(message_content_start, message_end_idx))
+        has_content_before_dash = any(not kinds[i] & (BLANK | SEPARATOR) for i in content_range)
         
         if content_lines and has_content_before_dash:
             if msg_type == 'Agent':
-                self._parse_agent_content(content_lines)
-                self._update_message_content_length(self.current_message_id)
+                self._parse_agent_content(message, content_lines, message_content_start)
             else:
-                content_text = ''.join([l for l in content_lines if l.strip() != '---'])
+                content_text = ''.join([lines[i] for i in content_range if not kinds[i] & SEPARATOR])
                 # Truncate user content to USER_TEXT_MAX_LINES max
                 user_lines = content_text.split('\n')
                 if len(user_lines) > self.user_text_max_lines:
                     content_text = '\n'.join(user_lines[:self.user_text_max_lines]) + '\n... (truncated)'
                 
-                self.cursor.execute("""
-                    INSERT INTO content (message_id, content_text)
-                    VALUES (?, ?)
-                """, (self.current_message_id, content_text))
+                self._add_content(message, content_text)
                 
                 first_line = ''
                 for line in content_lines:
@@ -282,40 +513,35 @@ class ChatParser:
                         first_line = stripped
                         break
                 
-                summary = first_line[:140] if first_line else None
-                
-                self.cursor.execute("""
-                    UPDATE messages SET content_type = ?, summary = ? WHERE id = ?
-                """, ('text', summary, self.current_message_id))
-                self._update_message_content_length(self.current_message_id)
-        
-        self.cursor.execute("""
-            UPDATE messages SET end_line = ? WHERE id = ?
-        """, (message_end_idx + 1, self.current_message_id))
+                message['content_type'] = 'text'
+                message['summary'] = first_line[:140] if first_line else None
         
-        self.conn.commit()
+        message['end_line'] = message_end_idx + 1
         
         next_idx = message_end_idx + 1
         
         while next_idx < len(lines):
-            while next_idx < len(lines) and lines[next_idx].strip() == '':
+            if isinstance(lines, StreamingLines):
+                # Continuation messages never look back, so keep the look-ahead to one message
+                lines.release(next_idx)
+            while next_idx < len(lines) and kinds[next_idx] & BLANK:
                 next_idx += 1
             
             if next_idx >= len(lines):
                 return next_idx
             
-            if re.match(r'^# (.+?)\s*\((.+?)\)', lines[next_idx]):
+            next_kind = kinds[next_idx]
+            if next_kind & CHAT_HEADER:
                 return next_idx
             
-            if re.match(r'^_\*\*', lines[next_idx]):
+            if next_kind & MARKER:
                 if msg_type == 'User':
                     return next_idx
                 elif msg_type == 'Agent':
-                    user_match = re.match(r'^_\*\*User', lines[next_idx])
-                    if user_match:
+                    if next_kind & USER_MARKER:
                         return next_idx
             
-            if msg_type == 'Agent' or (msg_type == 'User' and not re.match(r'^_\*\*Agent', lines[next_idx] if next_idx < len(lines) else '')):
+            if msg_type == 'Agent' or (msg_type == 'User' and not next_kind & AGENT_MARKER):
                 continuation_msg_type = 'Agent'
                 continuation_dt = dt if msg_type == 'Agent' else None
                 
@@ -325,27 +551,16 @@ class ChatParser:
                 if next_message_end < next_idx:
                     break
                 
-                self.cursor.execute("""
-                    INSERT INTO messages (chat_id, message_type, message_datetime, start_line)
-                    VALUES (?, ?, ?, ?)
-                """, (self.current_chat_id, continuation_msg_type, continuation_dt, content_start_line + 1))
-                self.current_message_id = self.cursor.lastrowid
-                self.message_count += 1
+                message = self._new_message(continuation_msg_type, continuation_dt, content_start_line + 1)
                 
                 if self.max_messages and self.message_count >= self.max_messages:
-                    self.conn.commit()
                     return next_idx
                 
                 continuation_content = lines[next_idx:next_message_end]
                 if continuation_content:
-                    self._parse_agent_content(continuation_content)
-                    self._update_message_content_length(self.current_message_id)
-                
-                self.cursor.execute("""
-                    UPDATE messages SET end_line = ? WHERE id = ?
-                """, (next_message_end + 1, self.current_message_id))
+                    self._parse_agent_content(message, continuation_content, next_idx)
                 
-                self.conn.commit()
+                message['end_line'] = next_message_end + 1
                 next_idx = next_message_end + 1
                 msg_type = continuation_msg_type
                 dt = continuation_dt
@@ -354,76 +569,45 @@ class ChatParser:
         
         return next_idx
     
-    def _find_message_end(self, lines: List[str], start_idx: int) -> int:
-        content_start = start_idx + 1
-        first_line = lines[content_start].strip() if content_start < len(lines) else ''
+    def _find_message_end(self, lines: List[str], start_idx: int, is_user: bool) -> int:
+        kinds = self.kinds
         
         # Check if this is a User message - if so, look for next Agent message first
-        user_match = re.match(r'^_\*\*User\s*\((.+?)\)\*\*_', lines[start_idx])
-        if user_match:
+        if is_user:
             # For User messages, first find the next Agent message boundary
             # (to allow embedded chats with User headers in the content)
             for i in range(start_idx + 1, len(lines)):
-                if re.match(r'^_\*\*Agent', lines[i]):
+                if kinds[i] & AGENT_MARKER:
                     return i - 1
             # If no Agent found, look for next User message (next chat)
             for i in range(start_idx + 1, len(lines)):
-                if re.match(r'^_\*\*User', lines[i]):
+                if kinds[i] & USER_MARKER:
                     return i - 1
             return len(lines) - 1
         
         # For Agent messages, use the original logic
-        if '<tool-use' in first_line:
-            for i in range(content_start, len(lines)):
-                if '</tool-use>' in lines[i]:
-                    for j in range(i + 1, len(lines)):
-                        if lines[j].strip() == '---':
-                            return j
-                        elif re.match(r'^_\*\*', lines[j]):
-                            return j - 1
-                    return len(lines) - 1
-        
-        in_code_block = False
-        code_fence_pattern = None
-        for i in range(start_idx + 1, len(lines)):
-            line = lines[i]
-            stripped = line.strip()
-            
-            if stripped.startswith('```'):
-                if code_fence_pattern is None:
-                    code_fence_pattern = stripped
-                    in_code_block = True
-                elif stripped == code_fence_pattern or stripped == '```':
-                    in_code_block = False
-                    code_fence_pattern = None
-            elif not in_code_block:
-                if stripped == '---':
-                    return i
-                elif re.match(r'^_\*\*', line):
-                    return i - 1
-        
-        return len(lines) - 1
+        return self._find_message_end_from_content(lines, start_idx + 1)
     
     def _find_message_end_from_content(self, lines: List[str], content_start: int) -> int:
-        first_line = lines[content_start].strip() if content_start < len(lines) else ''
+        kinds = self.kinds
         
-        if '<tool-use' in first_line:
+        if content_start < len(lines) and kinds[content_start] & TOOL_USE_OPEN:
             for i in range(content_start, len(lines)):
-                if '</tool-use>' in lines[i]:
+                if kinds[i] & TOOL_USE_CLOSE:
                     for j in range(i + 1, len(lines)):
-                        if lines[j].strip() == '---':
+                        if kinds[j] & SEPARATOR:
                             return j
-                        elif re.match(r'^_\*\*', lines[j]):
+                        elif kinds[j] & MARKER:
                             return j - 1
                     return len(lines) - 1
         
         in_code_block = False
         code_fence_pattern = None
         for i in range(content_start, len(lines)):
-            line = lines[i]
-            stripped = line.strip()
+            kind = kinds[i]
             
-            if stripped.startswith('```'):
+            if kind & CODE_FENCE:
+                stripped = lines[i].strip()
                 if code_fence_pattern is None:
                     code_fence_pattern = stripped
                     in_code_block = True
@@ -431,41 +615,35 @@ class ChatParser:
                     in_code_block = False
                     code_fence_pattern = None
             elif not in_code_block:
-                if stripped == '---':
+                if kind & SEPARATOR:
                     return i
-                elif re.match(r'^_\*\*', line):
+                elif kind & MARKER:
                     return i - 1
         
         return len(lines) - 1
     
     def _find_next_break(self, lines: List[str], start_idx: int) -> int:
+        kinds = self.kinds
         for i in range(start_idx + 1, len(lines)):
-            if re.match(r'^# (.+?)\s*\((.+?)\)', lines[i]) or re.match(r'^_\*\*', lines[i]):
+            if kinds[i] & (CHAT_HEADER | MARKER):
                 return i
-            if lines[i].strip() == '---':
+            if kinds[i] & SEPARATOR:
                 return i + 1
         return len(lines)
     
-    def _parse_agent_content(self, content_lines: List[str]):
+    def _parse_agent_content(self, message: Dict, content_lines: List[str], content_start: int):
         content_text = ''.join(content_lines)
+        # Agent content is a contiguous run of lines, so it can be stored as a byte range
+        line_range = (content_start, content_start + len(content_lines))
         
         if '<think>' in content_text or 'thought process' in content_text.lower():
-            content_type = 'think'
+            message['content_type'] = 'think'
             summary = self._extract_summary(content_text)
-            self.cursor.execute("""
-                INSERT INTO content (message_id, content_text)
-                VALUES (?, ?)
-            """, (self.current_message_id, content_text))
-            self.cursor.execute("""
-                UPDATE messages SET content_type = ? WHERE id = ?
-            """, (content_type, self.current_message_id))
+            self._add_content(message, content_text, line_range)
             if summary:
-                self.cursor.execute("""
-                    UPDATE messages SET summary = ? WHERE id = ?
-                """, (summary, self.current_message_id))
+                message['summary'] = summary
         
         elif '<tool-use' in content_text:
-            content_type = 'tool_call'
             data_tool_type = self._extract_attr(content_text, 'data-tool-type')
             data_tool_name = self._extract_attr(content_text, 'data-tool-name')
             summary = self._extract_summary(content_text)
@@ -476,29 +654,16 @@ class ChatParser:
                 if len(summary_lines) > self.agent_command_max_lines:
                     summary = '\n'.join(summary_lines[:self.agent_command_max_lines]) + '\n... (truncated)'
             
-            self.cursor.execute("""
-                INSERT INTO content (message_id, content_text)
-                VALUES (?, ?)
-            """, (self.current_message_id, content_text))
-            self.cursor.execute("""
-                UPDATE messages SET content_type = ? WHERE id = ?
-            """, (content_type, self.current_message_id))
-            
+            self._add_content(message, content_text, line_range)
+            message['content_type'] = 'tool_call'
             if data_tool_type:
-                self.cursor.execute("""
-                    UPDATE messages SET data_tool_type = ? WHERE id = ?
-                """, (data_tool_type, self.current_message_id))
+                message['data_tool_type'] = data_tool_type
             if data_tool_name:
-                self.cursor.execute("""
-                    UPDATE messages SET data_tool_name = ? WHERE id = ?
-                """, (data_tool_name, self.current_message_id))
+                message['data_tool_name'] = data_tool_name
             if summary:
-                self.cursor.execute("""
-                    UPDATE messages SET summary = ? WHERE id = ?
-                """, (summary, self.current_message_id))
+                message['summary'] = summary
         
         else:
-            content_type = 'text'
             # Use first AGENT_TEXT_MAX_LINES for agent text message summary
             summary_lines = []
             for line in content_lines:
@@ -508,29 +673,222 @@ class ChatParser:
                     if len(summary_lines) >= self.agent_text_max_lines:
                         break
             
-            summary = '\n'.join(summary_lines) if summary_lines else None
-            
+            self._add_content(message, content_text, line_range)
+            message['content_type'] = 'text'
+            if summary_lines:
+                message['summary'] = '\n'.join(summary_lines)
+    
+    def _new_message(self, msg_type: str, dt: Optional[str], start_line: int) -> Dict:
+        """Build a message row in memory; it is written to the database by _flush_pending()."""
+        message = dict.fromkeys(MESSAGE_COLUMNS)
+        message.update(id=self.next_message_id, chat_id=self.current_chat_id, message_type=msg_type,
+                       message_datetime=dt, start_line=start_line)
+        self.next_message_id += 1
+        self.current_message_id = message['id']
+        self.message_count += 1
+        self.pending_messages.append(message)
+        self.current_chat_messages.append(message)
+        return message
+    
+    def _add_content(self, message: Dict, content_text: str, line_range: Optional[Tuple[int, int]] = None):
+        """Buffer a content row, as a byte range of the source file when content_offsets is set.
+        
+        Args:
+            message: Message the content belongs to
+            content_text: Content text
+            line_range: (start_idx, end_idx) of the lines content_text was joined
+                from, if it is an unmodified slice of the file
+        """
+        if self.content_offsets and line_range is not None:
+            start = self.lines.byte_offset(line_range[0])
+            self.pending_content.append((message['id'], None, start, self.lines.byte_offset(line_range[1]) - start))
+        else:
+            self.pending_content.append((message['id'], content_text, None, None))
+        message['content_length'] = len(content_text)
+    
+    def _next_autoincrement_id(self, table_name: str) -> int:
+        """Return the id SQLite AUTOINCREMENT would assign to the next row of table_name."""
+        seq = self.cursor.execute("SELECT seq FROM sqlite_sequence WHERE name = ?", (table_name,)).fetchone()
+        max_id = self.cursor.execute(f"SELECT MAX(id) FROM {table_name}").fetchone()[0]
+        return max(seq[0] if seq else 0, max_id or 0) + 1
+    
+    def _set_chat_end_line(self, chat_id: int, end_line: int):
+        if chat_id in self.pending_chats:
+            self.pending_chats[chat_id][4] = end_line
+        else:
             self.cursor.execute("""
-                INSERT INTO content (message_id, content_text)
-                VALUES (?, ?)
-            """, (self.current_message_id, content_text))
+                UPDATE chats SET end_line = ? WHERE id = ?
+            """, (end_line, chat_id))
+    
+    def _has_overlapping_message(self, line_num: int) -> bool:
+        """Check if a message of the current chat spans the given 1-indexed line."""
+        for message in self.current_chat_messages:
+            if message['start_line'] <= line_num and (message['end_line'] is None or message['end_line'] > line_num):
+                return True
+        if self.current_chat_id in self.pending_chats:
+            return False
+        overlapping_msg = self.cursor.execute("""
+            SELECT id FROM messages 
+            WHERE chat_id = ? AND start_line <= ? AND (end_line IS NULL OR end_line > ?)
+        """, (self.current_chat_id, line_num, line_num)).fetchone()
+        return overlapping_msg is not None
+    
+    def _find_existing_user_message(self, line_num: int) -> Optional[int]:
+        for message in self.current_chat_messages:
+            if message['start_line'] == line_num and message['message_type'] == 'User':
+                return message['id']
+        if self.current_chat_id in self.pending_chats:
+            return None
+        existing_msg = self.cursor.execute("""
+            SELECT id FROM messages 
+            WHERE start_line = ? AND message_type = 'User' AND chat_id = ?
+        """, (line_num, self.current_chat_id)).fetchone()
+        return existing_msg[0] if existing_msg else None
+    
+    def _flush_pending(self):
+        """Write buffered chats, messages and content in a single transaction."""
+        if self.pending_chats:
+            for chat in self.pending_chats.values():
+                chat[5] = self._chat_hash(chat[3], chat[4])
+            self.cursor.executemany("""
+                INSERT INTO chats (id, title, chat_datetime, start_line, end_line, content_hash, start_offset)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, list(self.pending_chats.values()))
+        if self.pending_messages:
+            placeholders = ', '.join('?' * len(MESSAGE_COLUMNS))
+            self.cursor.executemany(f"""
+                INSERT INTO messages ({', '.join(MESSAGE_COLUMNS)})
+                VALUES ({placeholders})
+            """, [tuple(m[col] for col in MESSAGE_COLUMNS) for m in self.pending_messages])
+        if self.pending_content:
+            if self.compress_content and self.content_dictionary is None:
+                self._train_content_dictionary(self._pending_content_samples(1000))
+            self.cursor.executemany("""
+                INSERT INTO content (message_id, content_text, text_length, dictionary_id, source_offset, source_length)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, [self._content_row(*row) for row in self.pending_content])
+        self._add_chat_count(len(self.pending_chats))
+        if self.pending_messages:
+            # Ids are assigned in order, so everything from the batch's first id on is new
+            self._update_chat_stats("m.id >= :first_id", [{'first_id': self.pending_messages[0]['id']}], 1)
+        self.conn.commit()
+        self.pending_chats = {}
+        self.pending_messages = []
+        self.pending_content = []
+    
+    def _update_chat_stats(self, scope: str, params: List[Dict], sign: int):
+        """Add (sign 1) or subtract (sign -1) messages to the chat_stats rollup.
+        
+        Args:
+            scope: SQL condition on messages m selecting the messages
+            params: Named parameters of scope, one dict per execution
+            sign: 1 for inserted messages, -1 for messages about to be deleted
+        """
+        selects = ' UNION ALL '.join(f"""
+            SELECT '{dimension}' AS dimension, {key} AS key, m.content_length
+            FROM messages m LEFT JOIN chats c ON c.id = m.chat_id
+            WHERE ({scope}) AND {condition}
+        """ for dimension, key, condition in CHAT_STATS_DIMENSIONS)
+        self.cursor.executemany(f"""
+            INSERT INTO chat_stats (dimension, key, count, length_count, total_length)
+            SELECT dimension, key, :sign * COUNT(*), :sign * COUNT(content_length),
+                   :sign * COALESCE(SUM(content_length), 0)
+            FROM ({selects})
+            WHERE true
+            GROUP BY dimension, key
+            ON CONFLICT (dimension, key) DO UPDATE SET
+                count = count + excluded.count,
+                length_count = length_count + excluded.length_count,
+                total_length = total_length + excluded.total_length
+        """, [dict(p, sign=sign) for p in params])
+    
+    def _add_chat_count(self, delta: int):
+        if delta:
             self.cursor.execute("""
-                UPDATE messages SET content_type = ? WHERE id = ?
-            """, ('text', self.current_message_id))
-            
-            if summary:
-                self.cursor.execute("""
-                    UPDATE messages SET summary = ? WHERE id = ?
-                """, (summary, self.current_message_id))
-    def _update_message_content_length(self, message_id: int):
-        self.cursor.execute("""
-            SELECT SUM(LENGTH(content_text)) FROM content WHERE message_id = ?
-        """, (message_id,))
-        result = self.cursor.fetchone()
-        total_length = result[0] if result[0] is not None else 0
-        self.cursor.execute("""
-            UPDATE messages SET content_length = ? WHERE id = ?
-        """, (total_length, message_id))
+                INSERT INTO chat_stats (dimension, key, count, length_count, total_length)
+                VALUES ('chats', '', ?, 0, 0)
+                ON CONFLICT (dimension, key) DO UPDATE SET count = count + excluded.count
+            """, (delta,))
+    
+    def _content_row(self, message_id: int, content_text: Optional[str], source_offset: Optional[int],
+                     source_length: Optional[int]) -> Tuple:
+        """Build a content table row, compressing the text if a dictionary is loaded and it helps."""
+        if content_text is None:
+            return (message_id, None, None, None, source_offset, source_length)
+        if self.content_dictionary is not None:
+            dictionary_id, dictionary = self.content_dictionary
+            compressed = compress_text(content_text, dictionary)
+            if len(compressed) < len(content_text):
+                return (message_id, compressed, len(content_text), dictionary_id, source_offset, source_length)
+        return (message_id, content_text, len(content_text), None, source_offset, source_length)
+    
+    def _load_content_dictionary(self) -> Optional[Tuple[int, bytes]]:
+        row = self.cursor.execute("""
+            SELECT id, dictionary FROM content_dictionaries ORDER BY id DESC LIMIT 1
+        """).fetchone()
+        return (row[0], row[1]) if row else None
+    
+    def _train_content_dictionary(self, samples: List[str]):
+        """Train and store the dictionary that content is compressed with from now on."""
+        dictionary = train_dictionary(samples)
+        if not dictionary:
+            return
+        self.cursor.execute("INSERT INTO content_dictionaries (dictionary, sample_count) VALUES (?, ?)",
+                            (dictionary, len(samples)))
+        self.content_dictionary = (self.cursor.lastrowid, dictionary)
+        print(f"Trained a {len(dictionary)} byte compression dictionary on {len(samples)} tool-use blocks")
+    
+    def _compress_stored_content(self):
+        """Compress content stored as text, then VACUUM so the database file shrinks."""
+        if self.content_dictionary is None:
+            return
+        compressed_rows = 0
+        last_message_id = 0
+        while True:
+            rows = self.cursor.execute("""
+                SELECT message_id, content_text FROM content
+                WHERE message_id > ? AND typeof(content_text) = 'text'
+                ORDER BY message_id LIMIT 1000
+            """, (last_message_id,)).fetchall()
+            if not rows:
+                break
+            updates = [self._content_row(message_id, text, None, None)[1:4] + (message_id,) for message_id, text in rows]
+            self.cursor.executemany("""
+                UPDATE content SET content_text = ?, text_length = ?, dictionary_id = ? WHERE message_id = ?
+            """, updates)
+            compressed_rows += sum(1 for update in updates if update[2] is not None)
+            last_message_id = rows[-1][0]
+        self.conn.commit()
+        print(f"Compressed {compressed_rows} stored content rows, reclaiming space...")
+        self.cursor.execute("VACUUM")
+    
+    def _pending_content_samples(self, sample_size: int) -> List[str]:
+        """Pick up to sample_size tool-use blocks, or other texts if there are none, from the pending batch."""
+        tool_call_ids = {message['id'] for message in self.pending_messages if message['content_type'] == 'tool_call'}
+        samples = [text for message_id, text, _, _ in self.pending_content
+                   if text is not None and message_id in tool_call_ids]
+        if not samples:
+            samples = [text for _, text, _, _ in self.pending_content if text is not None]
+        step = max(1, len(samples) // sample_size)
+        return samples[::step][:sample_size]
+    
+    def _sample_content(self, content_type: str, sample_size: int) -> List[str]:
+        """Pick up to sample_size stored content texts of a content type, spread over the table."""
+        count = self.cursor.execute("""
+            SELECT COUNT(*) FROM content c JOIN messages m ON m.id = c.message_id
+            WHERE typeof(c.content_text) = 'text' AND m.content_type = ?
+        """, (content_type,)).fetchone()[0]
+        step = max(1, count // sample_size)
+        rows = self.cursor.execute("""
+            SELECT content_text FROM (
+                SELECT c.content_text, ROW_NUMBER() OVER (ORDER BY c.message_id) AS row_num
+                FROM content c JOIN messages m ON m.id = c.message_id
+                WHERE typeof(c.content_text) = 'text' AND m.content_type = ?
+            )
+            WHERE row_num % ? = 0
+            LIMIT ?
+        """, (content_type, step, sample_size)).fetchall()
+        return [row[0] for row in rows]
     
     def _extract_summary(self, text: str) -> Optional[str]:
         summary_match = re.search(r'<summary>(.+?)</summary>', text, re.DOTALL)
@@ -548,12 +906,13 @@ class ChatParser:
     def _handle_unknown_block(self, lines: List[str], start_idx: int) -> int:
         block_start = start_idx
         
+        kinds = self.kinds
         dash_idx = None
         for i in range(start_idx + 1, len(lines)):
-            if lines[i].strip() == '---':
+            if kinds[i] & SEPARATOR:
                 dash_idx = i
                 break
-            if re.match(r'^# (.+?)\s*\((.+?)\)', lines[i]) or re.match(r'^_\*\*', lines[i]):
+            if kinds[i] & (CHAT_HEADER | MARKER):
                 block_end = i
                 first_line = lines[block_start].strip()[:80]
                 print(f"Invalid block: lines {block_start + 1}-{block_end}: {first_line}")
@@ -563,7 +922,7 @@ class ChatParser:
             block_lines = lines[start_idx:dash_idx]
             non_empty_lines = [l.strip() for l in block_lines if l.strip()]
             
-            if len(non_empty_lines) == 1 and re.match(r'^# (.+?)\s*\((.+?)\)', non_empty_lines[0]):
+            if len(non_empty_lines) == 1 and CHAT_HEADER_RE.match(non_empty_lines[0]):
                 return self._handle_chat_start(lines, start_idx)
         
         block_end = self._find_next_break(lines, start_idx)
@@ -576,29 +935,23 @@ class ChatParser:
         
         stats_rows = []
         
-        total_chats = self.cursor.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
-        total_messages = self.cursor.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
-        user_messages = self.cursor.execute("SELECT COUNT(*) FROM messages WHERE message_type = 'User'").fetchone()[0]
-        agent_messages = self.cursor.execute("SELECT COUNT(*) FROM messages WHERE message_type = 'Agent'").fetchone()[0]
+        # Everything comes from the chat_stats rollup kept up to date while parsing
+        stats = defaultdict(dict)
+        for dimension, key, count, length_count, total_length in self.cursor.execute("""
+            SELECT dimension, key, count, length_count, total_length FROM chat_stats ORDER BY dimension, key
+        """):
+            avg_length = int(round(total_length / length_count)) if length_count else 0
+            stats[dimension][key] = (count, total_length, avg_length)
         
-        user_total = self.cursor.execute("SELECT SUM(content_length) FROM messages WHERE message_type = 'User'").fetchone()[0] or 0
-        user_avg = self.cursor.execute("SELECT AVG(content_length) FROM messages WHERE message_type = 'User'").fetchone()[0] or 0
-        user_avg_int = int(round(user_avg)) if user_avg else 0
+        total_chats = stats['chats'].get('', (0,))[0]
+        total_messages, overall_total, overall_avg_int = stats['messages'].get('', (0, 0, 0))
+        user_messages, user_total, user_avg_int = stats['message_type'].get('User', (0, 0, 0))
+        agent_messages, agent_total, agent_avg_int = stats['message_type'].get('Agent', (0, 0, 0))
         
         avg_messages_per_chat = total_messages / total_chats if total_chats > 0 else 0
         avg_user_per_chat = user_messages / total_chats if total_chats > 0 else 0
         avg_agent_per_chat = agent_messages / total_chats if total_chats > 0 else 0
         
-        agent_total = self.cursor.execute("SELECT SUM(content_length) FROM messages WHERE message_type = 'Agent'").fetchone()[0] or 0
-        agent_avg = self.cursor.execute("SELECT AVG(content_length) FROM messages WHERE message_type = 'Agent'").fetchone()[0] or 0
-        agent_avg_int = int(round(agent_avg)) if agent_avg else 0
-        
-        overall_total_precalc = user_total + agent_total
-        
-        overall_total = self.cursor.execute("SELECT SUM(content_length) FROM messages").fetchone()[0] or 0
-        overall_avg = self.cursor.execute("SELECT AVG(content_length) FROM messages").fetchone()[0] or 0
-        overall_avg_int = int(round(overall_avg)) if overall_avg else 0
-        
         avg_content_per_chat = overall_total / total_chats if total_chats > 0 else 0
         avg_content_per_chat_int = int(round(avg_content_per_chat)) if avg_content_per_chat else 0
         
@@ -612,69 +965,26 @@ class ChatParser:
         
         agent_content_rows = []
         for content_type in ['think', 'tool_call', 'text']:
-            count = self.cursor.execute(
-                "SELECT COUNT(*) FROM messages WHERE content_type = ? AND message_type = 'Agent'", (content_type,)
-            ).fetchone()[0]
-            if count > 0:
-                total_len = self.cursor.execute(
-                    "SELECT SUM(content_length) FROM messages WHERE content_type = ? AND message_type = 'Agent'", (content_type,)
-                ).fetchone()[0] or 0
-                avg_len = self.cursor.execute(
-                    "SELECT AVG(content_length) FROM messages WHERE content_type = ? AND message_type = 'Agent'", (content_type,)
-                ).fetchone()[0] or 0
-                avg_len_int = int(round(avg_len)) if avg_len else 0
+            if content_type in stats['agent_content_type']:
+                count, total_len, avg_len_int = stats['agent_content_type'][content_type]
                 agent_content_rows.append((f"Agent {content_type}", count, total_len, avg_len_int))
         agent_content_rows.sort(key=lambda x: x[1])
         stats_rows.extend(agent_content_rows)
         
-        tool_stats = self.cursor.execute("""
-            SELECT data_tool_type, COUNT(*) as cnt, SUM(content_length) as total_len, AVG(content_length) as avg_len
-            FROM messages 
-            WHERE data_tool_type IS NOT NULL
-            GROUP BY data_tool_type
-            ORDER BY cnt DESC
-        """).fetchall()
-        
-        tool_type_rows = []
-        for tool_type, cnt, total_len, avg_len in tool_stats:
-            total_len = total_len or 0
-            avg_len = avg_len or 0
-            avg_len_int = int(round(avg_len)) if avg_len else 0
-            tool_type_rows.append((f"Tool type: {tool_type}", cnt, total_len, avg_len_int))
+        tool_type_rows = [(f"Tool type: {tool_type}", count, total_len, avg_len_int)
+                          for tool_type, (count, total_len, avg_len_int) in stats['tool_type'].items()]
         tool_type_rows.sort(key=lambda x: x[1], reverse=True)
         stats_rows.extend(tool_type_rows)
         
-        tool_name_stats = self.cursor.execute("""
-            SELECT data_tool_name, COUNT(*) as cnt, SUM(content_length) as total_len, AVG(content_length) as avg_len
-            FROM messages 
-            WHERE data_tool_name IS NOT NULL
-            GROUP BY data_tool_name
-            ORDER BY cnt DESC
-        """).fetchall()
-        
-        tool_name_rows = []
-        for tool_name, cnt, total_len, avg_len in tool_name_stats:
-            total_len = total_len or 0
-            avg_len = avg_len or 0
-            avg_len_int = int(round(avg_len)) if avg_len else 0
-            tool_name_rows.append((f"Tool: {tool_name}", cnt, total_len, avg_len_int))
+        tool_name_rows = [(f"Tool: {tool_name}", count, total_len, avg_len_int)
+                          for tool_name, (count, total_len, avg_len_int) in stats['tool_name'].items()]
         tool_name_rows.sort(key=lambda x: x[1], reverse=True)
         stats_rows.extend(tool_name_rows)
         
-        daily_stats = self.cursor.execute("""
-            SELECT 
-                SUBSTR(c.chat_datetime, 1, 10) as chat_date,
-                COUNT(m.id) as msg_count,
-                SUM(m.content_length) as daily_total
-            FROM chats c
-            LEFT JOIN messages m ON c.id = m.chat_id
-            WHERE c.chat_datetime IS NOT NULL
-            GROUP BY SUBSTR(c.chat_datetime, 1, 10)
-        """).fetchall()
-        
+        daily_stats = list(stats['day'].values())
         if daily_stats:
-            msg_counts = [msg_count for _, msg_count, _ in daily_stats if msg_count]
-            daily_totals = [total for _, _, total in daily_stats if total]
+            msg_counts = [msg_count for msg_count, _, _ in daily_stats if msg_count]
+            daily_totals = [total for _, total, _ in daily_stats if total]
             
             if msg_counts and daily_totals:
                 msg_avg = sum(msg_counts) / len(msg_counts)
@@ -707,203 +1017,314 @@ class ChatParser:
             print(f"| {category} | {count_str} | {total_str} | {avg_str} |")
         print()
     
-    def _read_line_at(self, filepath: str, line_num: int) -> str:
-        """Read a specific line number from file (1-indexed)."""
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for i, line in enumerate(f, 1):
-                if i == line_num:
-                    return line
-        return None
+    def _get_line_index(self, filepath: str) -> LineIndex:
+        if self.line_index is None:
+            self.line_index = LineIndex.load_or_build(self.conn, filepath)
+        return self.line_index
     
-    def _find_start_position(self, filepath: str) -> int:
-        """Find the starting position for incremental parsing by checking if user messages at given lines already exist."""
-        existing_chats = self.cursor.execute("SELECT COUNT(*) FROM chats WHERE start_line IS NOT NULL").fetchone()[0]
-        if existing_chats == 0:
-            print("No existing chats found, starting from beginning")
-            return 0
-        
-        print(f"Found {existing_chats} existing chats, comparing source file to database content...")
-        first_broken = self._find_first_broken_chat(filepath)
-        if first_broken is not None:
-            broken_chat_info = self.cursor.execute("""
-                SELECT id, title, start_line FROM chats WHERE id = ?
-            """, (first_broken,)).fetchone()
-            broken_msg_count = self.cursor.execute("""
-                SELECT COUNT(*) FROM messages WHERE chat_id >= ?
-            """, (first_broken,)).fetchone()[0]
-            broken_msg_ids = self.cursor.execute("""
-                SELECT id FROM messages WHERE chat_id >= ?
-            """, (first_broken,)).fetchall()
-            broken_msg_ids_list = [row[0] for row in broken_msg_ids]
-            
-            orphaned_groups_count = 0
-            if broken_msg_ids_list:
-                placeholders = ','.join('?' * len(broken_msg_ids_list))
-                orphaned_groups_count = self.cursor.execute(f"""
-                    SELECT COUNT(DISTINCT group_id) FROM task_groups 
-                    WHERE user_msg_id IN ({placeholders})
-                """, broken_msg_ids_list).fetchone()[0]
-            
-            print(f"Found broken chat at ID {first_broken} (title: {broken_chat_info[1] if broken_chat_info else 'unknown'}, line {broken_chat_info[2] if broken_chat_info else 'unknown'})")
-            print(f"  This will delete {broken_msg_count} messages from chat {first_broken} onwards")
-            if orphaned_groups_count > 0:
-                print(f"  Warning: This will orphan {orphaned_groups_count} task groups (will be cleaned up during clustering)")
-            
-            if broken_msg_ids_list:
-                placeholders = ','.join('?' * len(broken_msg_ids_list))
-                self.cursor.execute(f"""
-                    DELETE FROM task_groups WHERE user_msg_id IN ({placeholders})
-                """, broken_msg_ids_list)
-                deleted_groups = self.cursor.rowcount
-                if deleted_groups > 0:
-                    print(f"  Deleted {deleted_groups} task_groups entries referencing deleted messages")
-            
-            self.cursor.execute("DELETE FROM chats WHERE id >= ?", (first_broken,))
-            deleted_chats = self.cursor.rowcount
-            self.cursor.execute("DELETE FROM messages WHERE chat_id >= ?", (first_broken,))
-            deleted_messages = self.cursor.rowcount
-            self.conn.commit()
-            print(f"  Deleted {deleted_chats} chats and {deleted_messages} messages")
-            
-            if first_broken > 1:
-                last_good = self.cursor.execute("SELECT end_line FROM chats WHERE id = ?", (first_broken - 1,)).fetchone()
-                if last_good and last_good[0]:
-                    print(f"  Resuming from line {last_good[0]} (end of last good chat)")
-                    return last_good[0] - 1
-            print("  Starting from beginning")
-            return 0
-        
-        last_chat = self.cursor.execute("""
-            SELECT id, end_line, title FROM chats 
-            WHERE start_line IS NOT NULL 
-            ORDER BY start_line DESC 
-            LIMIT 1
-        """).fetchone()
-        
-        if last_chat and last_chat[1]:
-            start_from_line = last_chat[1] - 1
-            print(f"Last chat ends at line {last_chat[1]}, checking for new content from line {start_from_line + 1}...")
-            return self._find_new_content_start(filepath, start_from_line)
-        else:
-            print("No end_line found for last chat, checking from beginning...")
-            return self._find_new_content_start(filepath, 0)
-    
-    def _find_new_content_start(self, filepath: str, start_from_line: int) -> int:
-        """Find the start of new content by scanning from a given line."""
-        checked_count = 0
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for i, line in enumerate(f, 1):
-                if i <= start_from_line:
-                    continue
-                
-                user_match = re.match(r'^_\*\*User\s*\((.+?)\)\*\*_', line)
-                if user_match:
-                    chat_match = None
-                    chat_line_idx = None
-                    for j in range(max(1, i - 20), i):
-                        check_line = self._read_line_at(filepath, j)
-                        if check_line:
-                            potential_chat = re.match(r'^# (.+?)\s*\((.+?)\)', check_line)
-                            if potential_chat:
-                                chat_match = potential_chat
-                                chat_line_idx = j
-                                break
-                    
-                    if chat_match:
-                        chat_title = chat_match.group(1).strip()
-                        chat_dt = chat_match.group(2).strip()
-                        existing_chat = self.cursor.execute("""
-                            SELECT id FROM chats 
-                            WHERE title = ? AND chat_datetime = ? AND start_line = ?
-                        """, (chat_title, chat_dt, chat_line_idx)).fetchone()
-                        
-                        if existing_chat:
-                            existing_msg = self.cursor.execute("""
-                                SELECT id FROM messages 
-                                WHERE start_line = ? AND message_type = 'User' AND chat_id = ?
-                            """, (i, existing_chat[0])).fetchone()
-                            if existing_msg is None:
-                                self.current_chat_id = existing_chat[0]
-                                if checked_count > 0:
-                                    print(f"  Checked {checked_count} lines, found new user message at line {i}")
-                                return i - 1
-                        else:
-                            if checked_count > 0:
-                                print(f"  Checked {checked_count} lines, found new chat at line {chat_line_idx}")
-                            return chat_line_idx - 1
-                
-                checked_count += 1
-                if checked_count % 1000 == 0:
-                    print(f"  Checked {checked_count} lines for new content...")
-                
-                chat_match = re.match(r'^# (.+?)\s*\((.+?)\)', line)
-                if chat_match:
-                    chat_title = chat_match.group(1).strip()
-                    chat_dt = chat_match.group(2).strip()
-                    existing_chat = self.cursor.execute("""
-                        SELECT id FROM chats 
-                        WHERE title = ? AND chat_datetime = ? AND start_line = ?
-                    """, (chat_title, chat_dt, i)).fetchone()
-                    if existing_chat is None:
-                        if checked_count > 0:
-                            print(f"  Checked {checked_count} lines, found new chat at line {i}")
-                        return i - 1
-        
-        if checked_count > 0:
-            print(f"  Checked {checked_count} lines, no new content found")
-        
-        with open(filepath, 'r', encoding='utf-8') as f:
-            line_count = sum(1 for _ in f)
-        return line_count
-    
-    def _find_first_broken_chat(self, filepath: str) -> Optional[int]:
-        chats = self.cursor.execute("""
-            SELECT id, start_line, end_line, title FROM chats 
+    def _chat_hash(self, start_line: Optional[int], end_line: Optional[int]) -> Optional[str]:
+        """Content hash of a chat span, from its header line through end_line (1-indexed)."""
+        if start_line is None or end_line is None or end_line < start_line:
+            return None
+        return self.line_index.hash_lines(start_line, end_line)
+    
+    def _update_resumed_chat_hashes(self):
+        """Rehash chats that got new messages appended, now that their end_line is final."""
+        for chat_id in self.resumed_chat_ids:
+            start_line, end_line = self.cursor.execute(
+                "SELECT start_line, end_line FROM chats WHERE id = ?", (chat_id,)
+            ).fetchone()
+            self.cursor.execute("UPDATE chats SET content_hash = ? WHERE id = ?",
+                                (self._chat_hash(start_line, end_line), chat_id))
+            if self.content_offsets:
+                # The new messages may be stored as offsets, which must move with the chat
+                self.cursor.execute("UPDATE chats SET start_offset = ? WHERE id = ? AND start_offset IS NULL",
+                                    (self.line_index.line_offset(start_line), chat_id))
+        self.conn.commit()
+        self.resumed_chat_ids = []
+    
+    def _record_content_source(self, line_index: LineIndex):
+        """Record the parsed file, which content source offsets now point into."""
+        self.cursor.execute("""
+            INSERT OR REPLACE INTO content_source (id, file_path, file_size, file_mtime_ns, file_hash)
+            VALUES (1, ?, ?, ?, ?)
+        """, (os.path.abspath(self.filepath), line_index.file_size, line_index.file_mtime_ns, line_index.file_hash))
+        self.conn.commit()
+    
+    def _plan_incremental_parse(self, line_index: LineIndex, end_line: int) -> List[Tuple[int, int, Optional[int]]]:
+        """Diff stored chats against the file and return the line ranges that need parsing.
+        
+        Every stored chat is looked up by its content hash, first at its stored
+        position and then at other header lines with the same title and datetime.
+        Unchanged chats keep their ids, messages, embeddings and groups and only
+        have their line numbers shifted; changed and removed chats are deleted.
+        
+        Args:
+            line_index: Index of the file being parsed
+            end_line: Number of lines to parse (respects max_lines)
+        
+        Returns:
+            List of (start_idx, end_idx, resume_chat_id) segments with 0-indexed,
+            end-exclusive line ranges, one before every unchanged chat (empty if
+            nothing needs parsing) and one after the last. resume_chat_id is set
+            when the segment continues an unchanged chat with new messages.
+        """
+        stored_chats = self.cursor.execute("""
+            SELECT id, title, chat_datetime, start_line, end_line, content_hash FROM chats 
             WHERE start_line IS NOT NULL 
-            ORDER BY chat_datetime, start_line
+            ORDER BY start_line
         """).fetchall()
-        
-        total_chats = len(chats)
-        for idx, (chat_id, start_line, end_line, expected_title) in enumerate(chats, 1):
-            if idx % 100 == 0:
-                print(f"  Checked {idx}/{total_chats} chats...")
+        if not stored_chats:
+            print("No existing chats found, starting from beginning")
+            return [(0, end_line, None)]
+        
+        print(f"Found {len(stored_chats)} existing chats, comparing source file to database content...")
+        header_lines = None
+        matches = []
+        stale_chat_ids = []
+        claimed_starts = []
+        claimed_ends = []
+        for idx, (chat_id, title, dt, start_line, chat_end_line, content_hash) in enumerate(stored_chats, 1):
+            if idx % 1000 == 0:
+                print(f"  Checked {idx}/{len(stored_chats)} chats...")
                 sys.stdout.flush()
-            stored_line = self._read_line_at(filepath, start_line)
-            if stored_line is None:
-                print(f"  Chat {chat_id}: line {start_line} is missing (file too short)")
-                return chat_id
-            
-            stored_line = stored_line.strip()
-            if not stored_line:
-                print(f"  Chat {chat_id}: line {start_line} is empty")
-                return chat_id
             
-            expected_match = re.match(r'^# (.+?)\s*\((.+?)\)', stored_line)
-            if not expected_match:
-                print(f"  Chat {chat_id}: line {start_line} doesn't match chat header pattern: {stored_line[:100]}")
-                return chat_id
-            
-            actual_title = expected_match.group(1).strip()
-            if actual_title != expected_title:
-                print(f"  Chat {chat_id}: title mismatch at line {start_line}")
-                print(f"    Expected: {expected_title[:100]}")
-                print(f"    Found: {actual_title[:100]}")
-                return chat_id
+            new_start = None
+            length = (chat_end_line - start_line + 1) if chat_end_line is not None else 0
+            if length <= 0:
+                pass
+            elif content_hash is None:
+                # Chats parsed before hashes were stored: trust a matching header at the stored position
+                if chat_end_line <= line_index.line_count and self._span_is_free(claimed_starts, claimed_ends, start_line, length):
+                    match = CHAT_HEADER_RE.match(line_index.read_line(start_line))
+                    if match and (match.group(1).strip(), match.group(2).strip()) == (title, dt):
+                        new_start = start_line
+                        self.cursor.execute("UPDATE chats SET content_hash = ? WHERE id = ?",
+                                            (self._chat_hash(start_line, chat_end_line), chat_id))
+            elif self._span_matches(line_index, start_line, length, content_hash, claimed_starts, claimed_ends):
+                new_start = start_line
+            else:
+                if header_lines is None:
+                    header_lines = self._scan_chat_headers(line_index)
+                positions = header_lines.get((title, dt), [])
+                for candidate in positions:
+                    if self._span_matches(line_index, candidate, length, content_hash, claimed_starts, claimed_ends):
+                        new_start = candidate
+                        break
             
-            if end_line is not None:
-                end_line_content = self._read_line_at(filepath, end_line)
-                if end_line_content is None:
-                    print(f"  Chat {chat_id}: end_line {end_line} is missing (file too short)")
-                    return chat_id
-        
-        if total_chats > 0:
-            print(f"  Checked {total_chats}/{total_chats} chats, all match")
+            if new_start is None:
+                stale_chat_ids.append(chat_id)
+            else:
+                matches.append((chat_id, start_line, new_start, length))
+                pos = bisect_left(claimed_starts, new_start)
+                claimed_starts.insert(pos, new_start)
+                claimed_ends.insert(pos, new_start + length - 1)
+        matches.sort(key=lambda match: match[2])
+        
+        # Lines after an unchanged chat either start another chat, add messages to it,
+        # or continue its last message, in which case the chat has changed after all.
+        # Only the chat that ended the last parse can end in an open message, which
+        # would run on into anything that now follows it.
+        last_chat_id = stored_chats[-1][0]
+        kept = []
+        gap_end = end_line
+        for chat_id, start_line, new_start, length in reversed(matches):
+            first_line = self._first_non_blank_line(line_index, new_start + length, gap_end)
+            if first_line is None:
+                follows = 'nothing'
+            elif CHAT_HEADER_RE.match(first_line):
+                follows = 'chat'
+            elif re.match(r'^_\*\*', first_line):
+                follows = 'messages'
+            else:
+                stale_chat_ids.append(chat_id)
+                continue
+            if chat_id == last_chat_id and (first_line is not None or kept) and \
+                    not self._ends_with_separator(line_index, chat_id, new_start - start_line):
+                stale_chat_ids.append(chat_id)
+                continue
+            kept.append((chat_id, start_line, new_start, length, follows))
+            gap_end = new_start - 1
+        kept.reverse()
+        
+        if stale_chat_ids:
+            self._delete_chats(stale_chat_ids)
+        
+        moved = [(chat_id, new_start - start_line, new_start, new_start + length - 1)
+                 for chat_id, start_line, new_start, length, _ in kept if new_start != start_line]
+        # Byte offsets change whenever earlier lines change length, even if line numbers do not
+        self._shift_content_offsets(line_index, [(chat_id, new_start) for chat_id, _, new_start, _, _ in kept])
+        if moved:
+            self.cursor.executemany("""
+                UPDATE chats SET start_line = ?, end_line = ? WHERE id = ?
+            """, [(new_start, new_end, chat_id) for chat_id, _, new_start, new_end in moved])
+            self.cursor.executemany("""
+                UPDATE messages SET start_line = start_line + ?, end_line = end_line + ? WHERE chat_id = ?
+            """, [(delta, delta, chat_id) for chat_id, delta, _, _ in moved])
+        self.conn.commit()
+        
+        self.resumed_chat_ids = [chat_id for chat_id, _, _, _, follows in kept if follows == 'messages']
+        print(f"  {len(kept)} chats unchanged ({len(moved)} moved, {len(self.resumed_chat_ids)} with new messages), "
+              f"{len(stale_chat_ids)} changed or removed")
+        
+        self.kept_chat_starts = {new_start - 1: chat_id for chat_id, _, new_start, _, _ in kept}
+        segments = []
+        segment_start = 1
+        resume_chat_id = None
+        parse_gap = True
+        for chat_id, _, new_start, length, follows in kept:
+            segment_end = min(new_start - 1, end_line)
+            segments.append((segment_start - 1 if parse_gap else segment_end, segment_end, resume_chat_id))
+            segment_start = new_start + length
+            resume_chat_id = chat_id if follows == 'messages' else None
+            parse_gap = follows != 'nothing'
+        segments.append((segment_start - 1 if parse_gap else end_line, end_line, resume_chat_id))
+        return segments
+    
+    def _ends_with_separator(self, line_index: LineIndex, chat_id: int, delta: int) -> bool:
+        """Check that the last message of a chat was closed by a '---' line rather than the end of the file.
+        
+        A User message without a reply or an Agent message without a separator
+        extends over the lines after it, so it may change when lines are added.
+        So does an Agent message whose last '---' is inside an unclosed code
+        fence, which only ended because the file did. The message is scanned
+        again with _find_message_end_from_content(), followed by a message
+        marker standing in for whatever comes next: a closed message ends on
+        its '---', an open one runs on past the marker.
+        
+        Args:
+            line_index: Index of the file being parsed
+            chat_id: Chat to check
+            delta: Offset between the stored line numbers of the chat and its position in the file
+        """
+        last_message = self.cursor.execute("""
+            SELECT message_type, start_line, end_line FROM messages WHERE chat_id = ?
+            ORDER BY start_line DESC, id DESC LIMIT 1
+        """, (chat_id,)).fetchone()
+        if last_message is None:
+            return True
+        message_type, start_line, end_line = last_message
+        if message_type != 'Agent' or start_line is None or end_line is None:
+            return False
+        lines = [line_index.read_line(line_num + delta) for line_num in range(start_line, end_line + 1)]
+        if not lines or None in lines or lines[-1].strip() != '---':
+            return False
+        lines.append('_**User**_\n')
+        kinds = self.kinds
+        self.kinds = classify_lines(lines)
+        try:
+            # Messages stored with their marker line start there, continuations start at their content
+            content_start = 1 if self.kinds[0] & MARKER else 0
+            return self._find_message_end_from_content(lines, content_start) == len(lines) - 2
+        finally:
+            self.kinds = kinds
+    
+    def _shift_content_offsets(self, line_index: LineIndex, kept: List[Tuple[int, int]]):
+        """Move byte offsets of content stored as offsets along with their (chat_id, new_start) chats."""
+        old_offsets = dict(self.cursor.execute("SELECT id, start_offset FROM chats WHERE start_offset IS NOT NULL"))
+        shifts = []
+        for chat_id, new_start in kept:
+            if chat_id in old_offsets:
+                new_offset = line_index.line_offset(new_start)
+                if new_offset != old_offsets[chat_id]:
+                    shifts.append((new_offset - old_offsets[chat_id], new_offset, chat_id))
+        self.cursor.executemany("""
+            UPDATE content SET source_offset = source_offset + ?
+            WHERE source_offset IS NOT NULL AND message_id IN (SELECT id FROM messages WHERE chat_id = ?)
+        """, [(delta, chat_id) for delta, _, chat_id in shifts])
+        self.cursor.executemany("UPDATE chats SET start_offset = ? WHERE id = ?",
+                                [(new_offset, chat_id) for _, new_offset, chat_id in shifts])
+    
+    def _span_matches(self, line_index: LineIndex, start_line: int, length: int, content_hash: str,
+                      claimed_starts: List[int], claimed_ends: List[int]) -> bool:
+        end_line = start_line + length - 1
+        return (end_line <= line_index.line_count and
+                self._span_is_free(claimed_starts, claimed_ends, start_line, length) and
+                line_index.hash_lines(start_line, end_line) == content_hash)
+    
+    def _span_is_free(self, claimed_starts: List[int], claimed_ends: List[int], start_line: int, length: int) -> bool:
+        """Check that a span does not overlap spans already claimed by unchanged chats (sorted by start)."""
+        pos = bisect_left(claimed_starts, start_line)
+        if pos > 0 and claimed_ends[pos - 1] >= start_line:
+            return False
+        return pos == len(claimed_starts) or claimed_starts[pos] > start_line + length - 1
+    
+    def _scan_chat_headers(self, line_index: LineIndex) -> Dict[Tuple[str, str], List[int]]:
+        """Map (title, datetime) of every chat header line to its line numbers (1-indexed, ascending)."""
+        header_lines = defaultdict(list)
+        for line_num, line in line_index.iter_lines(1):
+            if line.startswith('# '):
+                match = CHAT_HEADER_RE.match(line)
+                if match:
+                    header_lines[(match.group(1).strip(), match.group(2).strip())].append(line_num)
+        return header_lines
+    
+    def _first_non_blank_line(self, line_index: LineIndex, start_line: int, end_line: int) -> Optional[str]:
+        if start_line > end_line:
+            return None
+        for line_num, line in line_index.iter_lines(start_line):
+            if line_num > end_line:
+                break
+            if line.strip():
+                return line
         return None
     
+    def _delete_chats(self, chat_ids: List[int]):
+        """Delete chats along with their messages, content and task rows built from them."""
+        # Each delete runs once against temp tables of the ids, so task_groups, which has
+        # no index on user_msg_id, is scanned once instead of once per chat
+        fill_temp_id_table(self.cursor, 'deleted_chat_ids', chat_ids)
+        message_ids = [row[0] for row in self.cursor.execute("""
+            SELECT m.id FROM messages m JOIN temp.deleted_chat_ids d ON d.id = m.chat_id
+        """)]
+        fill_temp_id_table(self.cursor, 'deleted_message_ids', message_ids)
+        tables = {row[0] for row in self.cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+        for table in ('task_groups', 'task_embeddings'):
+            if table in tables:
+                self.cursor.execute(f"""
+                    DELETE FROM {table} WHERE user_msg_id IN (SELECT id FROM temp.deleted_message_ids)
+                """)
+                if self.cursor.rowcount > 0:
+                    print(f"  Deleted {self.cursor.rowcount} {table} entries referencing deleted messages")
+        self.cursor.execute("DELETE FROM content WHERE message_id IN (SELECT id FROM temp.deleted_message_ids)")
+        self._update_chat_stats("m.id IN (SELECT id FROM temp.deleted_message_ids)", [{}], -1)
+        self.cursor.execute("DELETE FROM messages WHERE id IN (SELECT id FROM temp.deleted_message_ids)")
+        deleted_messages = self.cursor.rowcount
+        self.cursor.execute("DELETE FROM chats WHERE id IN (SELECT id FROM temp.deleted_chat_ids)")
+        self._add_chat_count(-self.cursor.rowcount)
+        self.cursor.execute("DELETE FROM chat_stats WHERE count <= 0")
+        print(f"  Deleted {self.cursor.rowcount} chats and {deleted_messages} messages")
+    
     def close(self):
+        if self.line_index is not None:
+            self.line_index.close()
         self.conn.close()
 
 
+def _parse_chunk(filepath: str, index_state: Tuple, start_idx: int, end_idx: int,
+                 stop_chat_idx: Optional[int], content_offsets: bool = False) -> Tuple:
+    """Parse one chunk in a worker process.
+    
+    Returns:
+        Tuple of (stop index, chat rows, message rows, content rows, printed output),
+        with chat and message ids numbered from 1 within the chunk
+    """
+    line_index = LineIndex(filepath, *index_state)
+    parser = ChatParser(':memory:', batch_chats=sys.maxsize, content_offsets=content_offsets)
+    parser.line_index = line_index
+    parser.report_progress = False
+    output = io.StringIO()
+    lines = StreamingLines(filepath, start_idx, end_idx, line_index)
+    try:
+        with redirect_stdout(output):
+            stop_idx = parser._parse_lines(lines, start_idx, stop_chat_idx)
+    finally:
+        lines.close()
+        parser.close()
+    return (stop_idx, list(parser.pending_chats.values()), parser.pending_messages, parser.pending_content,
+            output.getvalue())
+
+
 def main():
     parser = argparse.ArgumentParser(description='Parse chat markdown file into SQLite database')
     parser.add_argument('md_file', help='Path to markdown file to parse')
@@ -912,13 +1333,18 @@ def main():
     parser.add_argument('--max-chats', type=int, default=None, help='Maximum number of chats to parse')
     parser.add_argument('--max-messages', type=int, default=None, help='Maximum number of messages to parse')
     parser.add_argument('--start-chat', type=int, default=0, help='Skip first N chats before parsing')
+    parser.add_argument('--batch-chats', type=int, default=100, help='Number of chats written per database transaction (default: 100)')
+    parser.add_argument('--stream', action='store_true', help='Read markdown lazily with a bounded look-ahead buffer instead of loading the whole file')
+    parser.add_argument('--workers', type=int, default=1, help='Number of processes parsing chunks of the file in parallel (default: 1)')
+    parser.add_argument('--content-offsets', action='store_true', help='Store agent message content as byte offsets into md_file instead of copying the text')
+    parser.add_argument('--compress-content', action='store_true', help='Store content as zlib BLOBs using a dictionary trained on the database\'s tool-use blocks')
     
     args = parser.parse_args()
     
     from db_utils import derive_db_path_from_file
     db_path = derive_db_path_from_file(args.md_file, args.db_file)
     
-    parser_obj = ChatParser(db_path, max_lines=args.max_lines, max_chats=args.max_chats, max_messages=args.max_messages, start_chat=args.start_chat)
+    parser_obj = ChatParser(db_path, max_lines=args.max_lines, max_chats=args.max_chats, max_messages=args.max_messages, start_chat=args.start_chat, streaming=args.stream, batch_chats=args.batch_chats, workers=args.workers, content_offsets=args.content_offsets, compress_content=args.compress_content)
     try:
         parser_obj.parse_file(args.md_file)
         parser_obj.print_stats()
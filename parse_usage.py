@@ -1,13 +1,134 @@
 #!/usr/bin/env python3
+import os
+import sys
+import glob
 import sqlite3
 import argparse
 import csv
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
-from typing import Dict
+from itertools import islice, repeat
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+import numpy as np
+from db_utils import safe_add_column
+from usage_utils import UsageColumns, TOKEN_COLUMNS, create_usage_version_table, usage_transaction
+
+
+USAGE_COLUMNS = ('date', 'kind', 'model', 'max_mode', 'input_with_cache_write', 'input_without_cache_write',
+                 'cache_read', 'output_tokens', 'total_tokens', 'cost', 'timestamp')
+# Columns identifying a usage row, unique in the usage table and across loaded files
+USAGE_KEY_COLUMNS = ('timestamp', 'date', 'kind', 'model')
+
+# CSV headers of the integer token columns, in USAGE_COLUMNS order
+CSV_TOKEN_COLUMNS = ('Input (w/ Cache Write)', 'Input (w/o Cache Write)', 'Cache Read', 'Output Tokens',
+                     'Total Tokens')
+
+# Keys of the TPS statistics for usage_utils.TOKEN_COLUMNS, in the same order
+TPS_KEYS = ('input_w_cache', 'input_wo_cache', 'cache_read', 'output', 'total')
+TPS_WINDOWS = [1, 2, 3, 4, 5, 6, 7]
+TPS_PERCENTILES = (50, 95, 99)
+
+
+def _parse_timestamp(date_str: str) -> Optional[float]:
+    """Unix timestamp of an ISO 8601 date such as '2025-12-09T20:09:45.973Z', None if invalid."""
+    try:
+        return datetime.fromisoformat(date_str.replace('Z', '+00:00')).timestamp()
+    except ValueError:
+        return None
+
+
+def _parse_csv_rows(records: List[List[str]], columns: Dict[str, int]) -> List[Tuple]:
+    """Convert CSV records to usage rows, one column at a time.
+    
+    Records with an unparseable date or an error kind are dropped before the
+    token and cost columns are cast, so footers and other malformed lines
+    are skipped rather than failing the load.
+    
+    Args:
+        records: CSV records without the header
+        columns: Column index by CSV header name
+    
+    Returns:
+        Rows in USAGE_COLUMNS order
+    """
+    width = len(columns)
+    # Transpose the chunk so every column is converted in one pass
+    fields = list(zip(*(record if len(record) >= width else record + [''] * (width - len(record))
+                        for record in records)))
+    count = len(records)
+    
+    def column(name: str, default: str = '') -> List[str]:
+        if name not in columns:
+            return [default] * count
+        return [value.strip('"') or default for value in fields[columns[name]]]
+    
+    dates = column('Date')
+    timestamps = [_parse_timestamp(date_str) for date_str in dates]
+    kinds = column('Kind')
+    kept = [idx for idx, (timestamp, kind) in enumerate(zip(timestamps, kinds))
+            if timestamp is not None and 'Error' not in kind]
+    if len(kept) < count:
+        fields = [[values[idx] for idx in kept] for values in fields]
+        dates, timestamps, kinds = ([values[idx] for idx in kept] for values in (dates, timestamps, kinds))
+        count = len(kept)
+    text_columns = [column('Model'), column('Max Mode')]
+    token_columns = [list(map(int, column(name, '0'))) for name in CSV_TOKEN_COLUMNS]
+    costs = list(map(float, column('Cost', '0')))
+    
+    return list(zip(dates, kinds, *text_columns, *token_columns, costs, timestamps))
+
+
+def _read_csv_chunks(csv_file: str, chunk_rows: int) -> Iterator[List[Tuple]]:
+    """Yield the usage rows of a CSV export, parsed chunk_rows records at a time."""
+    with open(csv_file, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        columns = {name.strip('"'): idx for idx, name in enumerate(header)}
+        while True:
+            chunk = list(islice(reader, chunk_rows))
+            if not chunk:
+                break
+            yield _parse_csv_rows(chunk, columns)
+
+
+def _parse_csv_file(csv_file: str, chunk_rows: int) -> List[List[Tuple]]:
+    """Parse a whole CSV export in a worker process, returning its row chunks.
+    
+    Unlike _read_csv_chunks(), this builds every row of the file in memory,
+    since a worker's result is sent back in one piece, and the pool may hold
+    the results of several files at once.
+    """
+    return list(_read_csv_chunks(csv_file, chunk_rows))
+
+
+def expand_csv_paths(paths: List[str]) -> List[str]:
+    """Expand CSV file paths, directories and glob patterns to a sorted list of CSV files.
+    
+    Args:
+        paths: Files, directories (all *.csv files directly inside) or glob patterns
+    
+    Returns:
+        Paths of the CSV files, each listed once
+    """
+    csv_files = set()
+    for path in paths:
+        if os.path.isdir(path):
+            csv_files.update(glob.glob(os.path.join(path, '*.csv')))
+        elif os.path.isfile(path):
+            csv_files.add(path)
+        else:
+            csv_files.update(match for match in glob.glob(path) if os.path.isfile(match))
+    unique = {}
+    for csv_file in sorted(csv_files):
+        unique.setdefault(os.path.abspath(csv_file), csv_file)
+    return list(unique.values())
 
 
 class UsageParser:
-    def __init__(self, db_path: str):
+    INGEST_CHUNK_ROWS = 10000
+    
+    def __init__(self, db_path: str, workers: int = 1):
+        self.workers = max(1, workers)
         self.conn = sqlite3.connect(db_path)
         self.cursor = self.conn.cursor()
         self._create_table()
@@ -30,6 +151,31 @@ class UsageParser:
             )
         """)
         self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_timestamp ON usage(timestamp)")
+        
+        has_unique_key = self.cursor.execute("""
+            SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_usage_unique'
+        """).fetchone()
+        if not has_unique_key:
+            # Usage loaded before the unique key existed may contain duplicates
+            self.cursor.execute(f"""
+                DELETE FROM usage WHERE id NOT IN (
+                    SELECT MIN(id) FROM usage GROUP BY {', '.join(USAGE_KEY_COLUMNS)}
+                )
+            """)
+            if self.cursor.rowcount > 0:
+                print(f"Removed {self.cursor.rowcount} duplicate usage records")
+        self.cursor.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_usage_unique ON usage({', '.join(USAGE_KEY_COLUMNS)})")
+        # Database a row was imported from by load_databases(), NULL for rows loaded from CSV files
+        safe_add_column(self.cursor, 'usage', 'source_db TEXT')
+        self.cursor.execute("""
+            CREATE TABLE IF NOT EXISTS usage_sources (
+                file_path TEXT PRIMARY KEY,
+                file_size INTEGER,
+                file_mtime_ns INTEGER,
+                row_count INTEGER
+            )
+        """)
+        create_usage_version_table(self.cursor)
         self.conn.commit()
     
     def has_usage_data(self) -> bool:
@@ -37,181 +183,265 @@ class UsageParser:
         count = self.cursor.execute("SELECT COUNT(*) FROM usage").fetchone()[0]
         return count > 0
     
-    def load_csv(self, csv_file: str, skip_if_exists: bool = True):
-        if skip_if_exists and self.has_usage_data():
+    def load_csv(self, csv_file: str, skip_if_exists: bool = True) -> bool:
+        """Load a usage CSV export, skipping rows that are already in the database.
+        
+        Args:
+            csv_file: Path to the usage CSV export
+            skip_if_exists: Keep existing usage data and add only new rows;
+                if False, existing usage data is deleted first
+        
+        Returns:
+            True if any rows were added
+        """
+        return self.load_csv_files([csv_file], skip_if_exists)
+    
+    def load_csv_files(self, csv_files: List[str], skip_if_exists: bool = True) -> bool:
+        """Load usage CSV exports that may overlap in time, skipping rows already loaded.
+        
+        Files whose size and modification time match usage_sources were loaded
+        before and are skipped without being read. The others are parsed in
+        chunks of INGEST_CHUNK_ROWS rows, a column at a time, by a process pool
+        when there are several of them. Rows are written with INSERT OR IGNORE
+        in one transaction, so the unique key on USAGE_KEY_COLUMNS drops rows
+        already in the database as well as rows repeated across files.
+        
+        Args:
+            csv_files: Paths of the usage CSV exports
+            skip_if_exists: Keep existing usage data and add only new rows;
+                if False, existing usage data is deleted first
+        
+        Returns:
+            True if any rows were added
+        """
+        # Usage data is deleted in the same transaction that loads the files
+        reset = not (skip_if_exists and self.has_usage_data())
+        if not reset:
             max_timestamp = self.cursor.execute("SELECT MAX(timestamp) FROM usage").fetchone()[0]
             if max_timestamp:
                 print(f"Existing usage data found (latest timestamp: {datetime.fromtimestamp(max_timestamp).isoformat()})")
-                print("Will only add new records with timestamps after this point")
+                print("Will only add records that are not in the database yet")
             else:
                 count = self.cursor.execute("SELECT COUNT(*) FROM usage").fetchone()[0]
                 print(f"Skipping usage parsing: {count} usage records already exist in database")
                 return False
-        else:
-            max_timestamp = None
-            self.cursor.execute("DELETE FROM usage")
-            self.conn.commit()
-        
-        with open(csv_file, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            rows = []
-            skipped_count = 0
-            for row in reader:
-                date_str = row['Date'].strip('"')
-                try:
-                    dt = datetime.fromisoformat(date_str.replace('Z', '+00:00'))
-                    timestamp = dt.timestamp()
-                except:
-                    continue
-                
-                if max_timestamp is not None and timestamp <= max_timestamp:
-                    skipped_count += 1
-                    continue
-                
-                existing = self.cursor.execute("""
-                    SELECT id FROM usage WHERE timestamp = ? AND date = ?
-                """, (timestamp, date_str)).fetchone()
-                if existing:
-                    skipped_count += 1
-                    continue
-                kind = row.get('Kind', '').strip('"')
-                if 'Error' in kind:
-                    continue
-                rows.append((
-                    date_str,
-                    kind,
-                    row.get('Model', '').strip('"'),
-                    row.get('Max Mode', '').strip('"'),
-                    int(row.get('Input (w/ Cache Write)', '0') or '0'),
-                    int(row.get('Input (w/o Cache Write)', '0') or '0'),
-                    int(row.get('Cache Read', '0') or '0'),
-                    int(row.get('Output Tokens', '0') or '0'),
-                    int(row.get('Total Tokens', '0') or '0'),
-                    float(row.get('Cost', '0') or '0'),
-                    timestamp
-                ))
-        
-        if skipped_count > 0:
-            print(f"Skipped {skipped_count} existing records")
-        
-        if rows:
-            self.cursor.executemany("""
-                INSERT INTO usage (
-                    date, kind, model, max_mode,
-                    input_with_cache_write, input_without_cache_write, cache_read,
-                    output_tokens, total_tokens, cost, timestamp
-                ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
-            """, rows)
-            self.conn.commit()
-            print(f"Added {len(rows)} new usage records")
+        
+        changed_files = []
+        for csv_file in csv_files:
+            stat = os.stat(csv_file)
+            loaded = not reset and self.cursor.execute("""
+                SELECT 1 FROM usage_sources WHERE file_path = ? AND file_size = ? AND file_mtime_ns = ?
+            """, (os.path.abspath(csv_file), stat.st_size, stat.st_mtime_ns)).fetchone()
+            if not loaded:
+                changed_files.append((csv_file, stat))
+        unchanged_count = len(csv_files) - len(changed_files)
+        if unchanged_count:
+            print(f"Skipping {unchanged_count} CSV files unchanged since they were loaded")
+        
+        parsed_count = 0
+        added_count = 0
+        if reset or changed_files:
+            with usage_transaction(self.conn) as cursor:
+                if reset:
+                    cursor.execute("DELETE FROM usage")
+                    cursor.execute("DELETE FROM usage_sources")
+                for (csv_file, stat), chunks in zip(changed_files,
+                                                    self._parse_csv_files([path for path, _ in changed_files])):
+                    file_count = 0
+                    for rows in chunks:
+                        file_count += len(rows)
+                        cursor.executemany(f"""
+                            INSERT OR IGNORE INTO usage ({', '.join(USAGE_COLUMNS)})
+                            VALUES ({', '.join('?' * len(USAGE_COLUMNS))})
+                        """, rows)
+                        added_count += max(cursor.rowcount, 0)
+                    parsed_count += file_count
+                    cursor.execute("""
+                        INSERT OR REPLACE INTO usage_sources (file_path, file_size, file_mtime_ns, row_count)
+                        VALUES (?, ?, ?, ?)
+                    """, (os.path.abspath(csv_file), stat.st_size, stat.st_mtime_ns, file_count))
+        
+        if parsed_count > added_count:
+            print(f"Skipped {parsed_count - added_count} records already loaded or repeated across files")
+        
+        if added_count:
+            print(f"Added {added_count} new usage records")
             return True
         else:
             print("No new records to add")
             return False
     
+    def load_databases(self, db_paths: List[str]) -> bool:
+        """Import the usage tables of other databases, skipping databases imported before.
+        
+        Like CSV files, source databases are recorded in usage_sources with
+        their size and modification time, and only new or changed ones are
+        read again. Every imported row records its database in source_db.
+        Sources that changed or are no longer in db_paths are forgotten and
+        their rows deleted first, so rows removed from a source or imported
+        for another set of databases do not stay behind. The unchanged
+        databases are then imported again with INSERT OR IGNORE to restore
+        rows they shared with the deleted ones.
+        
+        Args:
+            db_paths: Paths of databases with a usage table
+        
+        Returns:
+            True if any rows were added or removed
+        """
+        self.cursor.execute("CREATE INDEX IF NOT EXISTS idx_usage_source_db ON usage(source_db)")
+        own_path = os.path.abspath(self.conn.execute("PRAGMA database_list").fetchone()[2] or '')
+        sources = {}
+        for db_path in db_paths:
+            if os.path.abspath(db_path) != own_path:
+                sources.setdefault(os.path.abspath(db_path), (db_path, os.stat(db_path)))
+        
+        recorded = {file_path: (file_size, file_mtime_ns) for file_path, file_size, file_mtime_ns in
+                    self.cursor.execute("SELECT file_path, file_size, file_mtime_ns FROM usage_sources")}
+        unchanged = {file_path for file_path, (_, stat) in sources.items()
+                     if recorded.get(file_path) == (stat.st_size, stat.st_mtime_ns)}
+        stale = [file_path for file_path in recorded if file_path not in unchanged]
+        removed_count = 0
+        if stale:
+            with usage_transaction(self.conn) as cursor:
+                for file_path in stale:
+                    cursor.execute("DELETE FROM usage WHERE source_db = ?", (file_path,))
+                    removed_count += max(cursor.rowcount, 0)
+                    cursor.execute("DELETE FROM usage_sources WHERE file_path = ?", (file_path,))
+        if removed_count:
+            print(f"Removed {removed_count} usage records of databases that changed or are no longer matched")
+        
+        changed_dbs = [(file_path, db_path, stat) for file_path, (db_path, stat) in sources.items()
+                       if removed_count or file_path not in unchanged]
+        if not changed_dbs:
+            return removed_count > 0
+        
+        added_count = 0
+        for file_path, db_path, stat in changed_dbs:
+            # ATTACH is not allowed inside a transaction, so every database is imported in its own
+            self.cursor.execute("ATTACH DATABASE ? AS source", (db_path,))
+            try:
+                with usage_transaction(self.conn) as cursor:
+                    has_usage = cursor.execute("""
+                        SELECT 1 FROM source.sqlite_master WHERE type = 'table' AND name = 'usage'
+                    """).fetchone()
+                    if not has_usage:
+                        print(f"Skipping {db_path}: no usage table")
+                        row_count = 0
+                    else:
+                        row_count = cursor.execute("SELECT COUNT(*) FROM source.usage").fetchone()[0]
+                        cursor.execute(f"""
+                            INSERT OR IGNORE INTO usage ({', '.join(USAGE_COLUMNS)}, source_db)
+                            SELECT {', '.join(USAGE_COLUMNS)}, ? FROM source.usage ORDER BY timestamp
+                        """, (file_path,))
+                        added_count += max(cursor.rowcount, 0)
+                    cursor.execute("""
+                        INSERT OR REPLACE INTO usage_sources (file_path, file_size, file_mtime_ns, row_count)
+                        VALUES (?, ?, ?, ?)
+                    """, (file_path, stat.st_size, stat.st_mtime_ns, row_count))
+            finally:
+                self.cursor.execute("DETACH DATABASE source")
+        
+        print(f"Imported {len(changed_dbs)} usage databases: {added_count} new usage records")
+        return added_count > 0 or removed_count > 0
+    
+    def _parse_csv_files(self, csv_files: List[str]) -> Iterator[Iterable[List[Tuple]]]:
+        """Yield the row chunks of each CSV file in order, parsing several files in a process pool."""
+        if self.workers == 1 or len(csv_files) < 2:
+            for csv_file in csv_files:
+                yield _read_csv_chunks(csv_file, self.INGEST_CHUNK_ROWS)
+            return
+        workers = min(self.workers, len(csv_files))
+        print(f"Parsing {len(csv_files)} CSV files with {workers} worker processes")
+        sys.stdout.flush()
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            yield from pool.map(_parse_csv_file, csv_files, repeat(self.INGEST_CHUNK_ROWS))
+    
     def get_overall_stats(self) -> Dict:
-        stats = self.cursor.execute("""
-            SELECT 
-                COUNT(*) as total_requests,
-                SUM(input_with_cache_write) as total_input_w_cache,
-                SUM(input_without_cache_write) as total_input_wo_cache,
-                SUM(cache_read) as total_cache_read,
-                SUM(output_tokens) as total_output,
-                SUM(total_tokens) as total_tokens,
-                AVG(input_with_cache_write) as avg_input_w_cache,
-                AVG(input_without_cache_write) as avg_input_wo_cache,
-                AVG(cache_read) as avg_cache_read,
-                AVG(output_tokens) as avg_output,
-                AVG(total_tokens) as avg_total
-            FROM usage
-        """).fetchone()
+        usage = UsageColumns.load(self.conn)
+        count = len(usage)
+        totals = [int(usage[name].sum()) for name in TOKEN_COLUMNS]
+        averages = [total / count if count else 0.0 for total in totals]
         
         return {
-            'total_requests': stats[0] or 0,
-            'total_input_w_cache': stats[1] or 0,
-            'total_input_wo_cache': stats[2] or 0,
-            'total_cache_read': stats[3] or 0,
-            'total_output': stats[4] or 0,
-            'total_tokens': stats[5] or 0,
-            'avg_input_w_cache': stats[6] or 0.0,
-            'avg_input_wo_cache': stats[7] or 0.0,
-            'avg_cache_read': stats[8] or 0.0,
-            'avg_output': stats[9] or 0.0,
-            'avg_total': stats[10] or 0.0,
+            'total_requests': count,
+            'total_input_w_cache': totals[0],
+            'total_input_wo_cache': totals[1],
+            'total_cache_read': totals[2],
+            'total_output': totals[3],
+            'total_tokens': totals[4],
+            'avg_input_w_cache': averages[0],
+            'avg_input_wo_cache': averages[1],
+            'avg_cache_read': averages[2],
+            'avg_output': averages[3],
+            'avg_total': averages[4],
         }
     
-    def calculate_tps_stats(self, window_minutes: int) -> Dict:
-        window_seconds = window_minutes * 60
-        
-        rows = self.cursor.execute("""
-            SELECT 
-                id, timestamp,
-                input_with_cache_write, input_without_cache_write,
-                cache_read, output_tokens, total_tokens
-            FROM usage
-            ORDER BY timestamp
-        """).fetchall()
-        
-        token_totals = {
-            'input_w_cache': 0,
-            'input_wo_cache': 0,
-            'cache_read': 0,
-            'output': 0,
-            'total': 0,
-        }
-        individual_tps_sums = {
-            'input_w_cache': 0.0,
-            'input_wo_cache': 0.0,
-            'cache_read': 0.0,
-            'output': 0.0,
-            'total': 0.0,
-        }
-        total_time = 0.0
-        request_count = 0
-        
-        for i in range(1, len(rows)):
-            prev_row = rows[i-1]
-            curr_row = rows[i]
-            
-            time_diff = curr_row[1] - prev_row[1]
-            
-            if 0 < time_diff <= window_seconds:
-                request_count += 1
-                total_time += time_diff
-                
-                token_totals['input_w_cache'] += curr_row[2]
-                token_totals['input_wo_cache'] += curr_row[3]
-                token_totals['cache_read'] += curr_row[4]
-                token_totals['output'] += curr_row[5]
-                token_totals['total'] += curr_row[6]
-                
-                if time_diff > 0:
-                    individual_tps_sums['input_w_cache'] += curr_row[2] / time_diff
-                    individual_tps_sums['input_wo_cache'] += curr_row[3] / time_diff
-                    individual_tps_sums['cache_read'] += curr_row[4] / time_diff
-                    individual_tps_sums['output'] += curr_row[5] / time_diff
-                    individual_tps_sums['total'] += curr_row[6] / time_diff
-        
-        overall_tps = {}
-        avg_tps = {}
-        for key in token_totals:
-            overall_tps[key] = token_totals[key] / total_time if total_time > 0 else 0.0
-            avg_tps[key] = individual_tps_sums[key] / request_count if request_count > 0 else 0.0
+    def calculate_tps_stats_by_window(self, windows: List[int]) -> Dict[int, Dict]:
+        """Calculate TPS statistics for several time windows from one read of the usage table.
         
-        return {
-            'request_count': request_count,
-            'token_totals': token_totals,
-            'total_time': total_time,
-            'overall_tps': overall_tps,
-            'avg_tps': avg_tps
-        }
+        A request counts for a window when the gap since the previous request
+        is positive and at most the window. Gaps are sorted once with prefix
+        sums of their tokens, time and per-request TPS, so every window is the
+        prefix of gaps up to its length and costs a binary search plus the
+        percentiles of that prefix.
+        
+        Args:
+            windows: Window sizes in minutes
+        
+        Returns:
+            Stats by window: request_count, token_totals, total_time,
+            overall_tps, avg_tps and percentile_tps (TPS_PERCENTILES of
+            per-request TPS), all but request_count and total_time by TPS_KEYS
+        """
+        usage = UsageColumns.load(self.conn)
+        timestamps, tokens = usage['timestamp'], usage.tokens()
+        gaps = np.diff(timestamps)
+        tokens = tokens[1:]
+        positive = gaps > 0
+        order = np.argsort(gaps[positive], kind='stable')
+        gaps = gaps[positive][order]
+        tokens = tokens[positive][order]
+        request_tps = tokens / gaps[:, None]
+        
+        time_sums = np.cumsum(gaps)
+        token_sums = np.cumsum(tokens, axis=0)
+        tps_sums = np.cumsum(request_tps, axis=0)
+        counts = np.searchsorted(gaps, np.asarray(windows, dtype=np.float64) * 60, side='right')
+        
+        results = {}
+        for window, count in zip(windows, counts):
+            count = int(count)
+            if count == 0:
+                zeros = dict.fromkeys(TPS_KEYS, 0.0)
+                results[window] = {
+                    'request_count': 0,
+                    'token_totals': dict.fromkeys(TPS_KEYS, 0),
+                    'total_time': 0.0,
+                    'overall_tps': zeros,
+                    'avg_tps': dict(zeros),
+                    'percentile_tps': {p: dict(zeros) for p in TPS_PERCENTILES},
+                }
+                continue
+            total_time = float(time_sums[count - 1])
+            percentiles = np.percentile(request_tps[:count], TPS_PERCENTILES, axis=0)
+            results[window] = {
+                'request_count': count,
+                'token_totals': dict(zip(TPS_KEYS, token_sums[count - 1].tolist())),
+                'total_time': total_time,
+                'overall_tps': dict(zip(TPS_KEYS, (token_sums[count - 1] / total_time).tolist())),
+                'avg_tps': dict(zip(TPS_KEYS, (tps_sums[count - 1] / count).tolist())),
+                'percentile_tps': {p: dict(zip(TPS_KEYS, row.tolist())) for p, row in zip(TPS_PERCENTILES, percentiles)},
+            }
+        return results
+    
+    def calculate_tps_stats(self, window_minutes: int) -> Dict:
+        return self.calculate_tps_stats_by_window([window_minutes])[window_minutes]
     
     def print_unified_stats(self):
         stats = self.get_overall_stats()
         
-        tps_by_window = {}
-        for window in [1, 2, 3, 4, 5, 6, 7]:
-            tps_by_window[window] = self.calculate_tps_stats(window)
+        tps_by_window = self.calculate_tps_stats_by_window(TPS_WINDOWS)
         
         print("## Usage Statistics\n")
         print("TPS metrics shown only for consecutive requests within the specified time window.\n")
@@ -246,13 +476,20 @@ class UsageParser:
         print(row)
         
         for calc_type, calc_key in [('Avg TPS', 'avg_tps'), ('Overall TPS', 'overall_tps')]:
-            for window in [1, 2, 3, 4, 5, 6, 7]:
+            for window in TPS_WINDOWS:
                 window_data = tps_by_window[window]
                 row = f"| {window}min {calc_type} | {window_data['request_count']:,} |"
                 for _, tps_key, _, _ in tps_columns:
                     tps_val = window_data[calc_key][tps_key]
                     row += f" {tps_val:,.2f} |"
                 print(row)
+        for percentile in TPS_PERCENTILES:
+            for window in TPS_WINDOWS:
+                window_data = tps_by_window[window]
+                row = f"| {window}min p{percentile} TPS | {window_data['request_count']:,} |"
+                for _, tps_key, _, _ in tps_columns:
+                    row += f" {window_data['percentile_tps'][percentile][tps_key]:,.2f} |"
+                print(row)
         print()
     
     def close(self):
@@ -260,19 +497,26 @@ class UsageParser:
 
 
 def main():
-    parser = argparse.ArgumentParser(description='Parse usage CSV file into SQLite database and show statistics')
-    parser.add_argument('csv_file', help='Path to CSV file to parse')
-    parser.add_argument('--db-file', default=None, help='SQLite database path (default: same as csv_file with .db extension)')
+    parser = argparse.ArgumentParser(description='Parse usage CSV files into SQLite database and show statistics')
+    parser.add_argument('csv_files', nargs='+', help='CSV files, directories of CSV files or glob patterns to parse')
+    parser.add_argument('--db-file', default=None, help='SQLite database path (default: first CSV file or directory with .db extension)')
     parser.add_argument('--force', action='store_true', help='Force re-parsing even if usage data exists')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Number of processes parsing CSV files in parallel (default: number of CPUs)')
     
     args = parser.parse_args()
     
+    csv_files = expand_csv_paths(args.csv_files)
+    if not csv_files:
+        parser.error(f"No CSV files found in: {' '.join(args.csv_files)}")
+    
     from db_utils import derive_db_path_from_file
-    db_path = derive_db_path_from_file(args.csv_file, args.db_file)
+    first_path = args.csv_files[0]
+    db_path = derive_db_path_from_file(first_path.rstrip(os.sep) if os.path.isdir(first_path) else csv_files[0],
+                                       args.db_file)
     
-    parser_obj = UsageParser(db_path)
+    parser_obj = UsageParser(db_path, workers=args.workers)
     try:
-        parsed = parser_obj.load_csv(args.csv_file, skip_if_exists=not args.force)
+        parsed = parser_obj.load_csv_files(csv_files, skip_if_exists=not args.force)
         parser_obj.print_unified_stats()
     finally:
         parser_obj.close()
@@ -4,20 +4,22 @@ import numpy as np
 import argparse
 from embedding_utils import decompress_embedding, cosine_similarity
 from db_utils import find_db_file, add_db_file_argument
+from content_utils import ContentReader
 
 
 def show_similarity_matrix(db_path: str):
     conn = sqlite3.connect(db_path)
     cursor = conn.cursor()
+    content_reader = ContentReader(conn)
     
     tasks = cursor.execute("""
         SELECT se.user_msg_id, se.embedding_data,
-               m.message_datetime,
-               (SELECT content_text FROM content WHERE message_id = se.user_msg_id) as user_content
+               m.message_datetime
         FROM task_embeddings se
         JOIN messages m ON se.user_msg_id = m.id
         ORDER BY m.message_datetime, m.start_line
     """).fetchall()
+    tasks = [row + (content_reader.get_text(row[0]),) for row in tasks]
     
     if not tasks:
         print("No embeddings found in database")
@@ -70,15 +72,14 @@ def show_similarity_matrix(db_path: str):
     user_msg_ids = [task[0] for task in tasks]
     placeholders = ','.join(['?'] * len(user_msg_ids))
     cursor.execute(f"""
-        SELECT id, message_datetime,
-               (SELECT content_text FROM content WHERE message_id = id) as user_content
+        SELECT id, message_datetime
         FROM messages
         WHERE id IN ({placeholders})
         ORDER BY message_datetime, start_line
     """, user_msg_ids)
     
     print("\nTask Details:\n")
-    details = cursor.fetchall()
+    details = [row + (content_reader.get_text(row[0]),) for row in cursor.fetchall()]
     for user_msg_id, msg_dt, user_content in details:
         preview = user_content[:100].replace('\n', ' ') if user_content else ''
         print(f"Seq {user_msg_id} ({msg_dt}): {preview}...")
@@ -1,14 +1,169 @@
 #!/usr/bin/env python3
 import sqlite3
 import re
+import json
+import heapq
+from array import array
+from collections.abc import Mapping
 from datetime import datetime, timezone
-from typing import List, Dict, Optional
+from functools import lru_cache
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+from content_utils import ContentReader
+from db_utils import fill_temp_id_table
+
+
+# Bump when the way tasks are built changes, so stored tasks are rebuilt
+TASK_FORMAT_VERSION = 1
+
+# Columns of the tasks table besides the span (user_msg_id, next_user_msg_id), in task dict order
+TASK_COLUMNS = ('chat_id', 'user_timestamp', 'user_datetime_str', 'user_content', 'agent_summaries', 'message_count',
+                'formatted_text', 'formatted_length', 'task_end_timestamp', 'total_content_length',
+                'user_content_length', 'agent_count', 'agent_total_length', 'agent_text_length', 'agent_timestamps')
+JSON_TASK_COLUMNS = ('agent_summaries', 'agent_timestamps')
+
+# Message columns a task is built from; updating other columns (like start_line) keeps stored tasks
+TASK_MESSAGE_COLUMNS = ('chat_id', 'message_type', 'message_datetime', 'content_length', 'content_type', 'summary',
+                        'data_tool_type', 'data_tool_name')
+TASK_FIELDS = ('user_msg_id',) + TASK_COLUMNS
+
+# Tool results that are dropped from task summaries
+ERROR_SUMMARY_PATTERN = re.compile('|'.join(re.escape(pattern) for pattern in (
+    "The string to replace was not found in the file.",
+    "Invalid: old_string and new_string are exactly the same.",
+    "Cancelled",
+)))
+
+
+class ParsedSummary(NamedTuple):
+    """What TaskBuilder._filter_summaries() needs to know about one agent summary."""
+    key: str  # normalized summary for duplicate detection
+    op_type: Optional[str]  # 'read' or 'edit' for file operations, otherwise None
+    file_path: Optional[str]
+    is_error: bool
+    is_command: bool
+    is_todo: bool
+
+
+@lru_cache(maxsize=65536)
+def parse_summary(summary: str) -> ParsedSummary:
+    """Parse an agent summary once; the same tool summaries recur across tasks, so results are cached."""
+    op_type = file_path = None
+    key = summary
+    # For file operations, normalize by tool and file path to detect same file operations
+    if 'Read file:' in summary:
+        op_type = 'read'
+        file_path = summary.split('Read file:')[1].split(' •')[0].strip()
+        key = f"{summary.split('**')[1] if '**' in summary else 'read_file'}:{file_path}"
+    elif 'Edit file:' in summary:
+        op_type = 'edit'
+        file_path = summary.split('Edit file:')[1].split(' •')[0].strip()
+        key = f"{summary.split('**')[1] if '**' in summary else 'code_edit'}:{file_path}"
+    return ParsedSummary(key, op_type, file_path, ERROR_SUMMARY_PATTERN.search(summary) is not None,
+                         '**command**' in summary, '**todo_write**' in summary or 'Todo List' in summary)
+
+
+class Task(Mapping):
+    """A built task: a user message and the agent messages answering it.
+    
+    Fields are slots rather than dict entries, and agent_timestamps is a
+    compact array('d'), which keeps many tasks small in memory. Tasks read
+    with only some fields (see TaskBuilder.iter_message_tasks()) hold just
+    those. A Task is a read-only mapping, so task['field'], task.get(),
+    dict(task) and {**task} work as for plain dicts.
+    """
+    __slots__ = TASK_FIELDS
+    
+    def __init__(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, array('d', value) if name == 'agent_timestamps' else value)
+    
+    def __getitem__(self, name: str):
+        if name not in TASK_FIELDS:
+            raise KeyError(name)
+        try:
+            return getattr(self, name)
+        except AttributeError:
+            raise KeyError(name) from None
+    
+    def __iter__(self) -> Iterator[str]:
+        return (name for name in TASK_FIELDS if hasattr(self, name))
+    
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+    
+    def __repr__(self) -> str:
+        return f"Task({', '.join(f'{name}={value!r}' for name, value in self.items())})"
 
 
 class TaskBuilder:
-    def __init__(self, chats_db: str):
-        self.chats_conn = sqlite3.connect(chats_db)
+    def __init__(self, chats_db: str, conn: Optional[sqlite3.Connection] = None):
+        """Open the chats database, or use conn if given.
+        
+        Pass the connection a caller writes with when it writes while
+        iterating iter_message_tasks(): an open read on a second connection
+        would keep its commits waiting on the database lock.
+        """
+        self.chats_conn = conn if conn is not None else sqlite3.connect(chats_db)
         self.chats_cursor = self.chats_conn.cursor()
+        self.content_reader = ContentReader(self.chats_conn)
+        self._create_tasks_table()
+    
+    def _create_tasks_table(self):
+        """Create the tasks table and the triggers on messages that keep it valid.
+        
+        A stored task covers the message ids from user_msg_id up to (not
+        including) next_user_msg_id, the chat's next user message, or to the
+        end of the chat when that is NULL. Inserting, deleting or changing a
+        message deletes the stored task whose span holds it, and
+        refresh_tasks() builds it again.
+        """
+        cursor = self.chats_cursor
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tasks (
+                user_msg_id INTEGER PRIMARY KEY,
+                next_user_msg_id INTEGER,
+                chat_id INTEGER,
+                user_timestamp REAL,
+                user_datetime_str TEXT,
+                user_content TEXT,
+                agent_summaries TEXT,
+                message_count INTEGER,
+                formatted_text TEXT,
+                formatted_length INTEGER,
+                task_end_timestamp REAL,
+                total_content_length INTEGER,
+                user_content_length INTEGER,
+                agent_count INTEGER,
+                agent_total_length INTEGER,
+                agent_text_length INTEGER,
+                agent_timestamps TEXT
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_chat_id ON tasks(chat_id, user_msg_id)")
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_tasks_user_timestamp ON tasks(user_timestamp)")
+        cursor.execute("CREATE TABLE IF NOT EXISTS tasks_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER)")
+        stored = cursor.execute("SELECT version FROM tasks_version WHERE id = 1").fetchone()
+        if stored is None or stored[0] != TASK_FORMAT_VERSION:
+            cursor.execute("DELETE FROM tasks")
+            cursor.execute("INSERT OR REPLACE INTO tasks_version (id, version) VALUES (1, ?)", (TASK_FORMAT_VERSION,))
+        
+        invalidate = """
+            DELETE FROM tasks WHERE chat_id = {row}.chat_id AND user_msg_id <= {row}.id
+                AND (next_user_msg_id IS NULL OR next_user_msg_id > {row}.id);
+        """
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tasks_invalidate_insert AFTER INSERT ON messages
+            BEGIN {invalidate.format(row='NEW')} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tasks_invalidate_delete AFTER DELETE ON messages
+            BEGIN {invalidate.format(row='OLD')} END
+        """)
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS tasks_invalidate_update AFTER UPDATE OF {', '.join(TASK_MESSAGE_COLUMNS)} ON messages
+            BEGIN {invalidate.format(row='OLD')} {invalidate.format(row='NEW')} END
+        """)
+        self.chats_conn.commit()
     
     def parse_chat_datetime(self, dt_str: str) -> Optional[float]:
         if not dt_str:
@@ -33,382 +188,308 @@ class TaskBuilder:
             summary_match = re.search(r'<summary>(.*?)</summary>', content_text, re.DOTALL)
             return len(summary_match.group(1)) if summary_match else 0
     
-    def get_task_for_user_message(self, user_msg_id: int) -> Optional[Dict]:
-        """Get a single task for a specific user message."""
-        user_msg = self.chats_cursor.execute("""
-            SELECT id, chat_id, message_datetime, content_length
-            FROM messages
-            WHERE id = ? AND message_type = 'User' AND message_datetime IS NOT NULL
-        """, (user_msg_id,)).fetchone()
+    def get_task_for_user_message(self, user_msg_id: int) -> Optional[Task]:
+        """Get a single task for a specific user message, or None if it has no task."""
+        row = self._select_tasks(TASK_COLUMNS, "WHERE t.user_msg_id = ?", (user_msg_id,)).fetchone()
+        if row is None and self.refresh_tasks():
+            row = self._select_tasks(TASK_COLUMNS, "WHERE t.user_msg_id = ?", (user_msg_id,)).fetchone()
+        return self._task_from_row(TASK_FIELDS, row) if row is not None else None
+    
+    def get_message_tasks(self, since_timestamp: Optional[float] = None) -> List[Task]:
+        """Build a task for every user message, in message time order; see iter_message_tasks()."""
+        return list(self.iter_message_tasks(since_timestamp))
+    
+    def count_message_tasks(self, since_timestamp: Optional[float] = None) -> int:
+        """Number of tasks iter_message_tasks() yields for since_timestamp."""
+        self.refresh_tasks()
+        return self.chats_conn.execute("SELECT COUNT(*) FROM tasks WHERE user_timestamp >= ?",
+                                       (since_timestamp if since_timestamp is not None else float('-inf'),)).fetchone()[0]
+    
+    def iter_message_tasks(self, since_timestamp: Optional[float] = None,
+                           fields: Optional[Iterable[str]] = None) -> Iterator[Task]:
+        """Yield a task for every user message, in message time order.
         
-        if not user_msg:
-            return None
+        A task is a user message with the agent messages after it in the same
+        chat, up to the chat's next user message. Tasks are read from the
+        tasks table after refresh_tasks() has built the missing ones, so
+        only tasks whose messages changed since the last run are built again.
         
-        chat_id, user_dt_str, user_content_len = user_msg[1], user_msg[2], user_msg[3]
-        user_timestamp = self.parse_chat_datetime(user_dt_str)
-        if not user_timestamp:
-            return None
+        Args:
+            since_timestamp: Only yield tasks whose user message is at or after
+                this Unix timestamp (default: all tasks)
+            fields: Task fields to read besides user_msg_id (default: all);
+                reading only numeric fields skips the task texts
         
-        agent_messages = self.chats_cursor.execute("""
-            SELECT id, message_datetime, content_length, content_type, summary, agent_summary
-            FROM messages
-            WHERE chat_id = ? 
-            AND message_type = 'Agent'
-            AND id > ?
-            AND id < COALESCE(
-                (SELECT MIN(id) FROM messages 
-                 WHERE chat_id = ? AND message_type = 'User' AND id > ?),
-                999999999
-            )
-            ORDER BY message_datetime, start_line
-        """, (chat_id, user_msg_id, chat_id, user_msg_id)).fetchall()
+        Yields:
+            Tasks
+        """
+        columns = TASK_COLUMNS if fields is None else tuple(column for column in TASK_COLUMNS if column in fields)
+        self.refresh_tasks()
+        rows = self._select_tasks(columns, "WHERE t.user_timestamp >= ?",
+                                  (since_timestamp if since_timestamp is not None else float('-inf'),))
+        names = ('user_msg_id',) + columns
+        for row in rows:
+            yield self._task_from_row(names, row)
+    
+    def _select_tasks(self, columns: Tuple[str, ...], where: str, params: tuple) -> sqlite3.Cursor:
+        # Ordered by the user message row so that re-numbered lines (start_line) never invalidate tasks
+        return self.chats_conn.execute(f"""
+            SELECT {', '.join(f't.{column}' for column in ('user_msg_id',) + columns)}
+            FROM tasks t
+            JOIN messages u ON u.id = t.user_msg_id
+            {where}
+            ORDER BY u.message_datetime, u.start_line, u.id
+        """, params)
+    
+    def _task_from_row(self, names: Tuple[str, ...], row: tuple) -> Task:
+        fields = dict(zip(names, row))
+        for column in JSON_TASK_COLUMNS:
+            if column in fields:
+                fields[column] = json.loads(fields[column])
+        return Task(**fields)
+    
+    def refresh_tasks(self) -> int:
+        """Build and store the tasks of user messages that have none stored.
         
-        user_content = self.chats_cursor.execute("""
-            SELECT content_text FROM content WHERE message_id = ?
-        """, (user_msg_id,)).fetchone()
+        Returns:
+            Number of tasks built
+        """
+        missing_ids = [row[0] for row in self.chats_conn.execute("""
+            SELECT m.id FROM messages m
+            LEFT JOIN tasks t ON t.user_msg_id = m.id
+            WHERE m.message_type = 'User' AND m.message_datetime IS NOT NULL AND t.user_msg_id IS NULL
+        """)]
+        if not missing_ids:
+            return 0
         
-        user_content_text = user_content[0] if user_content else ""
+        cursor = self.chats_conn.cursor()
+        fill_temp_id_table(cursor, 'missing_task_ids', missing_ids)
+        insert = f"""
+            INSERT OR REPLACE INTO tasks (user_msg_id, next_user_msg_id, {', '.join(TASK_COLUMNS)})
+            VALUES ({', '.join('?' * (len(TASK_COLUMNS) + 2))})
+        """
+        built = 0
+        batch = []
+        for task, next_user_msg_id in self._build_tasks():
+            batch.append((task['user_msg_id'], next_user_msg_id) +
+                         tuple(json.dumps(task[column]) if column in JSON_TASK_COLUMNS else task[column]
+                               for column in TASK_COLUMNS))
+            if len(batch) >= 1000:
+                cursor.executemany(insert, batch)
+                built += len(batch)
+                batch = []
+        cursor.executemany(insert, batch)
+        built += len(batch)
+        # User messages whose datetime does not parse have no task and are looked at again next time
+        self.chats_conn.commit()
+        return built
+    
+    def _build_tasks(self) -> Iterator[Tuple[Dict, Optional[int]]]:
+        """Build the tasks of the user messages in temp.missing_task_ids.
         
-        agent_summaries = []
-        agent_timestamps = []
-        last_agent_timestamp = user_timestamp
+        All tasks come from one query over the user messages joined with
+        their agent messages and content, ordered so that the rows arrive
+        grouped by task; only the current task is held in memory.
+        
+        Yields:
+            (task dict, id of the chat's next user message or None) tuples
+        """
+        # LEAD() gives each user message the next user message of its chat; the agent messages in
+        # between are found by rowid range. Content is only fetched where it is used: user
+        # messages, tool calls and text without a summary.
+        rows = self.chats_conn.execute(f"""
+            WITH users AS (
+                SELECT id, chat_id, message_datetime,
+                       LEAD(id) OVER (PARTITION BY chat_id ORDER BY id) AS next_user_id
+                FROM messages
+                WHERE message_type = 'User' AND (chat_id IS NULL OR chat_id IN (
+                    SELECT chat_id FROM messages WHERE id IN (SELECT id FROM temp.missing_task_ids)))
+            )
+            SELECT u.id, u.next_user_id, u.chat_id, m.message_type, m.message_datetime, m.content_length,
+                   m.content_type, m.summary, m.data_tool_type, m.data_tool_name,
+                   {self.content_reader.select_columns('c')}
+            FROM users u
+            JOIN messages m ON m.id >= u.id AND m.id < COALESCE(u.next_user_id, 9223372036854775807)
+                AND (m.id = u.id OR (m.chat_id = u.chat_id AND m.message_type = 'Agent'))
+            LEFT JOIN content c ON c.message_id = m.id AND (
+                m.message_type = 'User' OR m.content_type = 'tool_call' OR
+                (m.content_type = 'text' AND COALESCE(m.summary, '') = ''))
+            WHERE u.id IN (SELECT id FROM temp.missing_task_ids)
+            ORDER BY u.id, m.id > u.id, m.message_datetime, m.start_line
+        """)
         
-        for agent_msg_id, agent_dt_str, agent_content_len, content_type, summary, agent_summary in agent_messages:
-            agent_timestamp = self.parse_chat_datetime(agent_dt_str) if agent_dt_str else None
-            if agent_timestamp:
-                agent_timestamps.append(agent_timestamp)
-                last_agent_timestamp = max(last_agent_timestamp, agent_timestamp)
+        task = None
+        next_user_msg_id = None
+        skipped_user_msg_id = None
+        for (user_msg_id, next_user_id, chat_id, message_type, dt_str, content_len, content_type, summary, tool_type,
+             tool_name, *content_columns) in rows:
+            if user_msg_id == skipped_user_msg_id:
+                continue
+            
+            if message_type == 'User':
+                if task is not None:
+                    yield self._finish_task(task), next_user_msg_id
+                    task = None
+                user_timestamp = self.parse_chat_datetime(dt_str)
+                if not user_timestamp:
+                    skipped_user_msg_id = user_msg_id
+                    continue
+                next_user_msg_id = next_user_id
+                task = {
+                    'user_msg_id': user_msg_id,
+                    'chat_id': chat_id,
+                    'user_timestamp': user_timestamp,
+                    'user_datetime_str': dt_str,
+                    'user_content': self.content_reader.resolve(*content_columns) or "",
+                    'user_content_length': content_len or 0,
+                    'agent_summaries': [],
+                    'agent_count': 0,
+                    'agent_total_length': 0,
+                    'agent_text_length': 0,
+                    'agent_timestamps': [],
+                }
+                continue
+            
+            task['agent_count'] += 1
+            task['agent_total_length'] += (content_len or 0)
+            
+            # Handle timestamps for correlation
+            if dt_str:
+                agent_ts = self.parse_chat_datetime(dt_str)
+                if agent_ts:
+                    task['agent_timestamps'].append(agent_ts)
             
+            # Extract summaries for embedding
+            agent_summaries = task['agent_summaries']
             if content_type == 'tool_call':
-                if agent_summary:
-                    agent_summaries.append(agent_summary)
-                elif summary:
+                content_text = self.content_reader.resolve(*content_columns)
+                # Use truncated summary from database if available, otherwise extract from content
+                if summary:
                     agent_summaries.append(summary)
-                else:
-                    content_result = self.chats_cursor.execute("""
-                        SELECT content_text FROM content WHERE message_id = ?
-                    """, (agent_msg_id,)).fetchone()
-                    if content_result:
-                        content_text = content_result[0]
-                        summary_match = re.search(r'<summary>(.*?)</summary>', content_text, re.DOTALL)
-                        if summary_match:
-                            summary_text = summary_match.group(1).strip()
-                            agent_summaries.append(summary_text)
-                        elif agent_content_len:
-                            agent_summaries.append(f"Tool call ({agent_content_len} chars)")
-                    elif agent_content_len:
-                        agent_summaries.append(f"Tool call ({agent_content_len} chars)")
+                elif content_text is not None:
+                    summary_match = re.search(r'<summary>(.*?)</summary>', content_text, re.DOTALL)
+                    if summary_match:
+                        agent_summaries.append(summary_match.group(1).strip())
+                    elif content_len:
+                        agent_summaries.append(f"Tool call ({content_len} chars)")
+                elif content_len:
+                    agent_summaries.append(f"Tool call ({content_len} chars)")
+                
+                # Calculate text length for correlation
+                task['agent_text_length'] += self._get_tool_output_length(content_text, tool_type, tool_name)
             elif content_type == 'text':
-                if agent_summary:
-                    agent_summaries.append(agent_summary)
-                elif summary:
+                # Use summary (first line) from database, or fallback to content
+                if summary:
                     agent_summaries.append(summary)
                 else:
-                    content_result = self.chats_cursor.execute("""
-                        SELECT content_text FROM content WHERE message_id = ?
-                    """, (agent_msg_id,)).fetchone()
-                    if content_result and content_result[0]:
-                        first_line = content_result[0].split('\n')[0]
-                        agent_summaries.append(first_line)
-                    elif agent_content_len:
-                        agent_summaries.append(f"Agent message ({agent_content_len} chars)")
-            elif agent_summary:
-                agent_summaries.append(agent_summary)
+                    content_text = self.content_reader.resolve(*content_columns)
+                    if content_text:
+                        agent_summaries.append(content_text.split('\n')[0])
+                    elif content_len:
+                        agent_summaries.append(f"Agent message ({content_len} chars)")
+                
+                task['agent_text_length'] += (content_len or 0)
             elif summary:
                 agent_summaries.append(summary)
-            elif agent_content_len:
-                agent_summaries.append(f"Agent message ({agent_content_len} chars)")
+            elif content_len:
+                agent_summaries.append(f"Agent message ({content_len} chars)")
         
-        filtered_summaries = self._filter_summaries(agent_summaries)
+        if task is not None:
+            yield self._finish_task(task), next_user_msg_id
+    
+    def _finish_task(self, task: Dict) -> Dict:
+        """Complete a task assembled by _build_tasks() with its end time, filtered summaries and text."""
+        user_timestamp = task['user_timestamp']
+        agent_timestamps = task['agent_timestamps']
+        last_agent_timestamp = max([user_timestamp] + agent_timestamps) if agent_timestamps else user_timestamp + 300
         
-        task_end_timestamp = last_agent_timestamp + 60
-        formatted_text = self.format_task_text(user_content_text, filtered_summaries)
+        # Filter out error messages and adjacent duplicates
+        filtered_summaries = self._filter_summaries(task['agent_summaries'])
+        formatted_text = self.format_task_text(task['user_content'], filtered_summaries)
+        user_content_length = task['user_content_length']
         
         return {
-            'user_msg_id': user_msg_id,
-            'chat_id': chat_id,
-            'user_content': user_content_text,
+            'user_msg_id': task['user_msg_id'],
+            'chat_id': task['chat_id'],
+            'user_timestamp': user_timestamp,
+            'user_datetime_str': task['user_datetime_str'],
+            'user_content': task['user_content'],
             'agent_summaries': filtered_summaries,
-            'message_count': 1 + len(agent_messages),
+            'message_count': 1 + task['agent_count'],
             'formatted_text': formatted_text,
             'formatted_length': len(formatted_text),
-            'user_timestamp': user_timestamp,
-            'task_end_timestamp': task_end_timestamp
+            # Fields for correlation
+            'task_end_timestamp': last_agent_timestamp + 60,
+            'total_content_length': user_content_length + task['agent_total_length'],
+            'user_content_length': user_content_length,
+            'agent_count': task['agent_count'],
+            'agent_total_length': task['agent_total_length'],
+            'agent_text_length': task['agent_text_length'],
+            'agent_timestamps': agent_timestamps
         }
     
-    def get_message_tasks(self) -> List[Dict]:
-        tasks = []
-        
-        user_messages = self.chats_cursor.execute("""
-            SELECT id, chat_id, message_datetime, content_length
-            FROM messages
-            WHERE message_type = 'User' AND message_datetime IS NOT NULL
-            ORDER BY message_datetime, start_line
-        """).fetchall()
-        
-        for user_msg_id, chat_id, user_dt_str, user_content_len in user_messages:
-            user_timestamp = self.parse_chat_datetime(user_dt_str)
-            if not user_timestamp:
-                continue
-            
-            agent_messages = self.chats_cursor.execute("""
-                SELECT id, message_datetime, content_length, content_type, summary
-                FROM messages
-                WHERE chat_id = ? 
-                AND message_type = 'Agent'
-                AND id > ?
-                AND id < COALESCE(
-                    (SELECT MIN(id) FROM messages 
-                     WHERE chat_id = ? AND message_type = 'User' AND id > ?),
-                    999999999
-                )
-                ORDER BY message_datetime, start_line
-            """, (chat_id, user_msg_id, chat_id, user_msg_id)).fetchall()
-            
-            user_content = self.chats_cursor.execute("""
-                SELECT content_text FROM content WHERE message_id = ?
-            """, (user_msg_id,)).fetchone()
-            
-            user_content_text = user_content[0] if user_content else ""
-            
-            # Calculate usage correlation fields
-            total_content_length = (user_content_len or 0)
-            agent_text_length = 0
-            agent_timestamps = []
-            last_agent_timestamp = user_timestamp
-            
-            # Extract agent summaries for embedding
-            agent_summaries = []
-            
-            for agent_msg_id, agent_dt_str, agent_content_len, agent_content_type, agent_summary in agent_messages:
-                total_content_length += (agent_content_len or 0)
-                
-                # Handle timestamps for correlation
-                if agent_dt_str:
-                    agent_ts = self.parse_chat_datetime(agent_dt_str)
-                    if agent_ts:
-                        agent_timestamps.append(agent_ts)
-                        if agent_ts > last_agent_timestamp:
-                            last_agent_timestamp = agent_ts
-                
-                # Extract summaries for embedding
-                if agent_content_type == 'tool_call':
-                    # Use truncated summary from database if available, otherwise extract from content
-                    if agent_summary:
-                        agent_summaries.append(agent_summary)
-                    else:
-                        content_result = self.chats_cursor.execute("""
-                            SELECT content_text FROM content WHERE message_id = ?
-                        """, (agent_msg_id,)).fetchone()
-                        if content_result:
-                            content_text = content_result[0]
-                            summary_match = re.search(r'<summary>(.*?)</summary>', content_text, re.DOTALL)
-                            if summary_match:
-                                summary_text = summary_match.group(1).strip()
-                                agent_summaries.append(summary_text)
-                            elif agent_content_len:
-                                agent_summaries.append(f"Tool call ({agent_content_len} chars)")
-                        elif agent_content_len:
-                            agent_summaries.append(f"Tool call ({agent_content_len} chars)")
-                    
-                    # Calculate text length for correlation
-                    tool_info = self.chats_cursor.execute("""
-                        SELECT data_tool_type, data_tool_name, 
-                               (SELECT content_text FROM content WHERE message_id = ?) as content_text
-                        FROM messages WHERE id = ?
-                    """, (agent_msg_id, agent_msg_id)).fetchone()
-                    
-                    if tool_info:
-                        tool_type, tool_name, content_text = tool_info
-                        output_len = self._get_tool_output_length(content_text, tool_type, tool_name)
-                        agent_text_length += output_len
-                elif agent_content_type == 'text':
-                    # Use summary (first line) from database, or fallback to content
-                    if agent_summary:
-                        agent_summaries.append(agent_summary)
-                    else:
-                        content_result = self.chats_cursor.execute("""
-                            SELECT content_text FROM content WHERE message_id = ?
-                        """, (agent_msg_id,)).fetchone()
-                        if content_result and content_result[0]:
-                            first_line = content_result[0].split('\n')[0]
-                            agent_summaries.append(first_line)
-                        elif agent_content_len:
-                            agent_summaries.append(f"Agent message ({agent_content_len} chars)")
-                    
-                    agent_text_length += (agent_content_len or 0)
-                elif agent_summary:
-                    agent_summaries.append(agent_summary)
-                elif agent_content_len:
-                    agent_summaries.append(f"Agent message ({agent_content_len} chars)")
-            
-            if not agent_timestamps:
-                last_agent_timestamp = user_timestamp + 300
-            
-            # Filter out error messages and adjacent duplicates
-            filtered_summaries = self._filter_summaries(agent_summaries)
-            
-            task_end_timestamp = last_agent_timestamp + 60
-            formatted_text = self.format_task_text(user_content_text, filtered_summaries)
-            
-            tasks.append({
-                'user_msg_id': user_msg_id,
-                'chat_id': chat_id,
-                'user_timestamp': user_timestamp,
-                'user_datetime_str': user_dt_str,
-                'user_content': user_content_text,
-                'agent_summaries': filtered_summaries,
-                'message_count': 1 + len(agent_messages),
-                'formatted_text': formatted_text,
-                'formatted_length': len(formatted_text),
-                # Fields for correlation
-                'task_end_timestamp': task_end_timestamp,
-                'total_content_length': total_content_length,
-                'user_content_length': user_content_len or 0,
-                'agent_count': len(agent_messages),
-                'agent_total_length': total_content_length - (user_content_len or 0),
-                'agent_text_length': agent_text_length,
-                'agent_timestamps': agent_timestamps
-            })
-        
-        return tasks
-    
     def _is_error_message(self, summary: str) -> bool:
         """Check if summary is an error message."""
-        error_patterns = [
-            "The string to replace was not found in the file.",
-            "Invalid: old_string and new_string are exactly the same.",
-            "Cancelled",
-        ]
-        return any(err in summary for err in error_patterns)
+        return parse_summary(summary).is_error
     
     def _normalize_summary(self, summary: str) -> str:
         """Normalize summary for duplicate detection.
         For file operations, extract file path to detect same file operations.
         """
-        # For file operations, normalize by file path
-        if 'Read file:' in summary:
-            try:
-                file_path = summary.split('Read file:')[1].split(' •')[0].strip()
-                tool_type = summary.split('**')[1] if '**' in summary else 'read_file'
-                return f"{tool_type}:{file_path}"
-            except:
-                return summary
-        elif 'Edit file:' in summary:
-            try:
-                file_path = summary.split('Edit file:')[1].split(' •')[0].strip()
-                tool_type = summary.split('**')[1] if '**' in summary else 'code_edit'
-                return f"{tool_type}:{file_path}"
-            except:
-                return summary
-        # For other summaries, use as-is
-        return summary
+        return parse_summary(summary).key
     
     def _filter_summaries(self, summaries: List[str]) -> List[str]:
-        """Hybrid deduplication: window-based + file operation consolidation + special handling."""
-        # Step 1: Remove error messages
-        filtered = []
-        for summary in summaries:
-            if not self._is_error_message(summary):
-                filtered.append(summary)
-        
-        if not filtered:
-            return []
+        """Hybrid deduplication: window-based + file operation consolidation + special handling.
         
-        # Step 2: Window-based deduplication
+        One pass over the summaries runs every step on each summary in turn,
+        using parse_summary() so each distinct summary is parsed once:
+        error messages are dropped, repeats of a normalized summary within
+        5 summaries are dropped (commands only when identical), rapid
+        repeats of the same operation on a file are consolidated, and only
+        the first todo_write is kept, with its count if there are more than 3.
+        """
         window_size = 5
         deduplicated = []
-        seen_in_window = {}  # normalized_summary -> last position
+        seen_in_window = {}  # normalized_summary -> last position in deduplicated
+        file_ops_tracker = {}  # file_path -> (last position in deduplicated, op_type)
+        final = []
+        todo_write_index = None
+        todo_write_count = 0
         
-        for i, summary in enumerate(filtered):
-            normalized = self._normalize_summary(summary)
-            last_seen = seen_in_window.get(normalized, -window_size - 1)
+        position = -1  # position among the summaries that are not error messages
+        for summary in summaries:
+            parsed = parse_summary(summary)
+            if parsed.is_error:
+                continue
+            position += 1
             
-            # Skip if duplicate in window (unless it's a command tool)
-            if i - last_seen <= window_size:
-                # Special handling: commands might be different even with similar summaries
-                if '**command**' in summary:
-                    # Keep commands but still mark as seen to prevent exact duplicates
-                    if summary == (deduplicated[last_seen] if last_seen >= 0 and last_seen < len(deduplicated) else None):
-                        continue
-                else:
+            # Window-based deduplication
+            last_seen = seen_in_window.get(parsed.key, -window_size - 1)
+            if position - last_seen <= window_size:
+                # Commands might be different even with similar summaries, only exact duplicates are dropped
+                if not parsed.is_command or summary == deduplicated[last_seen]:
                     continue
-            
-            seen_in_window[normalized] = len(deduplicated)
+            deduplicated_index = len(deduplicated)
+            seen_in_window[parsed.key] = deduplicated_index
             deduplicated.append(summary)
-        
-        # Step 3: File operation consolidation (consolidate rapid re-reads/edits)
-        if not deduplicated:
-            return []
-        
-        consolidated = []
-        file_ops_tracker = {}  # file_path -> (last_index, last_type, count)
-        window_size_file = 5
-        
-        for i, summary in enumerate(deduplicated):
-            normalized = self._normalize_summary(summary)
-            
-            # Check if it's a file operation
-            is_file_op = 'Read file:' in summary or 'Edit file:' in summary
-            
-            if is_file_op:
-                # Extract file path
-                try:
-                    if 'Read file:' in summary:
-                        file_path = summary.split('Read file:')[1].split(' •')[0].strip()
-                        op_type = 'read'
-                    else:
-                        file_path = summary.split('Edit file:')[1].split(' •')[0].strip()
-                        op_type = 'edit'
-                    
-                    # Check if same file was accessed recently
-                    if file_path in file_ops_tracker:
-                        last_idx, last_type, count = file_ops_tracker[file_path]
-                        gap = i - last_idx
-                        
-                        # If same file, same operation type, within window, consolidate
-                        if gap <= window_size_file and op_type == last_type:
-                            # Update count but skip adding duplicate
-                            file_ops_tracker[file_path] = (i, op_type, count + 1)
-                            # Optionally add a note about consolidation
-                            # For now, just skip the duplicate
-                            continue
-                        else:
-                            # Different operation or outside window, reset
-                            file_ops_tracker[file_path] = (i, op_type, 1)
-                    else:
-                        # First time seeing this file
-                        file_ops_tracker[file_path] = (i, op_type, 1)
-                except:
-                    # If extraction fails, keep the summary as-is
-                    pass
             
-            consolidated.append(summary)
-        
-        # Step 4: Special handling for todo_write (keep first, note frequency if >3)
-        final = []
-        todo_write_seen = False
-        todo_write_count = 0
-        
-        for summary in consolidated:
-            if '**todo_write**' in summary or 'Todo List' in summary:
-                if not todo_write_seen:
-                    todo_write_seen = True
-                    todo_write_count = sum(1 for s in consolidated if '**todo_write**' in s or 'Todo List' in s)
-                    if todo_write_count > 3:
-                        # Add count to first occurrence
-                        summary_with_count = summary.rstrip('.') + f" (×{todo_write_count})"
-                        final.append(summary_with_count)
-                    else:
-                        final.append(summary)
-                    # Skip subsequent todo_write occurrences
-                    continue
-                else:
-                    # Already added first todo_write, skip
+            # File operation consolidation (skip rapid re-reads/edits of the same file)
+            if parsed.op_type is not None:
+                last_op = file_ops_tracker.get(parsed.file_path)
+                file_ops_tracker[parsed.file_path] = (deduplicated_index, parsed.op_type)
+                if last_op is not None and deduplicated_index - last_op[0] <= window_size and last_op[1] == parsed.op_type:
                     continue
             
+            # Keep the first todo_write only, noting the frequency if >3
+            if parsed.is_todo:
+                todo_write_count += 1
+                if todo_write_index is not None:
+                    continue
+                todo_write_index = len(final)
             final.append(summary)
         
+        if todo_write_count > 3:
+            final[todo_write_index] = final[todo_write_index].rstrip('.') + f" (×{todo_write_count})"
         return final
     
     def aggressive_deduplicate_summaries(self, summaries: List[str]) -> List[str]:
@@ -487,11 +568,48 @@ class TaskBuilder:
 
 def test_task_lengths(db_path: str):
     builder = TaskBuilder(db_path)
-    tasks = builder.get_message_tasks()
     
-    print(f"Total tasks: {len(tasks)}\n")
+    # One pass over the tasks, keeping only the lengths and the few tasks that are printed
+    lengths = []
+    over_15k_count = 0
+    longest_over_15k = []  # heap of (length, user_msg_id, task), at most 5
+    over_300_count = 0
+    longest_summaries = []  # heap of (length, user_msg_id, summary index, preview), at most 5
+    examples = {'medium': None, 'short': None}
+    # Examples are the tasks closest to the middle of each length range
+    example_ranges = {'medium': (1000, 5000), 'short': (0, 499)}
+    
+    for task in builder.iter_message_tasks():
+        length = task['formatted_length']
+        lengths.append(length)
+        
+        if length > 15000:
+            over_15k_count += 1
+            entry = (length, task['user_msg_id'], task)
+            if len(longest_over_15k) < 5:
+                heapq.heappush(longest_over_15k, entry)
+            else:
+                heapq.heappushpop(longest_over_15k, entry)
+        
+        for name, (low, high) in example_ranges.items():
+            middle = (low + high) / 2
+            if low <= length <= high and (examples[name] is None or
+                                          abs(length - middle) < abs(examples[name]['formatted_length'] - middle)):
+                examples[name] = task
+        
+        for idx, summary in enumerate(task['agent_summaries']):
+            if len(summary) > 300:
+                over_300_count += 1
+                entry = (len(summary), task['user_msg_id'], idx, summary[:200])
+                if len(longest_summaries) < 5:
+                    heapq.heappush(longest_summaries, entry)
+                else:
+                    heapq.heappushpop(longest_summaries, entry)
     
-    lengths = [s['formatted_length'] for s in tasks]
+    print(f"Total tasks: {len(lengths)}\n")
+    if not lengths:
+        builder.close()
+        return True
     
     print(f"Task length statistics:")
     print(f"  Min: {min(lengths):,} chars")
@@ -499,12 +617,11 @@ def test_task_lengths(db_path: str):
     print(f"  Avg: {sum(lengths)/len(lengths):,.0f} chars")
     print(f"  Median: {sorted(lengths)[len(lengths)//2]:,} chars")
     
-    over_15k = [s for s in tasks if s['formatted_length'] > 15000]
-    print(f"\nTasks over 15k chars: {len(over_15k)}")
+    print(f"\nTasks over 15k chars: {over_15k_count}")
     
-    if over_15k:
+    if longest_over_15k:
         print("\nTasks exceeding 15k char limit:")
-        for task in sorted(over_15k, key=lambda x: x['formatted_length'], reverse=True)[:5]:
+        for _, _, task in sorted(longest_over_15k, key=lambda x: x[0], reverse=True):
             print(f"\n{'='*80}")
             print(f"Seq {task['user_msg_id']}: {task['formatted_length']:,} chars, {task['message_count']} messages")
             print(f"  User content: {len(task['user_content']):,} chars")
@@ -528,9 +645,8 @@ def test_task_lengths(db_path: str):
     print("\n" + "="*80)
     print("Example of a medium-length task:")
     print("="*80)
-    medium_tasks = [s for s in tasks if 1000 <= s['formatted_length'] <= 5000]
-    if medium_tasks:
-        task = medium_tasks[len(medium_tasks)//2]
+    task = examples['medium']
+    if task:
         print(f"Seq {task['user_msg_id']}: {task['formatted_length']:,} chars, {task['message_count']} messages\n")
         lines = task['formatted_text'].split('\n')
         for i, line in enumerate(lines[:50], 1):
@@ -541,30 +657,21 @@ def test_task_lengths(db_path: str):
     print("\n" + "="*80)
     print("Example of a short task:")
     print("="*80)
-    short_tasks = [s for s in tasks if s['formatted_length'] < 500]
-    if short_tasks:
-        task = short_tasks[len(short_tasks)//2]
+    task = examples['short']
+    if task:
         print(f"Seq {task['user_msg_id']}: {task['formatted_length']:,} chars, {task['message_count']} messages\n")
         print(task['formatted_text'])
     
-    over_300_summaries = []
-    for task in tasks:
-        for idx, summary in enumerate(task['agent_summaries']):
-            if len(summary) > 300:
-                over_300_summaries.append((task['user_msg_id'], idx, len(summary)))
-    
-    if over_300_summaries:
+    if longest_summaries:
         print(f"\n{'='*80}")
-        print(f"Agent summaries over 300 chars: {len(over_300_summaries)}")
+        print(f"Agent summaries over 300 chars: {over_300_count}")
         print(f"Top 5 longest summaries:")
-        for user_msg_id, summary_idx, length in sorted(over_300_summaries, key=lambda x: x[2], reverse=True)[:5]:
-            task = next(s for s in tasks if s['user_msg_id'] == user_msg_id)
-            summary = task['agent_summaries'][summary_idx]
+        for length, user_msg_id, summary_idx, preview in sorted(longest_summaries, key=lambda x: x[0], reverse=True):
             print(f"\n  Seq {user_msg_id}, summary #{summary_idx}: {length} chars")
-            print(f"  Preview (first 200 chars): {summary[:200]}...")
+            print(f"  Preview (first 200 chars): {preview}...")
     
     builder.close()
-    return len(over_15k) == 0
+    return over_15k_count == 0
 
 
 if __name__ == '__main__':
@@ -2,8 +2,15 @@
 import subprocess
 import tempfile
 import os
+import re
+import sys
+import csv
 import sqlite3
+import shutil
+from datetime import datetime, timedelta
 from pathlib import Path
+from correlate_chats_usage import match_usage_to_tasks, ChatUsageCorrelator, period_indices, period_label
+from generate_synthetic_export import generate_export
 
 def test_example_correlation():
     with tempfile.TemporaryDirectory() as tmpdir:
@@ -220,6 +227,207 @@ def test_example_correlation():
         
         return True
 
+def test_match_usage_to_tasks():
+    t0 = 1760000000.0
+    # Twelve tasks at the same time share one request; a lone task an hour later
+    tasks = [{'user_msg_id': i, 'user_timestamp': t0, 'task_end_timestamp': t0 + 60} for i in range(1, 13)]
+    tasks.append({'user_msg_id': 20, 'user_timestamp': t0 + 20000, 'task_end_timestamp': t0 + 20100})
+    usage = [
+        (100, t0 - 4 * 3600, 1, 0, 0, 0, 1, 'k', 'm'),
+        (101, t0 + 10, 1, 0, 0, 0, 1, 'k', 'm'),
+        (102, t0 + 5000, 1, 0, 0, 0, 1, 'k', 'm'),
+        (103, t0 + 20100, 1, 0, 0, 0, 1, 'k', 'm'),
+        (104, t0 + 23000, 1, 0, 0, 0, 1, 'k', 'm'),
+    ]
+    
+    task_matches, claimed_by = match_usage_to_tasks(tasks, usage, 600, 7200)
+    
+    # The strict pass lets 10 tasks share a close request, the relaxed pass matches the other two
+    assert claimed_by[101] == set(range(1, 13)), f"Unexpected claims of request 101: {claimed_by[101]}"
+    assert [m[0] for m in task_matches[1]] == [101], f"Task 1 matched {task_matches[1]}"
+    assert [m[0] for m in task_matches[11]] == [101, 102], f"Task 11 matched {task_matches[11]}"
+    assert claimed_by[102] == {11, 12}, f"Unexpected claims of request 102: {claimed_by[102]}"
+    # Request 104 is too far for the strict pass and task 20 is already matched, so it is backfilled
+    assert [m[0] for m in task_matches[20]] == [103, 104], f"Task 20 matched {task_matches[20]}"
+    assert claimed_by[104] == {20}, f"Unexpected claims of request 104: {claimed_by[104]}"
+    assert 100 not in claimed_by, "A request outside every window should stay unmatched"
+    
+    print("✓ Test passed!")
+    return True
+
+def test_calculate_correlations():
+    # Output tokens grow with the squared content length, so the rank correlation is perfect but Pearson is not
+    lengths = [100, 200, 200, 400, 800, 1600, 3200, 6400]
+    correlated = [{'total_content_length': n, 'user_content_length': 50, 'agent_total_length': n - 50,
+                   'agent_text_length': n // 2, 'matched_total_tokens': 3 * n + 1000, 'matched_input_w_cache': n,
+                   'matched_input_wo_cache': 0, 'matched_cache_read': 1000, 'matched_output': n * n}
+                  for n in lengths]
+    
+    correlations = ChatUsageCorrelator.calculate_correlations(None, correlated)
+    
+    x = lengths
+    y = [n * n for n in lengths]
+    mean_x, mean_y = sum(x) / len(x), sum(y) / len(y)
+    expected = (sum((a - mean_x) * (b - mean_y) for a, b in zip(x, y)) /
+                (sum((a - mean_x) ** 2 for a in x) * sum((b - mean_y) ** 2 for b in y)) ** 0.5)
+    assert abs(correlations['content_vs_output_tokens'] - expected) < 1e-12, \
+        f"Pearson {correlations['content_vs_output_tokens']} != {expected}"
+    assert abs(correlations['content_vs_output_tokens_spearman'] - 1.0) < 1e-12, "Ranks of tied lengths should be averaged"
+    assert abs(correlations['content_vs_total_tokens'] - 1.0) < 1e-12, "Linear metrics should correlate perfectly"
+    low, high = correlations['content_vs_output_tokens_ci']
+    assert low <= high <= 1.0, f"Invalid interval {low, high}"
+    assert correlations['content_vs_output_tokens_ci'] == \
+        ChatUsageCorrelator.calculate_correlations(None, correlated)['content_vs_output_tokens_ci'], \
+        "Bootstrap intervals should be reproducible"
+    # The user content length is constant, so its correlations are undefined
+    assert all(v != v for v in correlations['pearson'][1]), "A constant metric should have NaN correlations"
+    assert correlations['total_matched_output'] == sum(y), "Totals should be exact integers"
+    
+    print("✓ Test passed!")
+    return True
+
+def test_period_labels():
+    days = ['2020-12-31', '2021-01-03', '2021-01-04', '2024-02-29', '2024-12-30']
+    timestamps = [datetime.fromisoformat(f"{day}T23:59:59+00:00").timestamp() for day in days]
+    
+    labels = {period: [period_label(index, period) for index in period_indices(timestamps, period).tolist()]
+              for period in ('day', 'week', 'month')}
+    
+    assert labels['day'] == days, f"Unexpected day labels {labels['day']}"
+    expected_weeks = ["%d-W%02d" % datetime.fromisoformat(day).isocalendar()[:2] for day in days]
+    assert labels['week'] == expected_weeks, f"Week labels {labels['week']} != ISO weeks {expected_weeks}"
+    assert labels['month'] == [day[:7] for day in days], f"Unexpected month labels {labels['month']}"
+    
+    print("✓ Test passed!")
+    return True
+
+def _write_usage_csv(path, timestamps):
+    with open(path, 'w', encoding='utf-8', newline='') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(['Date', 'Kind', 'Model', 'Max Mode', 'Input (w/ Cache Write)', 'Input (w/o Cache Write)',
+                         'Cache Read', 'Output Tokens', 'Total Tokens', 'Cost'])
+        for i, ts in enumerate(timestamps):
+            writer.writerow([f"{ts:%Y-%m-%dT%H:%M:%S}.000Z", 'Included', 'auto', 'No', 1000 + i, 0, 500, 100 + i,
+                             1600 + 2 * i, '0.01'])
+
+def _run_script(*args):
+    result = subprocess.run([sys.executable, *args], capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"ERROR: {args[0]} failed with return code {result.returncode}")
+        print(f"STDOUT: {result.stdout}")
+        print(f"STDERR: {result.stderr}")
+    return result
+
+def _write_synthetic_inputs(tmpdir):
+    """Write first.md (20 chats), full.md (30 chats, starting with first.md) and usage CSVs for them.
+    
+    early.csv has the requests of the first 20 chats and late.csv the rest.
+    """
+    paths = {}
+    for name, chats in (('first', 20), ('full', 30)):
+        paths[name] = os.path.join(tmpdir, f"{name}.md")
+        with open(paths[name], 'w', encoding='utf-8') as f:
+            generate_export(f, chats=chats, seed=7)
+    with open(paths['full'], 'r', encoding='utf-8') as f:
+        user_times = [datetime.strptime(m, '%Y-%m-%d %H:%M')
+                      for m in re.findall(r'_\*\*User \((\d{4}-\d\d-\d\d \d\d:\d\d)Z\)', f.read())]
+    # Requests at irregular offsets after every user message, split where the first export ends
+    requests = [t + timedelta(seconds=s) for i, t in enumerate(user_times) for s in range(5 + i % 7, 400, 97)]
+    split = user_times[60]
+    for name, part in (('early', [t for t in requests if t < split]), ('late', [t for t in requests if t >= split])):
+        paths[name] = os.path.join(tmpdir, f"{name}.csv")
+        _write_usage_csv(paths[name], part)
+    return paths
+
+def _report(result):
+    return result.stdout[result.stdout.index('Found '):]
+
+def test_incremental_matches():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = _write_synthetic_inputs(tmpdir)
+        
+        db = os.path.join(tmpdir, 'chats.db')
+        steps = [('parse_chats.py', paths['first'], '--db-file', db),
+                 ('parse_usage.py', paths['early'], '--db-file', db),
+                 ('correlate_chats_usage.py', '--db-file', db),
+                 ('parse_chats.py', paths['full'], '--db-file', db),
+                 ('parse_usage.py', paths['late'], '--db-file', db)]
+        for step in steps:
+            if _run_script(*step).returncode != 0:
+                return False
+        
+        incremental = _run_script('correlate_chats_usage.py', '--db-file', db)
+        rerun = _run_script('correlate_chats_usage.py', '--db-file', db)
+        forced = _run_script('correlate_chats_usage.py', '--db-file', db, '--force')
+        if any(result.returncode != 0 for result in (incremental, rerun, forced)):
+            return False
+        
+        assert re.search(r'reused [1-9]\d* stored tasks', incremental.stdout), \
+            f"Stored matches should be reused: {incremental.stdout[:500]}"
+        assert 'No new tasks or usage requests' in rerun.stdout, "A rerun without new data should not match again"
+        assert 'Matching all tasks' in forced.stdout, "--force should match all tasks"
+        assert _report(incremental) == _report(forced), "Incremental matching should give the same report as a full match"
+        assert _report(rerun) == _report(forced), "A rerun should give the same report as a full match"
+    
+    print("✓ Test passed!")
+    return True
+
+def test_merged_usage_databases():
+    with tempfile.TemporaryDirectory() as tmpdir:
+        paths = _write_synthetic_inputs(tmpdir)
+        chats_db = os.path.join(tmpdir, 'chats.db')
+        single_db = os.path.join(tmpdir, 'single.db')
+        usage_dir = os.path.join(tmpdir, 'usage')
+        os.mkdir(usage_dir)
+        steps = [('parse_chats.py', paths['full'], '--db-file', chats_db),
+                 ('parse_usage.py', paths['early'], paths['late'], '--db-file', single_db),
+                 ('parse_usage.py', paths['early'], '--db-file', os.path.join(usage_dir, 'early.db')),
+                 ('parse_usage.py', paths['late'], '--db-file', os.path.join(usage_dir, 'late.db'))]
+        for step in steps:
+            if _run_script(*step).returncode != 0:
+                return False
+        
+        expected = _run_script('correlate_chats_usage.py', '--db-file', chats_db, '--usage-db-file', single_db, '--force')
+        pattern = os.path.join(usage_dir, '*.db')
+        merged = _run_script('correlate_chats_usage.py', '--db-file', chats_db, '--usage-db-file', pattern, '--force')
+        rerun = _run_script('correlate_chats_usage.py', '--db-file', chats_db, '--usage-db-file', pattern, '--force')
+        if any(result.returncode != 0 for result in (expected, merged, rerun)):
+            return False
+        
+        assert 'Imported 2 usage databases' in merged.stdout, f"Both databases should be imported: {merged.stdout[:500]}"
+        assert 'Imported' not in rerun.stdout, "Unchanged usage databases should not be imported again"
+        assert _report(merged) == _report(expected), "Merged databases should give the same report as one database"
+        assert _report(rerun) == _report(expected), "The merged store should give the same report on the next run"
+        
+        # Another pattern drops late.db; a source that changes drops the rows it no longer has
+        early_db = os.path.join(usage_dir, 'early.db')
+        early_only_db = os.path.join(tmpdir, 'early-only.db')
+        copy_db = os.path.join(usage_dir, 'early-copy.db')
+        shutil.copy(early_db, early_only_db)
+        shutil.copy(early_db, copy_db)
+        early_pattern = os.path.join(usage_dir, 'early*.db')
+        expected_early = _run_script('correlate_chats_usage.py', '--db-file', chats_db, '--usage-db-file', early_only_db,
+                                     '--force')
+        dropped = _run_script('correlate_chats_usage.py', '--db-file', chats_db, '--usage-db-file', early_pattern, '--force')
+        shutil.copy(single_db, copy_db)
+        grown = _run_script('correlate_chats_usage.py', '--db-file', chats_db, '--usage-db-file', early_pattern, '--force')
+        shutil.copy(early_only_db, copy_db)
+        shrunk = _run_script('correlate_chats_usage.py', '--db-file', chats_db, '--usage-db-file', early_pattern, '--force')
+        if any(result.returncode != 0 for result in (expected_early, dropped, grown, shrunk)):
+            return False
+        
+        assert _report(expected_early) != _report(expected), "The early usage should differ from all usage"
+        assert _report(dropped) == _report(expected_early), "Rows of databases no longer matched should be removed"
+        assert _report(grown) == _report(expected), "Rows added to a changed database should be imported"
+        assert _report(shrunk) == _report(expected_early), "Rows removed from a changed database should be removed"
+    
+    print("✓ Test passed!")
+    return True
+
 if __name__ == '__main__':
     test_example_correlation()
-
+    test_match_usage_to_tasks()
+    test_calculate_correlations()
+    test_period_labels()
+    test_incremental_matches()
+    test_merged_usage_databases()
@@ -1,8 +1,12 @@
 #!/usr/bin/env python3
+import re
 import sqlite3
 import subprocess
 import sys
 import os
+from content_utils import ContentReader
+from task_builder import TaskBuilder
+from generate_synthetic_export import generate_export
 
 
 def test_parse_chats():
@@ -178,7 +182,419 @@ def test_parse_chats():
     return True
 
 
+def _dump_tables(db_file):
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    chats = cursor.execute("SELECT id, title, chat_datetime, start_line, end_line FROM chats ORDER BY id").fetchall()
+    messages = cursor.execute("""
+        SELECT id, chat_id, message_type, message_datetime, summary, data_tool_type, data_tool_name,
+               content_type, content_length, start_line, end_line
+        FROM messages ORDER BY id
+    """).fetchall()
+    content = cursor.execute("SELECT message_id, content_text FROM content ORDER BY message_id").fetchall()
+    conn.close()
+    return chats, messages, content
+
+
+def _write_export(md_file, **kwargs):
+    """Write a synthetic export to md_file, returning the counts generate_export() reports."""
+    with open(md_file, 'w', encoding='utf-8') as f:
+        return generate_export(f, **kwargs)
+
+
+def _compare_parse_option(option_args, option_db_file, option_name):
+    """Parse a synthetic export with and without some options and compare the tables."""
+    md_file = 'EXAMPLE-options.md'
+    db_file = 'EXAMPLE-options.db'
+    
+    try:
+        _write_export(md_file, chats=30, user_messages=2, tool_uses=3, seed=11)
+        outputs = {}
+        for db, extra_args in ((db_file, []), (option_db_file, option_args)):
+            if os.path.exists(db):
+                os.remove(db)
+            outputs[db] = _run_parser(md_file, db, *extra_args)
+        
+        expected = _dump_tables(db_file)
+        actual = _dump_tables(option_db_file)
+        for name, exp_rows, act_rows in zip(('chats', 'messages', 'content'), expected, actual):
+            print(f"{name}: {len(exp_rows)} rows by default, {len(act_rows)} rows {option_name}")
+            assert exp_rows, f"The synthetic export should give {name} rows"
+            assert exp_rows == act_rows, f"Parsing {option_name} produced different {name} rows"
+        invalid_blocks = {db: [line for line in stdout.split('\n') if 'Invalid block' in line]
+                          for db, stdout in outputs.items()}
+        assert invalid_blocks[db_file] == invalid_blocks[option_db_file], \
+            f"Parsing {option_name} reported different invalid blocks"
+    finally:
+        for path in (md_file, db_file, option_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("All tests passed!")
+    return True
+
+
+def test_parse_chats_streaming():
+    if not _compare_parse_option(['--stream'], 'EXAMPLE-stream.db', 'streaming'):
+        return False
+    
+    # The look-ahead buffer should hold about one message, however long the file is
+    md_file = 'EXAMPLE-stream.md'
+    db_file = 'EXAMPLE-stream.db'
+    try:
+        for chats in (20, 200):
+            _write_export(md_file, chats=chats, user_messages=3, tool_uses=8, seed=3)
+            if os.path.exists(db_file):
+                os.remove(db_file)
+            stdout = _run_parser(md_file, db_file, '--stream')
+            peak = int(re.search(r'Look-ahead buffer peak: (\d+) lines', stdout).group(1))
+            conn = sqlite3.connect(db_file)
+            longest_message, file_lines = conn.execute(
+                "SELECT MAX(end_line - start_line + 1), MAX(end_line) FROM messages").fetchone()
+            conn.close()
+            print(f"{chats} chats, {file_lines} lines: look-ahead peak {peak} lines, longest message {longest_message} lines")
+            assert peak <= longest_message + 5, \
+                f"The look-ahead buffer held {peak} lines, the longest message has {longest_message}"
+    finally:
+        for path in (md_file, db_file):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("All tests passed!")
+    return True
+
+
+def test_parse_chats_workers():
+    return _compare_parse_option(['--workers', '3'], 'EXAMPLE-workers.db', 'with workers')
+
+
+def _dump_tables_by_position(db_file):
+    conn = sqlite3.connect(db_file)
+    cursor = conn.cursor()
+    chats = cursor.execute("SELECT title, chat_datetime, start_line, end_line FROM chats ORDER BY start_line").fetchall()
+    messages = cursor.execute("""
+        SELECT c.start_line, m.message_type, m.message_datetime, m.summary, m.content_type, m.content_length,
+               m.start_line, m.end_line, ct.content_text
+        FROM messages m
+        JOIN chats c ON c.id = m.chat_id
+        LEFT JOIN content ct ON ct.message_id = m.id
+        ORDER BY m.start_line, m.id
+    """).fetchall()
+    chat_stats = cursor.execute("SELECT * FROM chat_stats ORDER BY dimension, key").fetchall()
+    conn.close()
+    return chats, messages, chat_stats
+
+
+def _run_parser(md_file, db_file, *extra_args):
+    """Run parse_chats.py, failing the test if it fails, and return its output."""
+    result = subprocess.run(
+        [sys.executable, 'parse_chats.py', md_file, '--db', db_file, *extra_args],
+        capture_output=True,
+        text=True
+    )
+    assert result.returncode == 0, \
+        f"Parser failed with return code {result.returncode} ({md_file})\nSTDOUT: {result.stdout}\nSTDERR: {result.stderr}"
+    return result.stdout
+
+
+def test_parse_chats_incremental():
+    md_file = 'EXAMPLE-incremental.md'
+    edited_md_file = 'EXAMPLE-incremental-edited.md'
+    db_file = 'EXAMPLE-incremental.db'
+    fresh_db_file = 'EXAMPLE-incremental-fresh.db'
+    
+    try:
+        _write_export(md_file, chats=10, user_messages=2, seed=5)
+        for path in (db_file, fresh_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+        
+        _run_parser(md_file, db_file)
+        
+        conn = sqlite3.connect(db_file)
+        chats_before = conn.execute("SELECT id, title, start_line, end_line FROM chats ORDER BY start_line").fetchall()
+        conn.close()
+        assert len(chats_before) == 10, f"Expected 10 chats, got {len(chats_before)}"
+        
+        # Grow the second chat's first message so every later chat shifts down
+        edited_chat_id, _, edited_start, _ = chats_before[1]
+        with open(md_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        for i in range(edited_start, len(lines)):
+            if lines[i].startswith('_**'):
+                lines[i + 1:i + 1] = ['\n', 'Edited line one\n', 'Edited line two\n']
+                break
+        with open(edited_md_file, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        
+        _run_parser(edited_md_file, db_file)
+        _run_parser(edited_md_file, fresh_db_file)
+        
+        conn = sqlite3.connect(db_file)
+        chat_ids_after = {row[0] for row in conn.execute("SELECT id FROM chats")}
+        conn.close()
+        kept_ids = {chat_id for chat_id, _, _, _ in chats_before if chat_id != edited_chat_id}
+        print(f"Chats kept: {len(kept_ids & chat_ids_after)}/{len(kept_ids)}, edited chat re-parsed: {edited_chat_id not in chat_ids_after}")
+        assert kept_ids <= chat_ids_after, "Unchanged chats should keep their ids"
+        assert edited_chat_id not in chat_ids_after, "Edited chat should be re-parsed"
+        
+        expected = _dump_tables_by_position(fresh_db_file)
+        actual = _dump_tables_by_position(db_file)
+        for name, exp_rows, act_rows in zip(('chats', 'messages', 'chat_stats'), expected, actual):
+            print(f"{name}: {len(exp_rows)} rows fresh, {len(act_rows)} rows incremental")
+            assert exp_rows == act_rows, f"Incremental parse produced different {name} rows"
+    finally:
+        for path in (md_file, edited_md_file, db_file, fresh_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("All tests passed!")
+    return True
+
+
+def test_parse_chats_incremental_unclosed_fence():
+    md_file = 'EXAMPLE-fence.md'
+    db_file = 'EXAMPLE-fence.db'
+    fresh_db_file = 'EXAMPLE-fence-fresh.db'
+    
+    try:
+        _write_export(md_file, chats=3, user_messages=1, seed=5)
+        # The last agent message opens a code fence it never closes, so it runs to the end of
+        # the file even though its last line is '---'
+        with open(md_file, 'a', encoding='utf-8') as f:
+            f.write('_**Agent (model gpt-5, mode Agent)**_\n\ntext\n```\ncode unclosed\n---\n')
+        for path in (db_file, fresh_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+        _run_parser(md_file, db_file)
+        
+        with open(md_file, 'a', encoding='utf-8') as f:
+            f.write('\n_**User (2025-06-01 10:00Z)**_\n\nAn appended question\n\n---\n\n'
+                    '_**Agent (model gpt-5, mode Agent)**_\n\nAn appended answer\n\n---\n')
+        _run_parser(md_file, db_file)
+        _run_parser(md_file, fresh_db_file)
+        
+        expected = _dump_tables_by_position(fresh_db_file)
+        actual = _dump_tables_by_position(db_file)
+        for name, exp_rows, act_rows in zip(('chats', 'messages', 'chat_stats'), expected, actual):
+            print(f"{name}: {len(exp_rows)} rows fresh, {len(act_rows)} rows incremental")
+            assert exp_rows == act_rows, f"Lines appended after an unclosed fence parsed differently ({name})"
+    finally:
+        for path in (md_file, db_file, fresh_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("All tests passed!")
+    return True
+
+
+def test_parse_chats_carriage_returns():
+    md_file = 'EXAMPLE-cr.md'
+    db_files = {(): 'EXAMPLE-cr.db', ('--stream',): 'EXAMPLE-cr-stream.db',
+                ('--workers', '2'): 'EXAMPLE-cr-workers.db', ('--content-offsets',): 'EXAMPLE-cr-offsets.db'}
+    
+    try:
+        _write_export(md_file, chats=3, user_messages=2, tool_uses=2, seed=5)
+        with open(md_file, 'r', encoding='utf-8', newline='') as f:
+            lines = f.readlines()
+        # A bare '\r' ends a line in text mode, both inside a block header and between two lines
+        tool_line = next(i for i, line in enumerate(lines) if line.startswith('<details><summary>Tool use'))
+        lines[tool_line] = 'x\r' + lines[tool_line]
+        last_text = max(i for i, line in enumerate(lines) if line.endswith('now works.\n'))
+        lines[last_text:last_text + 1] = ['a\r\n', '\rb\n']
+        with open(md_file, 'w', encoding='utf-8', newline='') as f:
+            f.writelines(lines)
+        with open(md_file, 'r', encoding='utf-8') as f:
+            text_mode_lines = len(f.readlines())
+        
+        for extra_args, db_file in db_files.items():
+            if os.path.exists(db_file):
+                os.remove(db_file)
+            _run_parser(md_file, db_file, *extra_args)
+        
+        conn = sqlite3.connect(db_files[()])
+        last_end_line = conn.execute("SELECT MAX(end_line) FROM chats").fetchone()[0]
+        conn.close()
+        print(f"Lines in text mode: {text_mode_lines}, last chat ends at line {last_end_line}")
+        assert last_end_line == text_mode_lines, "Chats should end on the last line as text mode splits it"
+        
+        expected_lines = _dump_tables(db_files[()])[:2]
+        expected_content = _dump_content_by_position(db_files[()])
+        for extra_args, db_file in db_files.items():
+            print(f"{' '.join(extra_args) or 'default'}: comparing line numbers and content")
+            assert _dump_tables(db_file)[:2] == expected_lines, f"{extra_args} produced different line numbers"
+            assert _dump_content_by_position(db_file) == expected_content, f"{extra_args} produced different content"
+    finally:
+        for path in [md_file, *db_files.values()]:
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("All tests passed!")
+    return True
+
+
+def _tasks_without_ids(db_file):
+    builder = TaskBuilder(db_file)
+    try:
+        built = builder.refresh_tasks()
+        tasks = [{key: value for key, value in task.items() if key not in ('user_msg_id', 'chat_id')}
+                 for task in builder.iter_message_tasks()]
+    finally:
+        builder.close()
+    return built, tasks
+
+
+def test_stored_tasks_incremental():
+    md_file = 'EXAMPLE-synthetic.md'
+    edited_md_file = 'EXAMPLE-synthetic-edited.md'
+    db_file = 'EXAMPLE-synthetic.db'
+    fresh_db_file = 'EXAMPLE-synthetic-fresh.db'
+    
+    try:
+        _write_export(md_file, chats=20, user_messages=3, seed=3)
+        for path in (db_file, fresh_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+        _run_parser(md_file, db_file)
+        built_before, tasks_before = _tasks_without_ids(db_file)
+        assert built_before == len(tasks_before) == 60, f"The first run should build every task, built {built_before}"
+        
+        # Add an agent reply to a task in the middle; later lines shift but their messages are unchanged
+        with open(md_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        user_lines = [i for i, line in enumerate(lines) if line.startswith('_**User')]
+        lines[user_lines[30]:user_lines[30]] = ['_**Agent (model gpt-5, mode Agent)**_\n', '\n',
+                                                'An added agent reply\n', '\n', '---\n', '\n']
+        with open(edited_md_file, 'w', encoding='utf-8') as f:
+            f.writelines(lines)
+        
+        _run_parser(edited_md_file, db_file)
+        _run_parser(edited_md_file, fresh_db_file)
+        
+        rebuilt, tasks = _tasks_without_ids(db_file)
+        _, fresh_tasks = _tasks_without_ids(fresh_db_file)
+        print(f"Stored tasks: {len(tasks)}, rebuilt after the edit: {rebuilt}")
+        assert tasks == fresh_tasks, "Stored tasks should match tasks built from a fresh parse"
+        assert 0 < rebuilt <= 3, "Only tasks in the edited chat should be rebuilt"
+        assert _tasks_without_ids(db_file) == (0, tasks), "Unchanged messages should rebuild no tasks"
+        
+        builder = TaskBuilder(db_file)
+        try:
+            fields = ('user_timestamp', 'total_content_length', 'agent_timestamps')
+            partial = list(builder.iter_message_tasks(fields=fields))
+        finally:
+            builder.close()
+        assert [sorted(task) for task in partial] == [sorted(('user_msg_id',) + fields)] * len(tasks), \
+            "Tasks read with some fields should hold only those fields"
+        assert [{name: task[name] for name in fields} for task in partial] == \
+            [{name: task[name] for name in fields} for task in tasks], "Partial tasks should match full tasks"
+        assert 'formatted_text' not in partial[0] and partial[0].get('formatted_text') is None
+    finally:
+        for path in (md_file, edited_md_file, db_file, fresh_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("All tests passed!")
+    return True
+
+
+def _dump_content_by_position(db_file):
+    conn = sqlite3.connect(db_file)
+    reader = ContentReader(conn)
+    rows = [(start_line, reader.get_text(message_id)) for message_id, start_line in
+            conn.execute("SELECT id, start_line FROM messages ORDER BY start_line, id").fetchall()]
+    reader.close()
+    conn.close()
+    return rows
+
+
+def _compare_content_storage(option, storage_db_file, stored_rows_query, storage_name):
+    """Parse with a content storage option, re-parse an edited file and compare content with inline storage."""
+    md_file = 'EXAMPLE-storage.md'
+    edited_md_file = 'EXAMPLE-storage-edited.md'
+    db_file = 'EXAMPLE-storage.db'
+    
+    try:
+        _write_export(md_file, chats=10, user_messages=2, tool_uses=3, thinks=1, seed=9)
+        for path in (db_file, storage_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+        _run_parser(md_file, storage_db_file, option)
+        
+        # Prepend a chat so every stored chat moves on the incremental re-parse
+        with open(md_file, 'r', encoding='utf-8') as f:
+            lines = f.readlines()
+        with open(edited_md_file, 'w', encoding='utf-8') as f:
+            f.writelines(['# Prepended chat (2020-01-01 00:00Z)\n', '\n', '_**User (2020-01-01 00:00Z)**_\n', '\n',
+                          'Prepended question\n', '\n', '---\n', '\n'] + lines)
+        
+        _run_parser(edited_md_file, storage_db_file, option)
+        _run_parser(edited_md_file, db_file)
+        
+        conn = sqlite3.connect(storage_db_file)
+        stored_rows = conn.execute(stored_rows_query).fetchone()[0]
+        conn.close()
+        print(f"Content rows stored {storage_name}: {stored_rows}")
+        assert stored_rows > 0, f"Content should be stored {storage_name}"
+        
+        expected = _dump_content_by_position(db_file)
+        actual = _dump_content_by_position(storage_db_file)
+        print(f"content: {len(expected)} messages inline, {len(actual)} messages stored {storage_name}")
+        assert expected == actual, f"Content stored {storage_name} differs from inline content"
+    finally:
+        for path in (md_file, edited_md_file, db_file, storage_db_file):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("All tests passed!")
+    return True
+
+
+def test_parse_chats_content_offsets():
+    return _compare_content_storage('--content-offsets', 'EXAMPLE-offsets.db',
+                                    "SELECT COUNT(*) FROM content WHERE source_offset IS NOT NULL", 'as offsets')
+
+
+def test_parse_chats_compressed_content():
+    return _compare_content_storage('--compress-content', 'EXAMPLE-compressed.db',
+                                    "SELECT COUNT(*) FROM content WHERE typeof(content_text) = 'blob'", 'compressed')
+
+
+def test_parse_chats_synthetic():
+    md_file = 'EXAMPLE-synthetic.md'
+    db_file = 'EXAMPLE-synthetic.db'
+    
+    try:
+        counts = _write_export(md_file, chats=50, user_messages=2, tool_uses=4, thinks=1, texts=2, seed=7)
+        if os.path.exists(db_file):
+            os.remove(db_file)
+        _run_parser(md_file, db_file)
+        
+        conn = sqlite3.connect(db_file)
+        chats = conn.execute("SELECT COUNT(*) FROM chats").fetchone()[0]
+        message_counts = dict(conn.execute("SELECT message_type, COUNT(*) FROM messages GROUP BY message_type"))
+        content_counts = dict(conn.execute("SELECT content_type, COUNT(*) FROM messages GROUP BY content_type"))
+        conn.close()
+        print(f"Generated {counts['chats']} chats, {counts['user_messages']} user and {counts['agent_messages']} agent messages; "
+              f"parsed {chats} chats, {message_counts}")
+        assert chats == counts['chats'], "Every generated chat should be parsed"
+        assert message_counts.get('User') == counts['user_messages'], "Every generated user message should be parsed"
+        assert message_counts.get('Agent') == counts['agent_messages'], "Every generated agent block should be a message"
+        assert content_counts.get('tool_call') == counts['tool_uses'], "Every tool-use block should be a tool_call"
+        assert content_counts.get('think') == counts['thinks'], "Every think block should be a think message"
+    finally:
+        for path in (md_file, db_file):
+            if os.path.exists(path):
+                os.remove(path)
+    
+    print("All tests passed!")
+    return True
+
+
 if __name__ == '__main__':
-    success = test_parse_chats()
+    success = (test_parse_chats() and test_parse_chats_streaming() and test_parse_chats_workers() and
+               test_parse_chats_incremental() and test_parse_chats_incremental_unclosed_fence() and
+               test_parse_chats_carriage_returns() and test_stored_tasks_incremental() and
+               test_parse_chats_content_offsets() and test_parse_chats_compressed_content() and
+               test_parse_chats_synthetic())
     sys.exit(0 if success else 1)
-
@@ -3,6 +3,8 @@ import sqlite3
 import subprocess
 import sys
 import os
+import csv
+import tempfile
 
 
 def test_parse_usage():
@@ -60,12 +62,118 @@ def test_parse_usage():
     has_tps = any('TPS' in line for line in output_lines)
     assert has_tps, "Output should contain TPS statistics"
     
+    has_percentiles = any('p95 TPS' in line for line in output_lines)
+    assert has_percentiles, "Output should contain percentile TPS statistics"
+    
     conn.close()
     print("All tests passed!")
     return True
 
 
+def _run_usage_parser(args):
+    result = subprocess.run([sys.executable, 'parse_usage.py'] + args, capture_output=True, text=True)
+    if result.returncode != 0:
+        print(f"ERROR: Parser failed with return code {result.returncode}")
+        print(f"STDOUT: {result.stdout}")
+        print(f"STDERR: {result.stderr}")
+    return result
+
+
+def test_parse_usage_multiple_files():
+    with open('EXAMPLE.csv', 'r', encoding='utf-8', newline='') as f:
+        records = list(csv.reader(f))
+    header, records = records[0], records[1:]
+    third = len(records) // 3
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_dir = os.path.join(tmpdir, 'usage')
+        os.mkdir(csv_dir)
+        # Overlapping exports, the last one older than the others
+        for name, part in (('a.csv', records[:2 * third]), ('b.csv', records[third:]), ('c.csv', records[:third])):
+            with open(os.path.join(csv_dir, name), 'w', encoding='utf-8', newline='') as f:
+                writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+                writer.writerow(header)
+                writer.writerows(part)
+        
+        single_db = os.path.join(tmpdir, 'single.db')
+        multi_db = os.path.join(tmpdir, 'multi.db')
+        if _run_usage_parser(['EXAMPLE.csv', '--db-file', single_db]).returncode != 0:
+            return False
+        result = _run_usage_parser([csv_dir, '--db-file', multi_db, '--workers', '2'])
+        if result.returncode != 0:
+            return False
+        
+        query = "SELECT date, kind, model, total_tokens, cost FROM usage ORDER BY timestamp, date, kind, model"
+        conn = sqlite3.connect(single_db)
+        expected = conn.execute(query).fetchall()
+        conn.close()
+        conn = sqlite3.connect(multi_db)
+        loaded = conn.execute(query).fetchall()
+        sources = conn.execute("SELECT COUNT(*) FROM usage_sources").fetchone()[0]
+        version = conn.execute("SELECT version FROM usage_version").fetchone()[0]
+        triggers = conn.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'trigger' AND name LIKE 'usage_version_%'").fetchone()[0]
+        conn.close()
+        print(f"Usage records: {len(loaded)} from 3 files, {len(expected)} from EXAMPLE.csv")
+        assert loaded == expected, "Overlapping files should load the same records as the whole export"
+        assert sources == 3, f"Expected 3 usage sources, got {sources}"
+        assert 'repeated across files' in result.stdout, "Output should report records repeated across files"
+        assert version == 1, f"Loading the files should bump the usage version once, got {version}"
+        assert triggers == 3, "The usage_version triggers should be restored after loading"
+        
+        result = _run_usage_parser([os.path.join(csv_dir, '*.csv'), '--db-file', multi_db])
+        if result.returncode != 0:
+            return False
+        assert 'Skipping 3 CSV files unchanged' in result.stdout, "Unchanged files should not be parsed again"
+        assert 'No new records to add' in result.stdout, "Re-running on the same files should add nothing"
+        
+        conn = sqlite3.connect(multi_db)
+        assert conn.execute("SELECT version FROM usage_version").fetchone()[0] == 1, "Loading nothing should keep the version"
+        conn.execute("DELETE FROM usage WHERE id IN (SELECT id FROM usage LIMIT 2)")
+        conn.commit()
+        assert conn.execute("SELECT version FROM usage_version").fetchone()[0] == 3, "Other writes should bump the version per row"
+        conn.close()
+    
+    print("All tests passed!")
+    return True
+
+
+def test_parse_usage_malformed_rows():
+    with open('EXAMPLE.csv', 'r', encoding='utf-8', newline='') as f:
+        records = list(csv.reader(f))
+    header = records[0]
+    
+    with tempfile.TemporaryDirectory() as tmpdir:
+        csv_file = os.path.join(tmpdir, 'usage.csv')
+        # A footer row without a date and with text in the token and cost columns
+        footer = ['Total'] + [''] * (len(header) - 1)
+        for name, value in (('Input (w/ Cache Write)', 'abc'), ('Cost', 'n/a')):
+            footer[header.index(name)] = value
+        with open(csv_file, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+            writer.writerows(records + [footer])
+        
+        expected_db = os.path.join(tmpdir, 'expected.db')
+        db_file = os.path.join(tmpdir, 'usage.db')
+        if _run_usage_parser(['EXAMPLE.csv', '--db-file', expected_db]).returncode != 0:
+            return False
+        result = _run_usage_parser([csv_file, '--db-file', db_file])
+        assert result.returncode == 0, f"A malformed trailing row should be skipped: {result.stderr}"
+        
+        query = "SELECT date, kind, model, total_tokens, cost FROM usage ORDER BY timestamp, date, kind, model"
+        conn = sqlite3.connect(expected_db)
+        expected = conn.execute(query).fetchall()
+        conn.close()
+        conn = sqlite3.connect(db_file)
+        loaded = conn.execute(query).fetchall()
+        conn.close()
+        print(f"Usage records: {len(loaded)} with a malformed trailing row, {len(expected)} without")
+        assert loaded == expected, "The malformed row should be dropped and every other row loaded"
+    
+    print("All tests passed!")
+    return True
+
+
 if __name__ == '__main__':
-    success = test_parse_usage()
+    success = test_parse_usage() and test_parse_usage_multiple_files() and test_parse_usage_malformed_rows()
     sys.exit(0 if success else 1)
 
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+import os
+import json
+import struct
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
+import numpy as np
+
+
+# Numeric usage columns kept in the cache, with their dtypes; rows are sorted by timestamp
+CACHE_COLUMNS = (
+    ('id', np.int64),
+    ('timestamp', np.float64),
+    ('input_with_cache_write', np.int64),
+    ('input_without_cache_write', np.int64),
+    ('cache_read', np.int64),
+    ('output_tokens', np.int64),
+    ('total_tokens', np.int64),
+    ('cost', np.float64),
+)
+TOKEN_COLUMNS = ('input_with_cache_write', 'input_without_cache_write', 'cache_read', 'output_tokens', 'total_tokens')
+CATEGORY_COLUMNS = ('kind', 'model')
+
+CACHE_FORMAT_VERSION = 1
+# Columns start at multiples of this many bytes so every memory-mapped array is aligned
+ALIGNMENT = 64
+
+
+USAGE_VERSION_EVENTS = ('INSERT', 'UPDATE', 'DELETE')
+
+
+def create_usage_version_table(cursor: sqlite3.Cursor):
+    """Create the usage_version row and the triggers that bump it on every change to usage.
+    
+    The token is random per database, so a cache written for another database
+    with the same version number is never mistaken for a valid one. The
+    triggers catch writes made outside usage_transaction(), which bumps the
+    version once instead.
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS usage_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            token TEXT,
+            version INTEGER
+        )
+    """)
+    cursor.execute("INSERT OR IGNORE INTO usage_version (id, token, version) VALUES (1, lower(hex(randomblob(8))), 0)")
+    _create_usage_version_triggers(cursor)
+
+
+def _create_usage_version_triggers(cursor: sqlite3.Cursor):
+    for event in USAGE_VERSION_EVENTS:
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS usage_version_{event.lower()} AFTER {event} ON usage
+            BEGIN
+                UPDATE usage_version SET version = version + 1 WHERE id = 1;
+            END
+        """)
+
+
+@contextmanager
+def usage_transaction(conn: sqlite3.Connection):
+    """Change usage in one transaction that bumps usage_version once, not once per row.
+    
+    The per-row triggers are dropped inside the transaction and created again
+    before it commits, so other connections never see usage without them and
+    a rollback restores them.
+    
+    Args:
+        conn: Connection to a database with usage and usage_version tables
+    
+    Yields:
+        Cursor of the transaction
+    """
+    cursor = conn.cursor()
+    if not conn.in_transaction:
+        cursor.execute("BEGIN")
+    try:
+        for event in USAGE_VERSION_EVENTS:
+            cursor.execute(f"DROP TRIGGER IF EXISTS usage_version_{event.lower()}")
+        yield cursor
+        cursor.execute("UPDATE usage_version SET version = version + 1 WHERE id = 1")
+        _create_usage_version_triggers(cursor)
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+
+
+def usage_cache_path(conn: sqlite3.Connection) -> Optional[str]:
+    """Path of the usage cache next to the connection's main database file, None for in-memory databases."""
+    for _, name, file_path in conn.execute("PRAGMA database_list"):
+        if name == 'main':
+            return f"{file_path}.usage-cache" if file_path else None
+    return None
+
+
+class UsageColumns:
+    """Columnar, read-only copy of the usage table as NumPy arrays sorted by timestamp.
+    
+    Numeric columns are in CACHE_COLUMNS; kind and model are stored as int32
+    codes into the kinds and models lists. load() memory-maps the cache file
+    written next to the database and rebuilds it when the usage_version row
+    shows that usage changed since the cache was written.
+    """
+    
+    def __init__(self, columns: Dict[str, np.ndarray], categories: Dict[str, List[Optional[str]]]):
+        self.columns = columns
+        self.categories = categories
+    
+    def __len__(self) -> int:
+        return len(self.columns['id'])
+    
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+    
+    def tokens(self) -> np.ndarray:
+        """Token columns as an (n, 5) int64 matrix in TOKEN_COLUMNS order."""
+        if not len(self):
+            return np.empty((0, len(TOKEN_COLUMNS)), dtype=np.int64)
+        return np.column_stack([self.columns[name] for name in TOKEN_COLUMNS])
+    
+    def rows(self) -> List[Tuple]:
+        """Rows as (id, timestamp, <TOKEN_COLUMNS>, kind, model) tuples in timestamp order."""
+        values = [self.columns[name].tolist() for name in ('id', 'timestamp') + TOKEN_COLUMNS]
+        for name in CATEGORY_COLUMNS:
+            labels = self.categories[name]
+            values.append([labels[code] for code in self.columns[f"{name}_code"].tolist()])
+        return list(zip(*values))
+    
+    @classmethod
+    def load(cls, conn: sqlite3.Connection) -> 'UsageColumns':
+        """Load the usage table from the cache file, rebuilding the cache if usage changed.
+        
+        Args:
+            conn: Connection to a database with a usage table
+        
+        Returns:
+            UsageColumns backed by the memory-mapped cache (or by plain arrays
+            for in-memory databases)
+        """
+        cursor = conn.cursor()
+        create_usage_version_table(cursor)
+        conn.commit()
+        token, version = cursor.execute("SELECT token, version FROM usage_version WHERE id = 1").fetchone()
+        path = usage_cache_path(conn)
+        if path is None:
+            return cls._build(conn)
+        if os.path.exists(path):
+            cached = cls._read(path, token, version)
+            if cached is not None:
+                return cached
+        usage = cls._build(conn)
+        usage._write(path, token, version)
+        return cls._read(path, token, version)
+    
+    @classmethod
+    def _build(cls, conn: sqlite3.Connection) -> 'UsageColumns':
+        names = [name for name, _ in CACHE_COLUMNS]
+        selected = ', '.join(name if name in ('id', 'timestamp') else f"COALESCE({name}, 0)" for name in names)
+        rows = conn.execute(f"""
+            SELECT {selected}, {', '.join(CATEGORY_COLUMNS)} FROM usage ORDER BY timestamp, id
+        """).fetchall()
+        values = list(zip(*rows)) if rows else [()] * (len(names) + len(CATEGORY_COLUMNS))
+        columns = {name: np.array(column, dtype=dtype) for (name, dtype), column in zip(CACHE_COLUMNS, values)}
+        categories = {}
+        for name, column in zip(CATEGORY_COLUMNS, values[len(names):]):
+            codes = {}
+            columns[f"{name}_code"] = np.array([codes.setdefault(value, len(codes)) for value in column],
+                                               dtype=np.int32)
+            categories[name] = list(codes)
+        return cls(columns, categories)
+    
+    def _write(self, path: str, token: str, version: int):
+        """Write the cache atomically: a JSON header followed by each column's raw bytes."""
+        layout = []
+        offset = 0
+        for name, array in self.columns.items():
+            layout.append({'name': name, 'dtype': array.dtype.str, 'offset': offset})
+            offset += -(-array.nbytes // ALIGNMENT) * ALIGNMENT
+        header = json.dumps({'format': CACHE_FORMAT_VERSION, 'token': token, 'version': version, 'rows': len(self),
+                             'columns': layout, 'categories': self.categories}).encode('utf-8')
+        data_start = -(-(8 + len(header)) // ALIGNMENT) * ALIGNMENT
+        tmp_path = f"{path}.tmp{os.getpid()}"
+        with open(tmp_path, 'wb') as f:
+            f.write(struct.pack('<Q', len(header)) + header)
+            for column, array in zip(layout, self.columns.values()):
+                f.seek(data_start + column['offset'])
+                f.write(np.ascontiguousarray(array).tobytes())
+            f.truncate(data_start + offset)
+        os.replace(tmp_path, path)
+    
+    @classmethod
+    def _read(cls, path: str, token: str, version: int) -> Optional['UsageColumns']:
+        """Memory-map a cache file, or return None if it is stale or unreadable."""
+        try:
+            with open(path, 'rb') as f:
+                header_length = struct.unpack('<Q', f.read(8))[0]
+                header = json.loads(f.read(header_length))
+        except (OSError, ValueError, struct.error):
+            return None
+        if (header.get('format'), header.get('token'), header.get('version')) != (CACHE_FORMAT_VERSION, token, version):
+            return None
+        data_start = -(-(8 + header_length) // ALIGNMENT) * ALIGNMENT
+        rows = header['rows']
+        columns = {}
+        for column in header['columns']:
+            dtype = np.dtype(column['dtype'])
+            if rows == 0:
+                columns[column['name']] = np.empty(0, dtype=dtype)
+            else:
+                columns[column['name']] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + column['offset'],
+                                                    shape=(rows,))
+        return cls(columns, header['categories'])